@@ -6,8 +6,15 @@ import replicate
 import asyncio
 import requests  # Added for downloading videos
 import re  # For safe filename
+import sys
 from datetime import datetime  # For timestamped run folders
 
+# Platform exports and the project catalog are shared with the Streamlit app
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "streamlit"))
+from catalog import Catalog
+from media import ffmpeg_available
+from postprocess import PLATFORM_PRESETS, export_project
+
 load_dotenv()
 
 # Function to load JSON from file or input
@@ -28,16 +35,6 @@ def load_scenes_json():
             print("Invalid JSON. Please provide a valid JSON file path or JSON string.")
             return None
 
-# Load scenes from JSON
-print("Loading scenes from JSON...")
-data = load_scenes_json()
-
-if not data or 'scenes' not in data:
-    print("Error: Invalid JSON format. Expected JSON with 'scenes' array.")
-    exit(1)
-
-print(f"Loaded {len(data['scenes'])} scenes from JSON")
-
 # Ensure output directory exists for each run
 def ensure_output_dir():
     base_dir = 'final_videos'
@@ -126,7 +123,32 @@ async def generate_scene(scene, idx, output_dir):
 
     return final_video
 
-async def main():
+def load_storyboard():
+    """Load scenes from JSON; exits when the JSON has no scenes"""
+    print("Loading scenes from JSON...")
+    data = load_scenes_json()
+
+    if not data or 'scenes' not in data:
+        print("Error: Invalid JSON format. Expected JSON with 'scenes' array.")
+        exit(1)
+
+    print(f"Loaded {len(data['scenes'])} scenes from JSON")
+    return data
+
+def export_run(output_dir):
+    """Export the downloaded scenes and the final cut for TikTok, Reels and Shorts, as the app does after saving"""
+    if not ffmpeg_available():
+        print("\nInstall ffmpeg to export the scenes for TikTok, Reels and Shorts.")
+        return
+    names = ", ".join(preset["name"] for preset in PLATFORM_PRESETS.values())
+    print(f"\nExporting for {names}...")
+    summary = export_project(output_dir)
+    print(f"{summary['exported']} exported ({summary['copied']} by stream copy), {summary['skipped']} unchanged, "
+          f"{len(summary['failed'])} failed")
+    for relative, error in summary["failed"]:
+        print(f"  {relative}: {error}")
+
+async def main(data):
     """Main function to generate all scenes in parallel"""
     output_dir = ensure_output_dir()
     print(f"Starting generation of {len(data['scenes'])} scenes in parallel...")
@@ -151,6 +173,12 @@ async def main():
     for i, final_video in enumerate(results):
         print(f"{final_video}")
 
+    export_run(output_dir)
+    # The run shows up in the app's Saved Projects right away, with its scene prompts searchable.
+    # Cataloged after the export, which adds exports/ and so changes the directory the catalog compares
+    Catalog().add_project(output_dir, data)
+
 # Run the async main function
+# (the scenes are loaded here, not on import, because the export's worker processes may import this file)
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main(load_storyboard()))
\ No newline at end of file
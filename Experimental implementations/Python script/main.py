@@ -4,6 +4,7 @@ from dotenv import load_dotenv
 import json
 import replicate
 import asyncio
+import time
 
 load_dotenv()
 
@@ -16,7 +17,7 @@ system_prompt = """
 You are *Viral Short-Form Story & Prompt Architect*.
 
 GOAL  
-Produce 10 sequential scenes (≤60 s total) that show a “day in the life” for this POV: "{pov}".  
+Produce 10 sequential scenes (≤60 s total) that show a “day in the life” for the POV given in the input.  
 Every scene must grip short form viewers in terms of visuals, audio, and motion.
 
 ──────────────── STORY AXIOMS ────────────────  
@@ -113,15 +114,93 @@ RULES
 - Technical limitations: The image prompt only makes the starting frame of the video and the video generator only makes one shot for each image, it can't have way too many changes. 
 """
 
-response = openai_client.responses.create(
-    model="gpt-4.1",
-    instructions=system_prompt,
-    input=pov,
-)
+SCENE_FIELDS = ["scene", "scene_image_prompt", "scene_video_prompt", "scene_sound_prompt"]
 
-cleaned_text = response.output_text.replace("```json", "").replace("```", "")
+
+def json_schema_format(name, fields, as_storyboard=False):
+    """Structured output format for a scene (or a storyboard of scenes) with the given fields"""
+    scene_schema = {
+        "type": "object",
+        "properties": {field: {"type": "string"} for field in fields},
+        "required": fields,
+        "additionalProperties": False,
+    }
+    schema = scene_schema
+    if as_storyboard:
+        schema = {
+            "type": "object",
+            "properties": {"scenes": {"type": "array", "items": scene_schema}},
+            "required": ["scenes"],
+            "additionalProperties": False,
+        }
+    return {"format": {"type": "json_schema", "name": name, "schema": schema, "strict": True}}
+
+
+def request(input_text, text_format):
+    """Call the model with the static system prompt first so the prefix can be cached"""
+    started = time.time()
+    response = openai_client.responses.create(
+        model="gpt-4.1",
+        instructions=system_prompt,
+        input=input_text,
+        text=text_format,
+        extra_body={"prompt_cache_key": "flowly-pov-storyboard-v1"},
+    )
+    usage = response.usage
+    cached_tokens = getattr(usage.input_tokens_details, "cached_tokens", 0) if usage.input_tokens_details else 0
+    print(f"Tokens: prompt={usage.input_tokens} cached={cached_tokens} "
+          f"completion={usage.output_tokens} latency={time.time() - started:.1f}s")
+    return response.output_text.replace("```json", "").replace("```", "").strip()
+
+
+def parse_scenes(text):
+    """Parse the storyboard, keeping whatever complete scene objects survive a broken response"""
+    try:
+        return json.loads(text)["scenes"]
+    except (json.JSONDecodeError, KeyError, TypeError):
+        decoder = json.JSONDecoder()
+        scenes = []
+        position = text.find("[") + 1
+        while position > 0:
+            start = text.find("{", position)
+            if start == -1:
+                break
+            try:
+                scene, position = decoder.raw_decode(text, start)
+            except json.JSONDecodeError:
+                break
+            scenes.append(scene)
+        return scenes
+
+
+cleaned_text = request(pov, json_schema_format("storyboard", SCENE_FIELDS, as_storyboard=True))
 print(cleaned_text)
-data = json.loads(cleaned_text)
+scenes = parse_scenes(cleaned_text)
+if not scenes:
+    print("Error: the storyboard response could not be parsed.")
+    exit(1)
+
+# Re-request only the fields a scene is missing instead of the whole storyboard
+first_try = True
+for idx, scene in enumerate(scenes):
+    missing = [field for field in SCENE_FIELDS if not str(scene.get(field, "")).strip()]
+    if not missing:
+        continue
+    first_try = False
+    print(f"Scene {idx+1} is missing {missing}, re-requesting...")
+    context = json.dumps({"scenes": scenes}, indent=2)
+    reply = request(
+        f"POV: {pov}\n\nSTORYBOARD SO FAR:\n{context}\n\nWrite only these fields for scene {idx+1}: {', '.join(missing)}.",
+        json_schema_format("scene_fields", missing),
+    )
+    try:
+        fixed = json.loads(reply)
+        scene.update({field: fixed[field] for field in missing})
+    except (json.JSONDecodeError, KeyError, TypeError) as e:
+        print(f"Error: scene {idx+1} could not be repaired ({e!r}): {reply[:200]}")
+        exit(1)
+print(f"Storyboard valid on first try: {first_try}")
+data = {"scenes": scenes}
 
 
 async def _generate_image(prompt):
@@ -3,14 +3,39 @@ import os
 from openai import OpenAI
 from dotenv import load_dotenv
 import json
-import replicate
 import asyncio
+from concurrent.futures import CancelledError
 import requests
 import re
+import random
+import html
+import time
 from datetime import datetime
 import tempfile
-import shutil
+import uuid
+from functools import partial
 from pathlib import Path
+from generation import _generate_image, _generate_video, _generate_sound, _generate_audio, model_name, output_models
+from generation_service import GenerationService
+from state_backend import (open_backend, project_version, save_project_state, load_project_state,
+                           next_result_version, save_stage_result, results_version, load_stage_result)
+from manifest import load_manifest, is_current, write_json_atomic, write_text_atomic
+from media import ffmpeg_available, mux_audio
+from persistence import fetch, persist, record_saved, wait_for
+from postprocess import PLATFORM_PRESETS, export_project
+from loudness import TARGET_LOUDNESS, master_project
+from prompt_index import DEFAULT_THRESHOLD, get_index
+from phash_index import ShotIndex, file_hashes, shot_files
+from catalog import Catalog
+from blob_store import BlobStore, ingest_project
+from zip_export import download_url
+from regen_queue import RegenerationQueue, Superseded
+from profiler import profiled, section, profile_rerun, frame_table, folded_stacks
+from models import MODEL_REGISTRY, ROUTING_POLICIES, QUALITY_LEVELS, SCENE_DURATION, get_router
+from storyboard import (TOPIC_PROMPTS, MODEL_EXAMPLES, build_topic_prompt, request_storyboard,
+                        request_storyboard_two_phase, request_storyboard_long_form, rewrite_scene_prompts,
+                        LONG_FORM_DEFAULT_SCENES)
+import metrics
 
 # Load environment variables
 load_dotenv()
@@ -192,9 +217,54 @@ footer {
 </style>
 """, unsafe_allow_html=True)
 
+# One generation service per server process, shared by every session
+@st.cache_resource
+def get_generation_service():
+    return GenerationService()
+
+# Latest regeneration request of every scene stage in every session; superseded ones are cancelled
+@st.cache_resource
+def get_regeneration_queue():
+    return RegenerationQueue(get_generation_service().cancel)
+
+# Project state lives in a backend every replica can reach
+@st.cache_resource
+def get_state_backend():
+    return open_backend()
+
+# Perceptual hashes of every saved scene image, brought up to date once per server process
+@st.cache_resource
+def get_shot_index():
+    index = ShotIndex()
+    index.update()
+    return index
+
+# Catalog of saved projects, brought up to date with final_videos/ once per server process
+@st.cache_resource
+def get_catalog():
+    catalog = Catalog()
+    catalog.scan()
+    return catalog
+
+# Content-addressed store that saved projects hardlink into; blobs no project uses any more are collected on startup
+@st.cache_resource
+def get_blob_store():
+    store = BlobStore()
+    store.gc()
+    return store
+
 # Initialize session state
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex  # identifies this session in the shared generation queue
+
+if "profiling" not in st.session_state:
+    st.session_state.profiling = os.getenv("FLOWLY_PROFILE", "") not in ("", "0")
+
+if "profile_history" not in st.session_state:
+    st.session_state.profile_history = []  # rolling summaries of profiled reruns
+
 if "current_step" not in st.session_state:
-    st.session_state.current_step = 0  # 0: input, 1: storyboard view with progressive content
+    st.session_state.current_step = 0  # 0: input, 1: storyboard view with progressive content, 2: saved projects
 
 if "initial_prompt" not in st.session_state:
     st.session_state.initial_prompt = ""
@@ -202,12 +272,33 @@ if "initial_prompt" not in st.session_state:
 if "selected_format" not in st.session_state:
     st.session_state.selected_format = "conspiracy"
 
+if "two_phase_storyboard" not in st.session_state:
+    st.session_state.two_phase_storyboard = False
+
+if "long_form_storyboard" not in st.session_state:
+    st.session_state.long_form_storyboard = False
+
+if "long_form_scenes" not in st.session_state:
+    st.session_state.long_form_scenes = LONG_FORM_DEFAULT_SCENES
+
 if "custom_topic_prompts" not in st.session_state:
     st.session_state.custom_topic_prompts = {}
 
 if "show_advanced_settings" not in st.session_state:
     st.session_state.show_advanced_settings = False
 
+if "grid_page" not in st.session_state:
+    st.session_state.grid_page = 0  # page of the storyboard grid being shown
+
+if "grid_page_size" not in st.session_state:
+    st.session_state.grid_page_size = 12  # scene cards per page
+
+if "project_search" not in st.session_state:
+    st.session_state.project_search = ""  # full-text search of the saved projects list
+
+if "project_list_page" not in st.session_state:
+    st.session_state.project_list_page = 0
+
 if "generation_mode" not in st.session_state:
     st.session_state.generation_mode = "all_at_once"  # "all_at_once" or "one_by_one"
 
@@ -229,6 +320,54 @@ if "scene_data" not in st.session_state:
 if "project_dir" not in st.session_state:
     st.session_state.project_dir = None
 
+if "project_id" not in st.session_state:
+    st.session_state.project_id = None  # key of this project in the state backend, also in ?project=
+
+if "state_version" not in st.session_state:
+    st.session_state.state_version = 0
+
+if "results_version" not in st.session_state:
+    st.session_state.results_version = 0  # render results of the project in the backend this session has looked at
+
+if "last_storyboard_usage" not in st.session_state:
+    st.session_state.last_storyboard_usage = None
+
+if "render_quality" not in st.session_state:
+    st.session_state.render_quality = "final"  # "draft" or "final"
+
+if "sound_mode" not in st.session_state:
+    st.session_state.sound_mode = "video_to_audio"  # "video_to_audio" or "text_to_audio"
+
+if "routing_policy" not in st.session_state:
+    st.session_state.routing_policy = get_router("image").policy  # this session's model routing
+
+if "routing_models" not in st.session_state:
+    st.session_state.routing_models = {stage: list(get_router(stage).models) for stage in MODEL_REGISTRY}
+
+if "prompt_cache_enabled" not in st.session_state:
+    st.session_state.prompt_cache_enabled = True  # offer similar earlier outputs before generating
+
+if "prompt_cache_threshold" not in st.session_state:
+    st.session_state.prompt_cache_threshold = DEFAULT_THRESHOLD
+
+if "shot_suggestions" not in st.session_state:
+    st.session_state.shot_suggestions = True  # offer saved shots whose image looks like the scene's image
+
+if "normalize_loudness" not in st.session_state:
+    st.session_state.normalize_loudness = True  # gain every scene to the same loudness after saving
+
+if "target_loudness" not in st.session_state:
+    st.session_state.target_loudness = TARGET_LOUDNESS
+
+if "platform_exports" not in st.session_state:
+    st.session_state.platform_exports = list(PLATFORM_PRESETS)  # platforms exported after every save
+
+if "regenerations" not in st.session_state:
+    st.session_state.regenerations = {}  # "index:stage" -> latest queued regeneration request
+
+if "persist_outputs" not in st.session_state:
+    st.session_state.persist_outputs = True  # download outputs to the project directory in the background as they finish
+
 # Helper functions for scene state management
 def initialize_scene_states(scenes):
     """Initialize scene states for each scene"""
@@ -251,12 +390,89 @@ def initialize_scene_states(scenes):
             "scene_sound_prompt": scene["scene_sound_prompt"],
             "generated_image": None,
             "generated_video": None,
-            "generated_sound": None
+            "generated_sound": None,
+            # Text-to-audio track muxed into the final video when sound runs alongside the video
+            "generated_audio": None,
+            # Render quality of each generated stage, draft approval and the image seed reused when finalizing
+            "quality": {"image": None, "video": None, "sound": None},
+            "approved": False,
+            "seed": random.randint(0, 2**31 - 1),
+            # Background download of each stage output: {"url": ..., "path": ..., "future": ...}
+            "local_files": {}
         }
         
         st.session_state.scene_states.append(scene_state)
         st.session_state.scene_data.append(scene_data)
 
+# Session state keys stored in the state backend
+PROJECT_STATE_KEYS = ["storyboard_data", "scene_states", "scene_data", "project_dir",
+                      "initial_prompt", "selected_format", "current_step"]
+
+def start_project():
+    """Give a new storyboard its own project id and directory"""
+    st.session_state.project_id = uuid.uuid4().hex[:12]
+    st.session_state.project_dir = None
+    # Renders queued for the previous project's scenes are not applied to this one
+    st.session_state.regenerations = {}
+    st.session_state.results_version = 0
+    st.query_params["project"] = st.session_state.project_id
+    store_project_state()
+
+def store_project_state():
+    """Write this project's state to the backend so other replicas can serve it"""
+    if not st.session_state.project_id:
+        return
+    state = {key: st.session_state[key] for key in PROJECT_STATE_KEYS}
+    # Background downloads belong to this process; only the files they produce are shared
+    state["scene_data"] = [{**scene_data, "local_files": {}} for scene_data in state["scene_data"]]
+    # Skip the write (and the version bump) when nothing changed since the last one
+    serialized = json.dumps(state, sort_keys=True)
+    if serialized == st.session_state.get("stored_project_state"):
+        return
+    st.session_state.state_version = save_project_state(get_state_backend(), st.session_state.project_id, state)
+    st.session_state.stored_project_state = serialized
+
+def restore_project_state(project_id):
+    """Load a project from the backend into the session; returns False when it is unknown"""
+    state, version = load_project_state(get_state_backend(), project_id)
+    if state is None:
+        return False
+    for key in PROJECT_STATE_KEYS:
+        if key in state:
+            st.session_state[key] = state[key]
+    st.session_state.project_id = project_id
+    st.session_state.state_version = version
+    st.session_state.results_version = 0
+    st.session_state.stored_project_state = json.dumps(state, sort_keys=True)
+    return True
+
+def sync_project_state():
+    """Pick up the project named in the URL, or newer state written by another replica"""
+    project_id = st.query_params.get("project")
+    if not project_id:
+        return
+    if project_id != st.session_state.project_id:
+        if not restore_project_state(project_id):
+            st.warning(f"Project {project_id} was not found.")
+            del st.query_params["project"]
+            return
+    elif project_version(get_state_backend(), project_id) > st.session_state.state_version:
+        restore_project_state(project_id)
+    apply_stored_results(project_id)
+
+def apply_stored_results(project_id):
+    """Apply render results stored by any replica (or before a restart) since this session last looked"""
+    backend = get_state_backend()
+    version = results_version(backend, project_id)
+    if version == st.session_state.results_version:
+        return
+    st.session_state.results_version = version
+    for index in range(len(st.session_state.scene_data)):
+        for stage in CACHE_KEYS:
+            result = load_stage_result(backend, project_id, index, stage)
+            if result:
+                apply_stage_result(index, stage, result)
+
 def get_scene_state(index):
     """Get scene state for a specific scene"""
     if index < len(st.session_state.scene_states):
@@ -304,50 +520,25 @@ def reset_from_step(index, step):
         update_scene_state(index, "sound_generated", False)
     
     elif step == "sound":
-        # Reset sound only
+        # Reset sound only (including the text-to-audio track, which is otherwise reused)
         update_scene_data(index, "generated_sound", None)
+        update_scene_data(index, "generated_audio", None)
         update_scene_state(index, "sound_generated", False)
 
-# Topic Prompt Presets
-TOPIC_PROMPTS = {
-    "conspiracy": {
-        "name": "Conspiracy Theory",
-        "prompt": "Create a cinematic, intelligent, and scroll-stopping TikTok script based on this conspiracy theory {input}. Follow this format exactly: Start with a 1-sentence hook (max 2 seconds) using a question or intriguing fact (\"Why did...\", \"What if…\", \"Did you know that…\"). Then build a 7–9 scene script (~20–35 seconds total), written as immersive, voiceover-style narration — not camera directions. Each \"scene\" should be 1–2 sentences max and evoke a visual moment. The tone should feel like a Netflix doc: cinematic, calm, composed, and mysterious — never loud, never clickbait. The final line must leave the viewer wondering or imply the story isn't really over. Use real historical dates, locations, and terminology where possible to enhance realism."
-    },
-    "educational": {
-        "name": "Educational Content",
-        "prompt": "Create an engaging educational TikTok script about {input}. Start with a compelling hook question or surprising fact (1-2 seconds). Build a 6-8 scene script (~25-40 seconds) that teaches the audience something valuable. Use clear, conversational language with smooth transitions between concepts. Each scene should be 1-2 sentences that paint a clear visual picture. Make it informative but entertaining, like a good teacher explaining a fascinating topic."
-    },
-    "motivational": {
-        "name": "Motivational/Inspirational",
-        "prompt": "Create an inspiring and motivational TikTok script based on {input}. Start with a powerful hook that resonates emotionally (1-2 seconds). Build a 5-7 scene script (~20-30 seconds) that tells a compelling story of overcoming challenges or achieving success. Use uplifting language that motivates action. Each scene should be 1-2 sentences that create vivid, inspiring imagery. End with a call to action that empowers the viewer."
-    },
-    "storytelling": {
-        "name": "Storytelling/Narrative",
-        "prompt": "Create a captivating story-based TikTok script about {input}. Start with an intriguing hook that sets up the story (1-2 seconds). Build a 7-10 scene script (~30-45 seconds) that tells a complete narrative with beginning, middle, and end. Use vivid, descriptive language that makes viewers feel like they're experiencing the story. Each scene should be 1-2 sentences that advance the plot. Create emotional connection and satisfying resolution."
-    }
-}
+def set_stage_quality(index, stage, quality):
+    """Remember the quality a stage was rendered at"""
+    scene_data = get_scene_data(index)
+    if scene_data:
+        scene_data["quality"][stage] = quality
 
-# General Instructions
-GENERAL_PROMPT = """Make sure not to use em dashes (use commas instead) and other punctuation that would confuse the script reader (who is a robot). Next, with the scene informations, generate prompts for the images, the videos (that will be made with the images) and the sound for the scenes. The prompts should be as long and detailed as possible or should be, since it needs to look alluring. Output all scenes (including the hook) with their corresponding prompts in the format and only respond with the finalized format. The format and example prompts are listed below, pay close attention."""
-
-# Model Examples
-MODEL_EXAMPLES = {
-    "image_examples": [
-        "A cinematic, photorealistic medium shot capturing the nostalgic warmth of a mid-2000s indie film. The focus is a young woman with a sleek, straight bob haircut in cool platinum white with freckled skin, looking directly and intently into the camera lens with a knowing smirk, her head is looking up slightly. She wears an oversized band t-shirt that says \"Seedream 3.0 on Replicate\" in huge stylized text over a long-sleeved striped top and simple silver stud earrings. The lighting is soft, golden hour sunlight creating lens flare and illuminating dust motes in the air. The background shows a blurred outdoor urban setting with graffiti-covered walls (the graffiti says \"seedream\" in stylized graffiti lettering), rendered with a shallow depth of field. Natural film grain, a warm, slightly muted color palette, and sharp focus on her expressive eyes enhance the intimate, authentic feel",
-        "A cinematic, photorealistic medium shot capturing the rebellious energy of early 1990s grunge culture. The focus is a young woman with tousled, shoulder-length auburn hair with natural waves and freckled skin, looking directly and intently into the camera lens with a knowing smirk, her head is looking up slightly. She wears an oversized flannel shirt that says \"Seedream 3.0 on Replicate\" in huge stylized text over a band tee and simple hoop earrings. The lighting is moody, overcast daylight filtering through windows creating dramatic shadows. The background shows a blurred indoor coffee shop setting with vintage concert posters covering brick walls (one poster says \"seedream\" in bold concert lettering), rendered with a shallow depth of field. Natural film grain, a desaturated color palette with pops of deep reds and blues, and sharp focus on her expressive eyes enhance the raw, authentic underground feel."
-    ],
-    "video_examples": [
-        "a woman points at the words",
-        "a woman takes her hands out her pockets and gestures to the words with both hands, she is excited, behind her it is raining"
-    ],
-    "sound_examples": [
-        "Generate a continuous printer printing sound with periodic beeps and paper movement, plus a cat pawing at the machine. Add subtle ambient room noise for authenticity, keeping the focus on printing, beeps, and the cat's interaction.",
-        "Begin by creating a soft, steady background of light pacifier suckling. Add subtle, breathy rhythms to mimic a newborn's gentle mouth movements. Keep the sound smooth, natural, and soothing.",
-        "Generate the sound of firecrackers lighting and exploding repeatedly on the ground, followed by fireworks bursting in the sky. Incorporate occasional subtle echoes to mimic an outdoor night ambiance, with no human voices present.",
-        "Begin with the sound of hands scooping up loose plastic debris, followed by the subtle cascading noise as the pieces fall and scatter back down. Include soft crinkling and rustling to emphasize the texture of the plastic. Add ambient factory background noise with distant machinery to create an industrial atmosphere."
-    ]
-}
+def draft_stages(index):
+    """Generated stages of a scene that were rendered at draft quality"""
+    scene_state = get_scene_state(index)
+    scene_data = get_scene_data(index)
+    if not scene_state or not scene_data:
+        return []
+    return [stage for stage in ["image", "video", "sound"]
+            if scene_state[f"{stage}_generated"] and scene_data["quality"][stage] == "draft"]
 
 # Helper functions from original code
 def safe_filename(s):
@@ -356,14 +547,15 @@ def safe_filename(s):
     return s[:50]
 
 def download_file(url, filename):
-    """Download file from URL"""
-    response = requests.get(url, stream=True)
-    if response.status_code == 200:
-        with open(filename, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+    """Download file from URL (or copy it when it is already a local file)"""
+    if os.path.exists(url) and os.path.exists(filename) and os.path.samefile(url, filename):
         return True
-    return False
+    # Written to a temporary file and renamed, never in place: saved files can be hardlinks shared with other projects
+    try:
+        fetch(url, filename)
+    except (OSError, requests.RequestException):
+        return False
+    return True
 
 def create_project_directory():
     """Create project directory for this session"""
@@ -373,11 +565,259 @@ def create_project_directory():
             os.makedirs(base_dir)
         timestamp = datetime.now().strftime('project_%Y%m%d_%H%M%S')
         project_dir = os.path.join(base_dir, timestamp)
-        os.makedirs(project_dir)
+        # Sessions starting in the same second get a numbered directory instead of sharing one
+        suffix = 1
+        while True:
+            try:
+                os.makedirs(project_dir)
+                break
+            except FileExistsError:
+                suffix += 1
+                project_dir = os.path.join(base_dir, f"{timestamp}_{suffix}")
         st.session_state.project_dir = project_dir
     return st.session_state.project_dir
 
-def generate_storyboard(user_input, format_type="conspiracy"):
+def scene_output_path(index, kind, extension="mp4"):
+    """Path of a locally produced scene file in the project directory"""
+    scene_data = get_scene_data(index)
+    scene_name = safe_filename(scene_data["scene_text"])
+    return os.path.join(create_project_directory(), f"scene_{index+1}_{scene_name}_{kind}.{extension}")
+
+# Project file names of each stage output (the same names save_project uses)
+STAGE_FILES = {
+    "image": ("image", "png"),
+    "video": ("video", "mp4"),
+    "sound": ("final", "mp4"),
+    "audio": ("audio", "wav")
+}
+
+def local_asset(index, stage):
+    """Local copy of a stage output, once its background download finished and if it is still current"""
+    scene_data = get_scene_data(index)
+    local = scene_data.get("local_files", {}).get(stage) if scene_data else None
+    if not local or local["url"] != scene_data[f"generated_{stage}"]:
+        return None
+    future = local["future"]
+    if not future.done() or future.exception() is not None:
+        return None
+    return local["path"]
+
+def persist_stage_output(index, stage, url):
+    """Queue a stage output for background download into the project directory"""
+    scene_data = get_scene_data(index)
+    path = scene_output_path(index, *STAGE_FILES[stage])
+    future = persist(os.path.dirname(path), os.path.basename(path), url)
+    scene_data["local_files"][stage] = {"url": url, "path": path, "future": future}
+    
+    def attach(done):
+        # The local copy keeps the output reusable after its URL expires
+        if done.exception() is None:
+            get_index().attach_path(url, done.result())
+    future.add_done_callback(attach)
+    return future
+
+def pending_downloads():
+    """Background downloads that have not finished yet"""
+    return [local["future"] for scene_data in st.session_state.scene_data
+            for local in scene_data.get("local_files", {}).values() if not local["future"].done()]
+
+# Prompt field and input asset that identify a stage's output in the prompt cache
+CACHE_KEYS = {
+    "image": ("scene_image_prompt", None),
+    "video": ("scene_video_prompt", "generated_image"),
+    "sound": ("scene_sound_prompt", "generated_video"),
+    "audio": ("scene_sound_prompt", None)
+}
+
+def find_cached_output(index, stage, quality):
+    """Earlier output of a near-identical prompt (same input asset) that could be used instead of generating"""
+    scene_data = get_scene_data(index)
+    prompt_key, condition_key = CACHE_KEYS[stage]
+    condition = scene_data[condition_key] if condition_key else ""
+    if condition_key and not condition:
+        return None
+    # Only outputs of the models this session's prediction could run on
+    return get_index().lookup(stage, scene_data[prompt_key], quality, condition or "",
+                              st.session_state.prompt_cache_threshold,
+                              exclude=[scene_data[f"generated_{stage}"]] if scene_data[f"generated_{stage}"] else [],
+                              models=output_models(st.session_state.routing_models[stage]))
+
+def cache_lookup(index, stage, quality):
+    """Fields of the prompt_cache_lookup metric for a prediction about to be paid for, or None when the cache is off"""
+    if not st.session_state.prompt_cache_enabled:
+        return None
+    candidate = find_cached_output(index, stage, quality)
+    return {"stage": stage, "hit": candidate is not None,
+            "similarity": round(candidate["similarity"], 3) if candidate else None}
+
+def use_cached_output(index, stage, candidate):
+    """Take a cached output as the stage's result"""
+    update_scene_data(index, f"generated_{stage}", candidate["asset"])
+    update_scene_state(index, f"{stage}_generated", True)
+    set_stage_quality(index, stage, candidate["quality"])
+    if st.session_state.persist_outputs:
+        persist_stage_output(index, stage, candidate["asset"])
+    metrics.record("prompt_cache_reuse", stage=stage, model=candidate["model"],
+                   similarity=round(candidate["similarity"], 3))
+    store_project_state()
+
+def find_existing_shot(index):
+    """Saved scene of any project whose image is a near-duplicate of this scene's image and has a video"""
+    image = local_asset(index, "image")
+    if image is None:
+        image = get_scene_data(index)["generated_image"]
+        if not image or not os.path.exists(image):
+            return None
+    hashes = file_hashes(os.path.abspath(image), os.path.getmtime(image))
+    if hashes is None:
+        return None
+    for match in get_shot_index().lookup_hashes(*hashes, exclude=[image]):
+        files = shot_files(match["path"])
+        if "video" in files:
+            return {**match, **files}
+    return None
+
+def use_existing_shot(index, shot):
+    """Take a saved scene's video (and its sound, when that is generated from the video) as the scene's result"""
+    stages = ["video"]
+    update_scene_data(index, "generated_video", shot["video"])
+    update_scene_state(index, "video_generated", True)
+    if st.session_state.sound_mode == "video_to_audio" and "final" in shot:
+        update_scene_data(index, "generated_sound", shot["final"])
+        update_scene_state(index, "sound_generated", True)
+        stages.append("sound")
+    for stage in stages:
+        set_stage_quality(index, stage, "final")
+        if st.session_state.persist_outputs:
+            persist_stage_output(index, stage, get_scene_data(index)[f"generated_{stage}"])
+    metrics.record("shot_reuse", stages=stages, phash_distance=shot["phash_distance"],
+                   dhash_distance=shot["dhash_distance"])
+    store_project_state()
+
+def stage_call(index, stage, quality):
+    """Generation function and arguments of one stage of a scene, from its current prompts and inputs"""
+    scene_data = get_scene_data(index)
+    # This session's routing settings, which leave the other sessions' routing alone
+    routing = {"models": st.session_state.routing_models[stage], "policy": st.session_state.routing_policy}
+    if stage == "image":
+        return (partial(_generate_image, routing=routing), scene_data["scene_image_prompt"], quality, scene_data["seed"])
+    if stage == "video":
+        return (partial(_generate_video, routing=routing), scene_data["scene_video_prompt"], scene_data["generated_image"], quality)
+    if stage == "sound":
+        return (partial(_generate_sound, routing=routing), scene_data["generated_video"], scene_data["scene_sound_prompt"], quality)
+    return (partial(_generate_audio, routing=routing), scene_data["scene_sound_prompt"], quality)
+
+def request_regeneration(index, stage):
+    """Queue a debounced render of one scene stage; it supersedes the scene stage's earlier request"""
+    scene_data = get_scene_data(index)
+    quality = st.session_state.render_quality
+    call = stage_call(index, stage, quality)
+    prompt_key, input_key = CACHE_KEYS[stage]
+    session = st.session_state.session_id
+    project_id = st.session_state.project_id
+    service = get_generation_service()
+    backend = get_state_backend()
+    lookup = cache_lookup(index, stage, quality)
+    
+    def start():
+        # Recorded once the prediction starts, so requests superseded while debouncing do not count
+        if lookup:
+            metrics.record("prompt_cache_lookup", **lookup)
+        return service.submit(session, stage, quality, *call)
+    
+    # What the render was made from; the result is dropped if the scene has moved on since
+    details = {"index": index, "stage": stage, "quality": quality, "prompt": scene_data[prompt_key],
+               "input": scene_data[input_key] if input_key else None,
+               "version": next_result_version(backend, project_id, index, stage) if project_id else None}
+    request = get_regeneration_queue().submit((session, project_id, index, stage), start, details)
+    if project_id:
+        request.future.add_done_callback(partial(store_regeneration_result, backend, project_id, details))
+    st.session_state.regenerations[f"{index}:{stage}"] = request
+    return request
+
+def store_regeneration_result(backend, project_id, details, future):
+    """Done-callback of a regeneration: store its result where any replica serving the project applies it"""
+    if future.cancelled() or future.exception() is not None or not future.result():
+        return
+    save_stage_result(backend, project_id, details["index"], details["stage"], {**details, "url": future.result()})
+
+def pending_regeneration(index, stage):
+    """Latest regeneration request of a scene stage while it is debouncing or rendering"""
+    request = st.session_state.regenerations.get(f"{index}:{stage}")
+    return request if request and not request.future.done() else None
+
+def apply_regenerations():
+    """Apply finished regenerations that are still the latest version of their scene stage"""
+    queue = get_regeneration_queue()
+    for slot, request in list(st.session_state.regenerations.items()):
+        if not request.future.done():
+            continue
+        del st.session_state.regenerations[slot]
+        queue.forget(request.key, request)
+        details = request.details
+        index, stage = details["index"], details["stage"]
+        try:
+            url = request.future.result()
+        except (Superseded, CancelledError):
+            continue
+        except Exception as e:
+            st.error(f"Error generating {stage} for scene {index + 1}: {str(e)}")
+            continue
+        applied = bool(url) and apply_stage_result(index, stage, {**details, "url": url})
+        metrics.record("regeneration", stage=stage, version=request.version, applied=applied,
+                       latency=round(time.time() - request.created, 3))
+
+def apply_stage_result(index, stage, result):
+    """Apply a finished render unless a newer one was applied or the scene's prompt or input changed since
+
+    Returns whether the scene has it, which includes a result sync_project_state already took from the backend."""
+    scene_state = get_scene_state(index)
+    scene_data = get_scene_data(index)
+    if scene_data is None:
+        return False
+    version = result["version"]
+    if version is not None and version <= scene_state.get(f"{stage}_result_version", 0):
+        return version == scene_state[f"{stage}_result_version"]
+    prompt_key, input_key = CACHE_KEYS[stage]
+    if scene_data[prompt_key] != result["prompt"] or (input_key and scene_data[input_key] != result["input"]):
+        return False
+    # The previous output (and what was made from it) is only dropped now, so a superseded
+    # or failed render leaves the scene as it was
+    reset_from_step(index, stage)
+    scene_data["local_files"].pop(stage, None)
+    update_scene_data(index, f"generated_{stage}", result["url"])
+    update_scene_state(index, f"{stage}_generated", True)
+    if version is not None:
+        update_scene_state(index, f"{stage}_result_version", version)
+    set_stage_quality(index, stage, result["quality"])
+    if st.session_state.persist_outputs:
+        persist_stage_output(index, stage, result["url"])
+    return True
+
+@st.fragment(run_every=1)
+def watch_regenerations():
+    """Rerun the app as soon as a queued regeneration finishes"""
+    if any(request.future.done() for request in st.session_state.regenerations.values()):
+        st.rerun()
+
+async def _generate_stage(index, stage, quality):
+    """Run one stage of a scene and, if enabled, queue its output for download right away"""
+    scene_data = get_scene_data(index)
+    lookup = cache_lookup(index, stage, quality)
+    if lookup:
+        # Hit rate: how many paid predictions had a near-duplicate output available
+        metrics.record("prompt_cache_lookup", **lookup)
+    # The prediction waits for its turn in the deployment-wide queue
+    service = get_generation_service()
+    url = await asyncio.wrap_future(service.submit(st.session_state.session_id, stage, quality, *stage_call(index, stage, quality)))
+    scene_data["local_files"].pop(stage, None)
+    if url and st.session_state.persist_outputs:
+        # The download overlaps with the stages that are still generating
+        persist_stage_output(index, stage, url)
+    return url
+
+
+def generate_storyboard(user_input, format_type="conspiracy", two_phase=False, long_form_scenes=None):
     """Generate storyboard from initial prompt using OpenAI with advanced prompt structure"""
     try:
         # Check if OpenAI API key exists
@@ -388,96 +828,23 @@ def generate_storyboard(user_input, format_type="conspiracy"):
         
         client = OpenAI(api_key=api_key)
         
-        # Get the topic prompt based on format type
-        if format_type in TOPIC_PROMPTS:
-            topic_prompt = TOPIC_PROMPTS[format_type]["prompt"].format(input=user_input)
-        elif format_type in st.session_state.custom_topic_prompts:
-            topic_prompt = st.session_state.custom_topic_prompts[format_type].format(input=user_input)
-        else:
-            topic_prompt = f"Create a video script about: {user_input}"
+        # Static instructions and examples go first so the provider can cache the prefix
+        topic_prompt = build_topic_prompt(user_input, format_type, st.session_state.custom_topic_prompts)
         
-        # Build the comprehensive system prompt
-        system_prompt = f"""You are an expert video storyboard creator. Your task is to create detailed storyboards for TikTok-style videos.
-
-TOPIC PROMPT:
-{topic_prompt}
-
-GENERAL INSTRUCTIONS:
-{GENERAL_PROMPT}
-
-FORMAT:
-{{
-  "scenes": [
-    {{
-      "scene": "Scene script",
-      "scene_image_prompt": "...",
-      "scene_video_prompt": "...",
-      "scene_sound_prompt": "..."
-    }},
-    ...
-  ]
-}}
-
-MODEL EXAMPLES:
-
-Image prompts should be detailed and cinematic like these examples:
-{chr(10).join([f"{i+1}. {example}" for i, example in enumerate(MODEL_EXAMPLES["image_examples"])])}
-
-Video prompts should be simple motion descriptions like these examples:
-{chr(10).join([f"{i+1}. {example}" for i, example in enumerate(MODEL_EXAMPLES["video_examples"])])}
-
-Sound prompts should be detailed audio descriptions like these examples:
-{chr(10).join([f"{i+1}. {example}" for i, example in enumerate(MODEL_EXAMPLES["sound_examples"])])}
-
-IMPORTANT: Your response must be ONLY valid JSON with no additional text, explanations, or markdown formatting."""
-        
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"Input: {user_input}"}
-            ],
-            temperature=0.7
-        )
-        
-        storyboard_json = response.choices[0].message.content
-        
-        # Debug: show what we got from OpenAI
-        if not storyboard_json or storyboard_json.strip() == "":
-            st.error("OpenAI returned empty response. Please check your API key and try again.")
-            return None
-        
-        # Clean up the response (remove any markdown formatting)
-        storyboard_json = storyboard_json.strip()
-        if storyboard_json.startswith("```json"):
-            storyboard_json = storyboard_json[7:]
-        if storyboard_json.endswith("```"):
-            storyboard_json = storyboard_json[:-3]
-        storyboard_json = storyboard_json.strip()
-        
-        # Parse and validate JSON
+        # Structured output with local repair; only broken scenes are re-requested
         try:
-            storyboard_data = json.loads(storyboard_json)
-        except json.JSONDecodeError as e:
-            st.error(f"Invalid JSON response from OpenAI: {str(e)}")
-            st.error(f"Response received: {storyboard_json[:200]}...")
-            return None
-        
-        # Validate structure
-        if "scenes" not in storyboard_data:
-            st.error("Invalid storyboard structure: missing 'scenes' key")
-            return None
-        
-        if not isinstance(storyboard_data["scenes"], list):
-            st.error("Invalid storyboard structure: 'scenes' must be a list")
+            if long_form_scenes:
+                # Chunks of scene scripts with a running summary; prompts are expanded while later chunks stream
+                storyboard_data, usage = request_storyboard_long_form(client, topic_prompt, user_input, long_form_scenes)
+            elif two_phase:
+                # Outline first, then every scene's prompts in parallel
+                storyboard_data, usage = request_storyboard_two_phase(client, topic_prompt, user_input)
+            else:
+                storyboard_data, usage = request_storyboard(client, topic_prompt, user_input)
+        except ValueError as e:
+            st.error(f"Invalid storyboard response from OpenAI: {str(e)}")
             return None
-        
-        for i, scene in enumerate(storyboard_data["scenes"]):
-            required_fields = ["scene", "scene_image_prompt", "scene_video_prompt", "scene_sound_prompt"]
-            missing_fields = [field for field in required_fields if field not in scene]
-            if missing_fields:
-                st.error(f"Scene {i+1} missing required fields: {missing_fields}")
-                return None
+        st.session_state.last_storyboard_usage = usage
         
         return storyboard_data
         
@@ -487,42 +854,29 @@ IMPORTANT: Your response must be ONLY valid JSON with no additional text, explan
             st.error("This appears to be an API key issue. Please check your OpenAI API key in the .env file.")
         return None
 
-# AI Generation Functions (from original code)
-async def _generate_image(prompt):
-    """Generate image using Replicate"""
-    input = {
-        "prompt": prompt,
-        "aspect_ratio": "9:16",
-        "safety_filter_level": "block_medium_and_above",
-        "size": "big",
-        "guidance_scale": 2.5
-    }
-
-    output = await replicate.async_run("bytedance/seedream-3", input=input)
-    return output.url
-
-async def _generate_video(prompt, image_url):
-    """Generate video using Replicate"""
-    output = await replicate.async_run("kwaivgi/kling-v2.1",
-                                       input={
-                                           "prompt": prompt,
-                                           "start_image": image_url,
-                                           "mode": "pro"
-                                       })
-    return output.url
-
-async def _generate_sound(video_url, prompt):
-    """Generate sound using Replicate"""
-    output = await replicate.async_run(
-        "zsxkib/thinksound:40d08f9f569e91a5d72f6795ebed75178c185b0434699a98c07fc5f566efb2d4",
-        input={
-            "caption": prompt,
-            "cfg": 5,
-            "num_inference_steps": 24,
-            "video": video_url,
-            "cot": prompt,
-        })
-    return output.url
+def rewrite_scene_prompts_with_llm(index, instructions=""):
+    """Ask the LLM for new prompts for one scene; returns them without touching scene_data"""
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        st.error("OpenAI API key not found. Please check your .env file.")
+        return None
+    
+    topic_prompt = build_topic_prompt(st.session_state.initial_prompt, st.session_state.selected_format,
+                                      st.session_state.custom_topic_prompts)
+    scenes = [
+        {
+            "scene": scene_data["scene_text"],
+            "scene_image_prompt": scene_data["scene_image_prompt"],
+            "scene_video_prompt": scene_data["scene_video_prompt"],
+            "scene_sound_prompt": scene_data["scene_sound_prompt"]
+        }
+        for scene_data in st.session_state.scene_data
+    ]
+    try:
+        return rewrite_scene_prompts(OpenAI(api_key=api_key), topic_prompt, scenes, index, instructions)
+    except Exception as e:
+        st.error(f"Error rewriting prompts for scene {index + 1}: {str(e)}")
+        return None
 
 def run_async_function(func, *args):
     """Helper function to run async functions in Streamlit"""
@@ -534,16 +888,76 @@ def run_async_function(func, *args):
     
     return loop.run_until_complete(func(*args))
 
+def queue_status_text():
+    """This session's place in the shared generation queue"""
+    status = get_generation_service().status(st.session_state.session_id)
+    if status["queued"]:
+        return (f"⏳ {status['running']} running, {status['queued']} waiting "
+                f"({status['ahead']} predictions from other sessions ahead of your next one)")
+    return f"⏳ {status['running']} running"
+
+def run_with_queue_status(func, *args):
+    """Run a generation coroutine while showing this session's place in the shared queue"""
+    placeholder = st.empty()
+    
+    async def watch():
+        task = asyncio.ensure_future(func(*args))
+        while not task.done():
+            placeholder.caption(queue_status_text())
+            await asyncio.wait([task], timeout=0.5)
+        placeholder.empty()
+        return task.result()
+    
+    return run_async_function(watch)
+
 # Main app
 def main():
-    st.title("🎬 AI Video Generator")
-    
-    # Route to appropriate view
-    if st.session_state.current_step == 0:
-        show_simple_input()
-    elif st.session_state.current_step == 1:
-        show_storyboard_view()
+    with profile_rerun(st.session_state.profile_history, st.session_state.profiling,
+                       step=st.session_state.current_step, session_keys=len(st.session_state)):
+        st.title("🎬 AI Video Generator")
+        with section("sync_project_state"):
+            sync_project_state()
+        
+        # Route to appropriate view
+        if st.session_state.current_step == 0:
+            show_simple_input()
+        elif st.session_state.current_step == 1:
+            show_storyboard_view()
+        elif st.session_state.current_step == 2:
+            show_project_list()
+        
+        with section("store_project_state"):
+            store_project_state()
+    
+    if st.query_params.get("debug") or os.getenv("FLOWLY_PROFILE"):
+        show_profiler_panel()
+
+def show_profiler_panel():
+    """Debug sidebar with the timing of recent reruns"""
+    with st.sidebar:
+        st.markdown("### 🔬 Rerun Profiler")
+        st.session_state.profiling = st.checkbox("Profile reruns", value=st.session_state.profiling)
+        history = st.session_state.profile_history
+        if not history:
+            st.caption("No profiled reruns yet.")
+            return
+        
+        last = history[-1]
+        st.caption(f"Last rerun: {last['total'] * 1000:.0f} ms, {last['session_keys']} session state keys"
+                   f"{'' if last['completed'] else ' (interrupted by a rerun)'}")
+        st.line_chart({"rerun ms": [summary["total"] * 1000 for summary in history]}, height=120)
+        st.dataframe(frame_table(last), hide_index=True, use_container_width=True)
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            st.download_button("⬇️ Flamegraph", folded_stacks(history), file_name="flowly_reruns.folded",
+                               help="Folded stacks (self time in microseconds) for flamegraph.pl or speedscope")
+        with col2:
+            if st.button("🗑️ Clear"):
+                st.session_state.profile_history = []
+                st.rerun()
 
+@profiled
 def show_simple_input():
     """Simple input interface with text box and dropdown"""
     
@@ -581,6 +995,33 @@ def show_simple_input():
         
         st.session_state.selected_format = selected_format
         
+        st.session_state.two_phase_storyboard = st.checkbox(
+            "⚡ Two-phase generation",
+            value=st.session_state.two_phase_storyboard,
+            help="Write a short outline first, then every scene's prompts in parallel"
+        )
+        
+        st.session_state.long_form_storyboard = st.checkbox(
+            "🎞️ Long-form video",
+            value=st.session_state.long_form_storyboard,
+            help="Write a longer storyboard in chunks that share a running summary of characters, setting and style"
+        )
+        if st.session_state.long_form_storyboard:
+            st.session_state.long_form_scenes = st.number_input(
+                "Scenes",
+                min_value=10,
+                max_value=120,
+                step=10,
+                value=st.session_state.long_form_scenes,
+                help=f"Each scene is {SCENE_DURATION} seconds long"
+            )
+            st.caption(f"≈ {st.session_state.long_form_scenes * SCENE_DURATION // 60} min "
+                       f"{st.session_state.long_form_scenes * SCENE_DURATION % 60} s of video")
+        
+        if st.button("📂 Saved Projects"):
+            st.session_state.current_step = 2
+            st.rerun()
+        
         # Advanced settings button
         if st.button("⚙️ Advanced Settings"):
             st.session_state.show_advanced_settings = not st.session_state.show_advanced_settings
@@ -599,7 +1040,9 @@ def show_simple_input():
                     
                     # Generate storyboard using OpenAI with selected format
                     with st.spinner("🤖 Generating storyboard..."):
-                        storyboard_data = generate_storyboard(prompt, selected_format)
+                        long_form_scenes = st.session_state.long_form_scenes if st.session_state.long_form_storyboard else None
+                        storyboard_data = generate_storyboard(prompt, selected_format, st.session_state.two_phase_storyboard,
+                                                              long_form_scenes)
                         
                     if storyboard_data:
                         st.session_state.storyboard_data = storyboard_data
@@ -607,6 +1050,7 @@ def show_simple_input():
                         st.session_state.current_generation_step = "none"
                         initialize_scene_states(storyboard_data["scenes"])
                         st.session_state.current_step = 1
+                        start_project()
                         st.rerun()
                     else:
                         st.error("Failed to generate storyboard. Please try again or use the demo option.")
@@ -672,11 +1116,107 @@ def show_simple_input():
                     st.session_state.current_generation_step = "none"
                     initialize_scene_states(demo_storyboard["scenes"])
                     st.session_state.current_step = 1
+                    start_project()
                     st.success("Demo storyboard created!")
                     st.rerun()
                 else:
                     st.error("Please enter a prompt first!")
 
+# Catalog file kind that fills each generated_* field of a scene
+CATALOG_STAGES = {"image": ["image"], "video": ["video"], "sound": ["final", "mastered"], "audio": ["audio"]}
+PROJECT_LIST_PAGE_SIZE = 10
+
+def open_saved_project(project_dir):
+    """Rebuild the storyboard and scene state of a saved project from the catalog"""
+    started = time.time()
+    project = get_catalog().open_project(project_dir)
+    if project is None:
+        st.error("This project is no longer in the catalog.")
+        return False
+    storyboard = {"scenes": [{key: scene[key] for key in ["scene", "scene_image_prompt", "scene_video_prompt", "scene_sound_prompt"]}
+                             for scene in project["scenes"]]}
+    initialize_scene_states(storyboard["scenes"])
+    for i, scene in enumerate(project["scenes"]):
+        scene_data = get_scene_data(i)
+        for stage, kinds in CATALOG_STAGES.items():
+            path = next((scene["files"][kind] for kind in kinds if kind in scene["files"]), None)
+            if path is None:
+                continue
+            scene_data[f"generated_{stage}"] = path
+            if stage != "audio":
+                update_scene_state(i, f"{stage}_generated", True)
+                set_stage_quality(i, stage, scene["state"].get("quality", {}).get(stage) or "final")
+        scene_data["seed"] = scene["state"].get("seed", scene_data["seed"])
+        scene_data["approved"] = scene["state"].get("approved", False)
+    st.session_state.storyboard_data = storyboard
+    st.session_state.initial_prompt = project["prompt"]
+    if project["format_type"]:
+        st.session_state.selected_format = project["format_type"]
+    st.session_state.current_generation_step = "none"
+    st.session_state.grid_page = 0
+    st.session_state.current_step = 1
+    start_project()
+    # Saving again writes into the same directory; files already there are skipped
+    st.session_state.project_dir = project["dir"]
+    store_project_state()
+    metrics.record("project_opened", scenes=len(storyboard["scenes"]), latency=round(time.time() - started, 4))
+    return True
+
+def set_project_list_page(page):
+    st.session_state.project_list_page = page
+
+@profiled
+def show_project_list():
+    """Saved projects from the catalog, newest first or by full-text search"""
+    col1, col2 = st.columns([5, 1])
+    with col1:
+        st.markdown("### 📂 Saved Projects")
+    with col2:
+        if st.button("🔙 Back", use_container_width=True):
+            st.session_state.current_step = 0
+            st.rerun()
+    
+    catalog = get_catalog()
+    query = st.text_input("Search", key="project_search", on_change=set_project_list_page, args=(0,),
+                          placeholder="Search prompts and scenes, e.g. saturn rings", label_visibility="collapsed")
+    
+    total = catalog.count(query)
+    if not total:
+        st.info("No saved projects match." if query.strip() else "No saved projects yet.")
+        return
+    pages = (total + PROJECT_LIST_PAGE_SIZE - 1) // PROJECT_LIST_PAGE_SIZE
+    page = min(st.session_state.project_list_page, pages - 1)
+    st.caption(f"{total} project{'s' if total != 1 else ''}")
+    
+    for project in catalog.list_projects(query, PROJECT_LIST_PAGE_SIZE, page * PROJECT_LIST_PAGE_SIZE):
+        with st.container(border=True):
+            col_thumb, col_info, col_open = st.columns([1, 4, 1])
+            with col_thumb:
+                if project["thumbnail"] and os.path.exists(project["thumbnail"]):
+                    st.image(project["thumbnail"], width=100)
+            with col_info:
+                prompt = project["prompt"].strip() or project["name"]
+                st.markdown(f"**{html.escape(prompt[:120])}{'...' if len(prompt) > 120 else ''}**")
+                format_name = TOPIC_PROMPTS.get(project["format_type"], {}).get("name", project["format_type"] or "CLI run")
+                st.caption(f"{datetime.fromtimestamp(project['created']).strftime('%Y-%m-%d %H:%M')} · {format_name} · "
+                           f"{project['scene_count']} scenes, {project['finished_scenes']} with sound")
+            with col_open:
+                if st.button("📂 Open", key=f"open_{project['name']}", use_container_width=True):
+                    if open_saved_project(project["dir"]):
+                        st.rerun()
+    
+    if pages > 1:
+        col_prev, col_page, col_next = st.columns([1, 2, 1])
+        with col_prev:
+            st.button("◀ Prev", disabled=page == 0, on_click=set_project_list_page, args=(page - 1,),
+                      use_container_width=True, key="projects_prev")
+        with col_page:
+            st.caption(f"Page {page + 1} of {pages}")
+        with col_next:
+            st.button("Next ▶", disabled=page >= pages - 1, on_click=set_project_list_page, args=(page + 1,),
+                      use_container_width=True, key="projects_next")
+
+@profiled
 def show_advanced_settings():
     """Advanced settings modal"""
     with st.container():
@@ -712,6 +1252,105 @@ def show_advanced_settings():
             else:
                 st.error("Please enter both name and prompt!")
         
+        # Storyboard metrics
+        st.markdown("**Storyboard Metrics:**")
+        parses = metrics.summarize_storyboard_parses()
+        llm_calls = metrics.summarize_llm_calls("storyboard")
+        if parses["storyboards"]:
+            st.caption(f"First-try success: {parses['first_try_rate']:.0%} of {parses['storyboards']} storyboards, "
+                       f"{parses['repaired_locally']} repaired locally, {parses['rerequested_scenes']} scenes re-requested, "
+                       f"{parses['failed']} failed")
+        if llm_calls["calls"]:
+            st.caption(f"Prompt cache: {llm_calls['cache_hit_ratio']:.0%} of prompt tokens cached, "
+                       f"average latency {llm_calls['avg_latency']:.1f}s")
+        
+        # Output files
+        st.session_state.persist_outputs = st.checkbox(
+            "Download outputs in the background",
+            value=st.session_state.persist_outputs,
+            help="Download each image, video and sound into the project folder as soon as it is generated, so saving only writes metadata"
+        )
+        st.session_state.normalize_loudness = st.checkbox(
+            "Normalize loudness across scenes",
+            value=st.session_state.normalize_loudness,
+            help="After saving, measure every scene's sound and write a mastered copy gained to the target loudness (needs ffmpeg)"
+        )
+        if st.session_state.normalize_loudness:
+            st.session_state.target_loudness = st.slider(
+                "Target loudness (LUFS)",
+                min_value=-24.0,
+                max_value=-9.0,
+                step=0.5,
+                value=st.session_state.target_loudness
+            )
+        st.session_state.platform_exports = st.multiselect(
+            "Platform exports after saving",
+            options=list(PLATFORM_PRESETS),
+            default=st.session_state.platform_exports,
+            format_func=lambda platform: PLATFORM_PRESETS[platform]["name"],
+            help="Convert every scene and the final cut to 1080x1920 H.264/AAC with the platform's bitrate cap and loudness target (needs ffmpeg)"
+        )
+        
+        # Near-duplicate prompt cache
+        st.session_state.prompt_cache_enabled = st.checkbox(
+            "Offer cached outputs of similar prompts",
+            value=st.session_state.prompt_cache_enabled,
+            help="Before generating, look for an earlier output of the same model whose prompt (and input image or video) is nearly the same"
+        )
+        if st.session_state.prompt_cache_enabled:
+            st.session_state.prompt_cache_threshold = st.slider(
+                "Prompt similarity threshold",
+                min_value=0.5,
+                max_value=1.0,
+                step=0.01,
+                value=st.session_state.prompt_cache_threshold,
+                help="Cosine similarity of the prompt embeddings; lower offers more (and looser) matches"
+            )
+            cache = metrics.summarize_prompt_cache()
+            if cache["requests"]:
+                st.caption(f"Prompt cache: similar output available for {cache['hit_rate']:.0%} of "
+                           f"{cache['requests']} requests, {cache['reuses']} reused ({cache['reuse_rate']:.0%})")
+        
+        # Perceptual-hash index of saved scene images
+        st.session_state.shot_suggestions = st.checkbox(
+            "Suggest existing shots",
+            value=st.session_state.shot_suggestions,
+            help="When a scene's image looks like the image of a saved scene in any project, offer that scene's video instead of generating a new one"
+        )
+        
+        # Shared generation queue
+        st.markdown("**Generation Queue (all sessions):**")
+        for stage, stats in get_generation_service().snapshot().items():
+            st.caption(f"{stage.capitalize()}: {stats['running']}/{stats['limit']} running, "
+                       f"{stats['queued']} queued from {stats['sessions']} sessions")
+        
+        # Model routing
+        st.markdown("**Model Routing:**")
+        st.session_state.routing_policy = st.selectbox(
+            "Routing policy",
+            options=ROUTING_POLICIES,
+            index=ROUTING_POLICIES.index(st.session_state.routing_policy),
+            format_func=lambda x: {"preference": "Preference order", "latency": "Best recent latency"}[x],
+            help="Failing or suddenly slow models are skipped automatically with either policy"
+        )
+        for stage in MODEL_REGISTRY:
+            models = st.multiselect(
+                f"{stage.capitalize()} models (in preference order)",
+                options=list(MODEL_REGISTRY[stage]),
+                default=st.session_state.routing_models[stage],
+                format_func=model_name,
+                key=f"routing_models_{stage}"
+            )
+            if models:
+                st.session_state.routing_models[stage] = models
+            with st.expander(f"{stage.capitalize()} model health"):
+                # Health is shared by all sessions, since they all call the same models
+                for stats in get_router(stage).snapshot(st.session_state.routing_models[stage]):
+                    latency = f"{stats['latency']:.1f}s" if stats["latency"] is not None else "n/a"
+                    status = "✅" if stats["healthy"] else "⏸️"
+                    st.caption(f"{status} {model_name(stats['model'])}: {latency} avg, "
+                               f"{stats['calls']} calls, {stats['errors']} errors")
+        
         # Model settings
         st.markdown("**Model Examples:**")
         with st.expander("View Current Examples"):
@@ -727,6 +1366,7 @@ def show_advanced_settings():
             for i, example in enumerate(MODEL_EXAMPLES["sound_examples"]):
                 st.text_area(f"Sound Example {i+1}:", value=example, height=80, disabled=True)
 
+@profiled
 def show_storyboard_view():
     """Clean storyboard view focused on scripts and images"""
     
@@ -736,30 +1376,101 @@ def show_storyboard_view():
     
     scenes = st.session_state.storyboard_data["scenes"]
     
-    # Clean header with core features (no duplicate title)
-    col1, col2, col3, col4 = st.columns([3, 1, 1, 1])
-    
-    with col1:
-        st.markdown(f"**Project:** {st.session_state.initial_prompt[:80]}{'...' if len(st.session_state.initial_prompt) > 80 else ''}")
-    
-    with col2:
-        if st.button("🔙 Back", use_container_width=True):
-            st.session_state.current_step = 0
-            st.rerun()
+    # Results of queued regenerations; superseded versions never reach the scenes
+    with section("regenerations"):
+        apply_regenerations()
+        if st.session_state.regenerations:
+            watch_regenerations()
     
-    with col3:
-        if st.button("💾 Save", type="primary", use_container_width=True):
-            save_project()
+    # Clean header with core features (no duplicate title)
+    with section("header"):
+        col1, col2, col3, col4, col5 = st.columns([3, 1, 1, 1, 1])
+        
+        with col1:
+            st.markdown(f"**Project:** {st.session_state.initial_prompt[:80]}{'...' if len(st.session_state.initial_prompt) > 80 else ''}")
+        
+        with col2:
+            if st.button("🔙 Back", use_container_width=True):
+                st.session_state.current_step = 0
+                st.rerun()
+        
+        with col3:
+            if st.button("💾 Save", type="primary", use_container_width=True):
+                save_project()
+        
+        with col4:
+            if st.button("⚙️ Settings", use_container_width=True):
+                st.session_state.show_advanced_settings = True
+        
+        with col5:
+            url = project_download_url()
+            if url:
+                st.link_button("📦 Zip", url, use_container_width=True,
+                               help="Download the saved project (storyboard, prompts and all media) as one zip")
+            else:
+                st.button("📦 Zip", disabled=True, use_container_width=True, help="Save the project to download it as a zip")
     
-    with col4:
-        if st.button("⚙️ Settings", use_container_width=True):
-            st.session_state.show_advanced_settings = True
+    # Render quality and whole-storyboard actions
+    with section("storyboard actions"):
+        col_q, col_s, col_all, col_final = st.columns([2, 2, 1, 1])
+        
+        with col_q:
+            st.session_state.render_quality = st.radio(
+                "Render quality",
+                options=QUALITY_LEVELS,
+                index=QUALITY_LEVELS.index(st.session_state.render_quality),
+                format_func=lambda x: {"draft": "⚡ Draft (fast preview)", "final": "🎞️ Final (full quality)"}[x],
+                horizontal=True,
+                label_visibility="collapsed"
+            )
+        
+        with col_s:
+            st.session_state.sound_mode = st.selectbox(
+                "Sound mode",
+                options=["video_to_audio", "text_to_audio"],
+                index=["video_to_audio", "text_to_audio"].index(st.session_state.sound_mode),
+                format_func=lambda x: {"video_to_audio": "🔊 Sound from video", "text_to_audio": "⚡ Sound alongside video"}[x],
+                label_visibility="collapsed",
+                help="Sound alongside video generates audio from the sound prompt while the video renders, then muxes locally with ffmpeg"
+            )
+            if st.session_state.sound_mode == "text_to_audio" and not ffmpeg_available():
+                st.warning("ffmpeg not found: install it to mux sound into the videos")
+        
+        with col_all:
+            if st.button("▶️ Generate All", use_container_width=True, help="Render every missing image, video and sound"):
+                generate_all_scenes(scenes)
+        
+        with col_final:
+            approved_count = sum(1 for i in range(len(scenes)) if get_scene_data(i) and get_scene_data(i)["approved"] and draft_stages(i))
+            if st.button(f"✨ Finalize Approved ({approved_count})", use_container_width=True,
+                         disabled=approved_count == 0, help="Re-render approved draft scenes at full quality"):
+                finalize_approved_scenes(scenes)
+    
+    # Token accounting for the last storyboard call
+    usage = st.session_state.last_storyboard_usage
+    if usage:
+        st.caption(f"Storyboard: {usage['prompt_tokens']} prompt tokens ({usage['cached_tokens']} cached), "
+                   f"{usage['completion_tokens']} completion tokens, {usage['latency']:.1f}s")
     
     st.markdown("---")
     
     # Clean storyboard grid
     show_storyboard_grid(scenes)
 
+def project_download_url():
+    """Streaming zip download link of the saved project, or None before the first save"""
+    project_dir = st.session_state.project_dir
+    if not project_dir or not os.path.exists(os.path.join(project_dir, "storyboard.json")):
+        return None
+    # Same host the user reached the app on; FLOWLY_EXPORT_URL overrides it behind a proxy
+    host = st.context.headers.get("Host", "localhost").rsplit(":", 1)[0]
+    try:
+        return download_url(project_dir, host)
+    except OSError as e:
+        st.warning(f"Zip download server could not start: {str(e)}")
+        return None
+
+@profiled
 def show_storyboard_grid(scenes):
     """Display clean storyboard grid that spreads vertically like traditional storyboards"""
     
@@ -774,145 +1485,154 @@ def show_storyboard_grid(scenes):
         cols_per_row = 3  # Keep max 3 columns for readability
     
     # CSS for proper storyboard layout with larger visual content
-    st.markdown("""
-    <style>
-    .storyboard-container {
-        max-width: 1400px;
-        margin: 0 auto;
-        padding: 20px;
-    }
-    .scene-card {
-        border: 2px solid #e1e5e9;
-        border-radius: 12px;
-        padding: 20px;
-        margin-bottom: 20px;
-        background: white;
-        box-shadow: 0 4px 6px rgba(0,0,0,0.1);
-        min-height: 500px;
-    }
-    .scene-header {
-        font-size: 18px;
-        font-weight: 700;
-        margin-bottom: 15px;
-        color: #1f2937;
-        text-align: center;
-        border-bottom: 2px solid #f3f4f6;
-        padding-bottom: 10px;
-    }
-    .scene-content-container {
-        width: 100%;
-        height: 280px;
-        border-radius: 8px;
-        margin-bottom: 15px;
-        display: flex;
-        align-items: center;
-        justify-content: center;
-        background: #f8f9fa;
-        border: 2px dashed #d1d5db;
-        overflow: hidden;
-        position: relative;
-    }
-    .scene-content {
-        max-width: 100%;
-        max-height: 100%;
-        object-fit: cover;
-        border-radius: 6px;
-        cursor: pointer;
-    }
-    .content-tabs {
-        display: flex;
-        gap: 5px;
-        margin-bottom: 10px;
-        justify-content: center;
-    }
-    .content-tab {
-        padding: 5px 12px;
-        border: 1px solid #d1d5db;
-        border-radius: 6px;
-        background: white;
-        cursor: pointer;
-        font-size: 12px;
-        transition: all 0.2s;
-    }
-    .content-tab:hover {
-        background: #f3f4f6;
-    }
-    .content-tab.active {
-        background: #3b82f6;
-        color: white;
-        border-color: #3b82f6;
-    }
-    .content-tab.disabled {
-        background: #f9fafb;
-        color: #9ca3af;
-        cursor: not-allowed;
-    }
-    .scene-script {
-        font-size: 14px;
-        line-height: 1.5;
-        color: #374151;
-        margin-bottom: 15px;
-        padding: 12px;
-        background: #f8f9fa;
-        border-radius: 6px;
-        border-left: 4px solid #3b82f6;
-        min-height: 80px;
-    }
-    .generation-controls {
-        display: flex;
-        gap: 8px;
-        justify-content: space-between;
-        margin-top: 10px;
-    }
-    .popup-overlay {
-        position: fixed;
-        top: 0;
-        left: 0;
-        right: 0;
-        bottom: 0;
-        background: rgba(0,0,0,0.8);
-        display: flex;
-        align-items: center;
-        justify-content: center;
-        z-index: 1000;
-    }
-    .popup-content {
-        max-width: 90vw;
-        max-height: 90vh;
-        border-radius: 8px;
-        position: relative;
-    }
-    .popup-close {
-        position: absolute;
-        top: 10px;
-        right: 10px;
-        background: rgba(0,0,0,0.7);
-        color: white;
-        border: none;
-        border-radius: 50%;
-        width: 40px;
-        height: 40px;
-        cursor: pointer;
-        font-size: 20px;
-    }
-    </style>
-    """, unsafe_allow_html=True)
+    with section("css"):
+        st.markdown("""
+        <style>
+        .storyboard-container {
+            max-width: 1400px;
+            margin: 0 auto;
+            padding: 20px;
+        }
+        .scene-card {
+            border: 2px solid #e1e5e9;
+            border-radius: 12px;
+            padding: 20px;
+            margin-bottom: 20px;
+            background: white;
+            box-shadow: 0 4px 6px rgba(0,0,0,0.1);
+            min-height: 500px;
+        }
+        .scene-header {
+            font-size: 18px;
+            font-weight: 700;
+            margin-bottom: 15px;
+            color: #1f2937;
+            text-align: center;
+            border-bottom: 2px solid #f3f4f6;
+            padding-bottom: 10px;
+        }
+        .scene-content-container {
+            width: 100%;
+            height: 280px;
+            border-radius: 8px;
+            margin-bottom: 15px;
+            display: flex;
+            align-items: center;
+            justify-content: center;
+            background: #f8f9fa;
+            border: 2px dashed #d1d5db;
+            overflow: hidden;
+            position: relative;
+        }
+        .scene-content {
+            max-width: 100%;
+            max-height: 100%;
+            object-fit: cover;
+            border-radius: 6px;
+            cursor: pointer;
+        }
+        .content-tabs {
+            display: flex;
+            gap: 5px;
+            margin-bottom: 10px;
+            justify-content: center;
+        }
+        .content-tab {
+            padding: 5px 12px;
+            border: 1px solid #d1d5db;
+            border-radius: 6px;
+            background: white;
+            cursor: pointer;
+            font-size: 12px;
+            transition: all 0.2s;
+        }
+        .content-tab:hover {
+            background: #f3f4f6;
+        }
+        .content-tab.active {
+            background: #3b82f6;
+            color: white;
+            border-color: #3b82f6;
+        }
+        .content-tab.disabled {
+            background: #f9fafb;
+            color: #9ca3af;
+            cursor: not-allowed;
+        }
+        .scene-script {
+            font-size: 14px;
+            line-height: 1.5;
+            color: #374151;
+            margin-bottom: 15px;
+            padding: 12px;
+            background: #f8f9fa;
+            border-radius: 6px;
+            border-left: 4px solid #3b82f6;
+            min-height: 80px;
+        }
+        .generation-controls {
+            display: flex;
+            gap: 8px;
+            justify-content: space-between;
+            margin-top: 10px;
+        }
+        .popup-overlay {
+            position: fixed;
+            top: 0;
+            left: 0;
+            right: 0;
+            bottom: 0;
+            background: rgba(0,0,0,0.8);
+            display: flex;
+            align-items: center;
+            justify-content: center;
+            z-index: 1000;
+        }
+        .popup-content {
+            max-width: 90vw;
+            max-height: 90vh;
+            border-radius: 8px;
+            position: relative;
+        }
+        .popup-close {
+            position: absolute;
+            top: 10px;
+            right: 10px;
+            background: rgba(0,0,0,0.7);
+            color: white;
+            border: none;
+            border-radius: 50%;
+            width: 40px;
+            height: 40px;
+            cursor: pointer;
+            font-size: 20px;
+        }
+        </style>
+        """, unsafe_allow_html=True)
     
     # Create vertical storyboard layout
     st.markdown('<div class="storyboard-container">', unsafe_allow_html=True)
     
+    # Long storyboards are paged: only the cards (and media) of the current page are built
+    start, end = grid_page_bounds(num_scenes)
+    if num_scenes > st.session_state.grid_page_size:
+        with section("filmstrip"):
+            show_filmstrip(num_scenes, start, end)
+    with section("pager"):
+        show_grid_pager(num_scenes)
+    
     # Create rows of scenes
-    rows = (num_scenes + cols_per_row - 1) // cols_per_row
-    scene_index = 0
+    rows = (end - start + cols_per_row - 1) // cols_per_row
+    scene_index = start
     
     for row in range(rows):
-        if scene_index >= num_scenes:
+        if scene_index >= end:
             break
         
         cols = st.columns(cols_per_row)
         
         for col_idx in range(cols_per_row):
-            if scene_index >= num_scenes:
+            if scene_index >= end:
                 break
                 
             with cols[col_idx]:
@@ -921,6 +1641,101 @@ def show_storyboard_grid(scenes):
     
     st.markdown('</div>', unsafe_allow_html=True)
 
+GRID_PAGE_SIZES = [6, 12, 24, 48]
+
+# Filmstrip colors by the furthest generated stage
+FILMSTRIP_COLORS = {"none": "#e5e7eb", "image": "#bfdbfe", "video": "#60a5fa", "sound": "#22c55e"}
+
+def grid_page_bounds(num_scenes):
+    """Scene range of the current grid page, clamped after the storyboard or page size changed"""
+    page_size = st.session_state.grid_page_size
+    pages = max(1, (num_scenes + page_size - 1) // page_size)
+    st.session_state.grid_page = min(max(st.session_state.grid_page, 0), pages - 1)
+    start = st.session_state.grid_page * page_size
+    return start, min(start + page_size, num_scenes)
+
+def set_grid_page(page):
+    st.session_state.grid_page = page
+
+def set_grid_page_size():
+    # Keep the first scene of the current page in view
+    first_scene = st.session_state.grid_page * st.session_state.grid_page_size
+    st.session_state.grid_page_size = st.session_state.grid_page_size_select
+    st.session_state.grid_page = first_scene // st.session_state.grid_page_size
+
+def jump_to_scene():
+    # Clearing the field also fires on_change
+    if st.session_state.grid_jump is None:
+        return
+    st.session_state.grid_page = (st.session_state.grid_jump - 1) // st.session_state.grid_page_size
+
+def scene_status(index):
+    """Furthest generated stage of a scene"""
+    scene_state = get_scene_state(index)
+    for stage in ["sound", "video", "image"]:
+        if scene_state and scene_state[f"{stage}_generated"]:
+            return stage
+    return "none"
+
+def show_filmstrip(num_scenes, start, end):
+    """Compact overview of every scene's progress, built as a single element"""
+    cells = []
+    for i in range(num_scenes):
+        status = scene_status(i)
+        scene_data = get_scene_data(i)
+        border = "2px solid #1f2937" if start <= i < end else "1px solid #d1d5db"
+        style = "dashed" if draft_stages(i) else "solid"
+        title = html.escape(scene_data["scene_text"][:80], quote=True) if scene_data else ""
+        cells.append(
+            f'<span title="Scene {i + 1} ({status}): {title}" style="display:inline-block;width:26px;height:18px;'
+            f'margin:1px;font-size:10px;line-height:18px;text-align:center;border-radius:3px;'
+            f'background:{FILMSTRIP_COLORS[status]};border:{border};border-style:{style}">{i + 1}</span>'
+        )
+    done = sum(1 for i in range(num_scenes) if scene_status(i) == "sound")
+    with st.expander(f"🎞️ Filmstrip: {done}/{num_scenes} scenes complete", expanded=True):
+        st.markdown(f'<div style="line-height:0">{"".join(cells)}</div>', unsafe_allow_html=True)
+        st.caption("Gray: not started · light blue: image · blue: video · green: with sound · dashed: draft")
+
+def show_grid_pager(num_scenes):
+    """Page navigation, page size and jump-to-scene controls of the storyboard grid
+
+    The page size is always shown, so a page size larger than the storyboard can be changed back."""
+    page_size = st.session_state.grid_page_size
+    pages = (num_scenes + page_size - 1) // page_size
+    page = st.session_state.grid_page
+    col_prev, col_page, col_next, col_size, col_jump = st.columns([1, 2, 1, 1, 1])
+    with col_size:
+        st.selectbox(
+            "Scenes per page",
+            options=GRID_PAGE_SIZES,
+            index=GRID_PAGE_SIZES.index(page_size) if page_size in GRID_PAGE_SIZES else 0,
+            key="grid_page_size_select",
+            on_change=set_grid_page_size,
+            label_visibility="collapsed",
+            format_func=lambda size: f"{size} per page"
+        )
+    if pages <= 1:
+        return
+    with col_prev:
+        st.button("◀ Prev", disabled=page == 0, on_click=set_grid_page, args=(page - 1,), use_container_width=True)
+    with col_page:
+        st.selectbox(
+            "Page",
+            options=list(range(pages)),
+            index=page,
+            format_func=lambda p: f"Page {p + 1} of {pages} (scenes {p * page_size + 1}–{min((p + 1) * page_size, num_scenes)})",
+            key=f"grid_page_select_{page}",
+            on_change=lambda: set_grid_page(st.session_state[f"grid_page_select_{page}"]),
+            label_visibility="collapsed"
+        )
+    with col_next:
+        st.button("Next ▶", disabled=page >= pages - 1, on_click=set_grid_page, args=(page + 1,), use_container_width=True)
+    with col_jump:
+        st.number_input("Jump to scene", min_value=1, max_value=num_scenes, value=None, step=1,
+                        key="grid_jump", on_change=jump_to_scene, placeholder="Scene #",
+                        label_visibility="collapsed")
+
+@profiled
 def show_scene_card(scene, index):
     """Display a single scene card with proper image scaling and all generation options"""
     
@@ -1006,6 +1821,18 @@ def show_scene_card(scene, index):
     if st.session_state.get(f"show_image_popup_{index}", False):
         show_image_popup(scene_data, index)
     
+    # Draft badge and approval for finalizing
+    drafts = draft_stages(index)
+    if drafts:
+        # Callback so the header's approved count is already up to date on this rerun
+        st.checkbox(
+            f"👍 Approve draft ({', '.join(drafts)})",
+            value=scene_data["approved"],
+            key=f"approve_{index}",
+            on_change=lambda: update_scene_data(index, "approved", st.session_state[f"approve_{index}"]),
+            help="Approved scenes are re-rendered at full quality with Finalize Approved"
+        )
+    
     # Editable script
     st.markdown("**Script:**")
     new_script = st.text_area(
@@ -1025,22 +1852,23 @@ def show_scene_card(scene, index):
     # Image generation
     with col1:
         if scene_state["image_generated"]:
-            if st.button("🎨 ✓", key=f"img_{index}", help="Regenerate Image", use_container_width=True):
-                reset_from_step(index, "image")
+            button_text = "🎨 ⏳" if pending_regeneration(index, "image") else "🎨 ✓"
+            if st.button(button_text, key=f"img_{index}", help="Regenerate Image", use_container_width=True):
                 generate_individual_image(index)
         else:
-            if st.button("🎨 Generate", key=f"img_{index}", help="Generate Image", use_container_width=True):
+            button_text = "🎨 ⏳" if pending_regeneration(index, "image") else "🎨 Generate"
+            if st.button(button_text, key=f"img_{index}", help="Generate Image", use_container_width=True):
                 generate_individual_image(index)
     
     # Video generation
     with col2:
         video_disabled = not scene_state["image_generated"]
         if scene_state["video_generated"]:
-            if st.button("🎥 ✓", key=f"vid_{index}", help="Regenerate Video", use_container_width=True):
-                reset_from_step(index, "video")
-                generate_individual_video(index)
+            button_text = "🎥 ⏳" if pending_regeneration(index, "video") else "🎥 ✓"
+            if st.button(button_text, key=f"vid_{index}", help="Regenerate Video", use_container_width=True):
+                generate_individual_video(index, regenerate=True)
         else:
-            button_text = "🎥 Generate" if not video_disabled else "🎥 Need Image"
+            button_text = "🎥 ⏳" if pending_regeneration(index, "video") else "🎥 Generate" if not video_disabled else "🎥 Need Image"
             if st.button(button_text, key=f"vid_{index}", disabled=video_disabled, help="Generate Video", use_container_width=True):
                 generate_individual_video(index)
     
@@ -1048,14 +1876,28 @@ def show_scene_card(scene, index):
     with col3:
         sound_disabled = not scene_state["video_generated"]
         if scene_state["sound_generated"]:
-            if st.button("🔊 ✓", key=f"sound_{index}", help="Regenerate Sound", use_container_width=True):
-                reset_from_step(index, "sound")
-                generate_individual_sound(index)
+            button_text = "🔊 ⏳" if pending_regeneration(index, "sound") else "🔊 ✓"
+            if st.button(button_text, key=f"sound_{index}", help="Regenerate Sound", use_container_width=True):
+                generate_individual_sound(index, regenerate=True)
         else:
-            button_text = "🔊 Generate" if not sound_disabled else "🔊 Need Video"
+            button_text = "🔊 ⏳" if pending_regeneration(index, "sound") else "🔊 Generate" if not sound_disabled else "🔊 Need Video"
             if st.button(button_text, key=f"sound_{index}", disabled=sound_disabled, help="Generate Sound", use_container_width=True):
                 generate_individual_sound(index)
     
+    pending = [(stage, request) for stage in ["image", "video", "sound"]
+               for request in [pending_regeneration(index, stage)] if request]
+    if pending:
+        st.caption("⏳ " + ", ".join(f"{stage} v{request.version} {'rendering' if request.started else 'queued'}"
+                                    for stage, request in pending) + " (editing or clicking again replaces it)")
+    
+    # Near-duplicate output of the next stage, offered before paying for a prediction
+    if st.session_state.prompt_cache_enabled:
+        show_cache_candidate(index)
+    
+    # A saved shot from any project whose image looks the same, offered before generating the video
+    if st.session_state.shot_suggestions and scene_state["image_generated"] and not scene_state["video_generated"]:
+        show_existing_shot(index)
+    
     # Popup prompt editor
     if st.button("✏️ Edit Prompts", key=f"edit_{index}", use_container_width=True):
         st.session_state[f"show_prompts_{index}"] = True
@@ -1064,7 +1906,50 @@ def show_scene_card(scene, index):
     if st.session_state.get(f"show_prompts_{index}", False):
         show_prompt_popup(scene_data, index)
 
+def next_stage(index):
+    """The stage a scene would generate next, or None when it is complete"""
+    scene_state = get_scene_state(index)
+    for stage in ["image", "video", "sound"]:
+        if not scene_state[f"{stage}_generated"]:
+            # Text-to-audio sound is a separate track muxed locally, not a cached prediction
+            if stage == "sound" and st.session_state.sound_mode == "text_to_audio":
+                return None
+            return stage
+    return None
+
+@profiled
+def show_cache_candidate(index):
+    """Offer an earlier output of a near-identical prompt for the scene's next stage"""
+    stage = next_stage(index)
+    if stage is None:
+        return
+    candidate = find_cached_output(index, stage, st.session_state.render_quality)
+    if candidate is None:
+        return
+    st.caption(f"♻️ Cached {stage} from a {candidate['similarity']:.0%} similar prompt "
+               f"({candidate['model']}, {candidate['quality']})")
+    if stage == "image":
+        st.image(candidate["asset"], width=120)
+    if st.button(f"♻️ Use cached {stage}", key=f"reuse_{index}", use_container_width=True,
+                 help=f"Earlier prompt: {candidate['prompt'][:300]}"):
+        use_cached_output(index, stage, candidate)
+        st.rerun()
+
+@profiled
+def show_existing_shot(index):
+    """Offer the video of a saved scene whose image is a near-duplicate of this one"""
+    shot = find_existing_shot(index)
+    if shot is None:
+        return
+    project = os.path.basename(os.path.dirname(shot["path"]))
+    st.caption(f"🎬 Near-identical image in {project} (distance {shot['phash_distance']}/64)")
+    label = "♻️ Reuse existing shot" + (" with sound" if "final" in shot and st.session_state.sound_mode == "video_to_audio" else "")
+    if st.button(label, key=f"shot_{index}", use_container_width=True, help=shot["video"]):
+        use_existing_shot(index, shot)
+        st.rerun()
+
 @st.dialog("View Image")
+@profiled
 def show_image_popup(scene_data, index):
     """Show image in popup for closer inspection"""
     
@@ -1087,16 +1972,25 @@ def show_image_popup(scene_data, index):
             st.rerun()
 
 @st.dialog("Edit Prompts")
+@profiled
 def show_prompt_popup(scene_data, index):
     """Show popup modal for editing prompts"""
     
     st.markdown(f"### Scene {index + 1} Prompts")
     
+    # Prompts proposed by the LLM rewrite take the place of the saved ones until saved or cancelled
+    prompts = {
+        "scene_image_prompt": scene_data["scene_image_prompt"],
+        "scene_video_prompt": scene_data["scene_video_prompt"],
+        "scene_sound_prompt": scene_data["scene_sound_prompt"]
+    }
+    prompts.update(st.session_state.get(f"rewritten_prompts_{index}", {}))
+    
     # Image prompt
     st.markdown("**Image Prompt:**")
     new_image_prompt = st.text_area(
         "Image",
-        scene_data["scene_image_prompt"],
+        prompts["scene_image_prompt"],
         height=80,
         key=f"popup_img_prompt_{index}",
         label_visibility="collapsed"
@@ -1106,7 +2000,7 @@ def show_prompt_popup(scene_data, index):
     st.markdown("**Video Prompt:**")
     new_video_prompt = st.text_area(
         "Video",
-        scene_data["scene_video_prompt"],
+        prompts["scene_video_prompt"],
         height=80,
         key=f"popup_vid_prompt_{index}",
         label_visibility="collapsed"
@@ -1116,12 +2010,29 @@ def show_prompt_popup(scene_data, index):
     st.markdown("**Sound Prompt:**")
     new_sound_prompt = st.text_area(
         "Sound",
-        scene_data["scene_sound_prompt"],
+        prompts["scene_sound_prompt"],
         height=80,
         key=f"popup_sound_prompt_{index}",
         label_visibility="collapsed"
     )
     
+    # Rewrite this scene's prompts with the LLM (other scenes and generated content stay untouched)
+    rewrite_instructions = st.text_input(
+        "What should change?",
+        key=f"popup_rewrite_instructions_{index}",
+        placeholder="Optional, e.g. darker lighting, closer shot"
+    )
+    if st.button("🔁 Rewrite Prompts", use_container_width=True, key=f"popup_rewrite_{index}"):
+        with st.spinner(f"Rewriting prompts for scene {index + 1}..."):
+            new_prompts = rewrite_scene_prompts_with_llm(index, rewrite_instructions)
+        if new_prompts:
+            # Load the proposal into the editor; it is only applied with Save Changes
+            st.session_state[f"rewritten_prompts_{index}"] = new_prompts
+            for key in (f"popup_img_prompt_{index}", f"popup_vid_prompt_{index}", f"popup_sound_prompt_{index}"):
+                if key in st.session_state:
+                    del st.session_state[key]
+            st.rerun()
+    
     # Save and close buttons
     col1, col2 = st.columns(2)
     
@@ -1135,11 +2046,19 @@ def show_prompt_popup(scene_data, index):
             if new_sound_prompt != scene_data["scene_sound_prompt"]:
                 update_scene_data(index, "scene_sound_prompt", new_sound_prompt)
             
+            # A render still queued or running for an edited prompt is replaced by one of the new version
+            for stage in ["image", "video", "sound"]:
+                request = pending_regeneration(index, stage)
+                if request and request.details["prompt"] != scene_data[CACHE_KEYS[stage][0]]:
+                    request_regeneration(index, stage)
+            
+            st.session_state.pop(f"rewritten_prompts_{index}", None)
             st.session_state[f"show_prompts_{index}"] = False
             st.rerun()
     
     with col2:
         if st.button("✖️ Cancel", use_container_width=True):
+            st.session_state.pop(f"rewritten_prompts_{index}", None)
             st.session_state[f"show_prompts_{index}"] = False
             st.rerun()
 
@@ -1162,10 +2081,12 @@ def generate_all_images_new(scenes):
             
             if scene_state and scene_data and not scene_state["image_generated"]:
                 try:
-                    image_url = run_async_function(_generate_image, scene_data["scene_image_prompt"])
+                    quality = st.session_state.render_quality
+                    image_url = run_with_queue_status(_generate_stage, i, "image", quality)
                     if image_url:
                         update_scene_data(i, "generated_image", image_url)
                         update_scene_state(i, "image_generated", True)
+                        set_stage_quality(i, "image", quality)
                         generated_count += 1
                 except Exception as e:
                     st.error(f"Error generating image for scene {i+1}: {str(e)}")
@@ -1197,10 +2118,12 @@ def generate_all_videos_new(scenes):
                 not scene_state["video_generated"] and
                 scene_data["generated_image"]):
                 try:
-                    video_url = run_async_function(_generate_video, scene_data["scene_video_prompt"], scene_data["generated_image"])
+                    quality = st.session_state.render_quality
+                    video_url = run_with_queue_status(_generate_stage, i, "video", quality)
                     if video_url:
                         update_scene_data(i, "generated_video", video_url)
                         update_scene_state(i, "video_generated", True)
+                        set_stage_quality(i, "video", quality)
                 except Exception as e:
                     st.error(f"Error generating video for scene {i+1}: {str(e)}")
     
@@ -1228,10 +2151,12 @@ def generate_all_sounds_new(scenes):
                 not scene_state["sound_generated"] and
                 scene_data["generated_video"]):
                 try:
-                    sound_url = run_async_function(_generate_sound, scene_data["generated_video"], scene_data["scene_sound_prompt"])
+                    quality = st.session_state.render_quality
+                    sound_url = run_with_queue_status(_generate_stage, i, "sound", quality)
                     if sound_url:
                         update_scene_data(i, "generated_sound", sound_url)
                         update_scene_state(i, "sound_generated", True)
+                        set_stage_quality(i, "sound", quality)
                 except Exception as e:
                     st.error(f"Error generating sound for scene {i+1}: {str(e)}")
     
@@ -1240,62 +2165,159 @@ def generate_all_sounds_new(scenes):
 
 
 
+async def _render_scene(index, quality, from_stage=None):
+    """Generate a scene's stages in order; from_stage forces a re-render from that stage on"""
+    scene_state = get_scene_state(index)
+    stages = ["image", "video", "sound"]
+    start = stages.index(from_stage) if from_stage else None
+    
+    def forced(stage):
+        return start is not None and stages.index(stage) >= start
+    
+    for position, stage in enumerate(stages):
+        if scene_state[f"{stage}_generated"] and not forced(stage):
+            continue
+        if stage in ("video", "sound") and st.session_state.sound_mode == "text_to_audio":
+            # Sound comes from the prompt alone, so it runs alongside the video
+            await _render_video_and_audio(index, quality, forced("video"), forced("sound"))
+            return
+        url = await _generate_stage(index, stage, quality)
+        if not url:
+            raise RuntimeError(f"No {stage} returned")
+        # The new asset replaces the old one only once it exists; later stages depend on it
+        if position + 1 < len(stages):
+            reset_from_step(index, stages[position + 1])
+        update_scene_data(index, f"generated_{stage}", url)
+        update_scene_state(index, f"{stage}_generated", True)
+        set_stage_quality(index, stage, quality)
+        store_project_state()
+
+async def _render_video_and_audio(index, quality, force_video=False, force_audio=False):
+    """Generate the video and a text-to-audio track concurrently, then mux them locally"""
+    scene_data = get_scene_data(index)
+    scene_state = get_scene_state(index)
+    
+    pending = {}
+    if force_video or not scene_state["video_generated"]:
+        pending["video"] = _generate_stage(index, "video", quality)
+    if force_audio or not scene_data["generated_audio"]:
+        pending["audio"] = _generate_stage(index, "audio", quality)
+    results = dict(zip(pending, await asyncio.gather(*pending.values())))
+    
+    if "video" in results:
+        reset_from_step(index, "video")
+        update_scene_data(index, "generated_video", results["video"])
+        update_scene_state(index, "video_generated", True)
+        set_stage_quality(index, "video", quality)
+    if "audio" in results:
+        update_scene_data(index, "generated_audio", results["audio"])
+    
+    # Stream-copy the video and encode only the audio into the scene's final file,
+    # reading the copies already downloaded in the background instead of fetching the URLs again
+    for stage in ["video", "audio"]:
+        local = scene_data["local_files"].get(stage)
+        if local:
+            await asyncio.wait([asyncio.wrap_future(local["future"])])
+    final_path = await mux_audio(local_asset(index, "video") or scene_data["generated_video"],
+                                 local_asset(index, "audio") or scene_data["generated_audio"],
+                                 scene_output_path(index, "final"))
+    update_scene_data(index, "generated_sound", final_path)
+    update_scene_state(index, "sound_generated", True)
+    set_stage_quality(index, "sound", quality)
+    store_project_state()
+
+async def _render_scenes(jobs):
+    """Render several scenes concurrently; returns the error of each failed scene"""
+    results = await asyncio.gather(*[_render_scene(index, quality, from_stage) for index, quality, from_stage in jobs],
+                                   return_exceptions=True)
+    return {jobs[i][0]: result for i, result in enumerate(results) if isinstance(result, Exception)}
+
+def generate_all_scenes(scenes):
+    """Render every missing stage of every scene at the selected quality"""
+    quality = st.session_state.render_quality
+    jobs = [(i, quality, None) for i in range(len(scenes))
+            if get_scene_state(i) and not get_scene_state(i)["sound_generated"]]
+    if not jobs:
+        st.info("All scenes already generated!")
+        return
+    
+    with st.spinner(f"Rendering {len(jobs)} scenes ({quality})..."):
+        errors = run_with_queue_status(_render_scenes, jobs)
+    for index, error in errors.items():
+        st.error(f"Error generating scene {index + 1}: {str(error)}")
+    if not errors:
+        st.rerun()
+
+def finalize_approved_scenes(scenes):
+    """Re-render approved draft scenes at full quality, reusing their prompts and image seed"""
+    jobs = []
+    for i in range(len(scenes)):
+        scene_data = get_scene_data(i)
+        drafts = draft_stages(i)
+        if scene_data and scene_data["approved"] and drafts:
+            jobs.append((i, "final", drafts[0]))
+    if not jobs:
+        st.info("No approved draft scenes to finalize. Approve scenes on their cards first.")
+        return
+    
+    with st.spinner(f"Finalizing {len(jobs)} approved scenes..."):
+        errors = run_with_queue_status(_render_scenes, jobs)
+    for index, error in errors.items():
+        st.error(f"Error finalizing scene {index + 1}: {str(error)}")
+    if not errors:
+        st.rerun()
+
 def generate_individual_image(index):
-    """Generate image for a specific scene"""
+    """Queue image generation for a specific scene; the current image stays until the new one is applied"""
     scene_data = get_scene_data(index)
     if not scene_data:
         return
-    
-    with st.spinner(f"Generating image for scene {index + 1}..."):
-        try:
-            image_url = run_async_function(_generate_image, scene_data["scene_image_prompt"])
-            if image_url:
-                update_scene_data(index, "generated_image", image_url)
-                update_scene_state(index, "image_generated", True)
-                st.success(f"Image generated for scene {index + 1}!")
-                st.rerun()
-            else:
-                st.error("Failed to generate image")
-        except Exception as e:
-            st.error(f"Error generating image: {str(e)}")
+    # Repeated clicks within the debounce window become one prediction; a running older one is cancelled
+    request_regeneration(index, "image")
+    st.rerun()
 
-def generate_individual_video(index):
-    """Generate video for a specific scene"""
+def generate_individual_video(index, regenerate=False):
+    """Queue video generation for a specific scene; the current video stays until the new one is applied"""
     scene_data = get_scene_data(index)
     if not scene_data or not scene_data["generated_image"]:
         return
     
-    with st.spinner(f"Generating video for scene {index + 1}..."):
-        try:
-            video_url = run_async_function(_generate_video, scene_data["scene_video_prompt"], scene_data["generated_image"])
-            if video_url:
-                update_scene_data(index, "generated_video", video_url)
-                update_scene_state(index, "video_generated", True)
-                st.success(f"Video generated for scene {index + 1}!")
-                st.rerun()
-            else:
-                st.error("Failed to generate video")
-        except Exception as e:
-            st.error(f"Error generating video: {str(e)}")
+    if st.session_state.sound_mode == "text_to_audio":
+        # Generated right away; the current video is replaced once the new one is ready
+        generate_individual_video_and_audio(index, force_video=regenerate)
+        return
+    
+    request_regeneration(index, "video")
+    st.rerun()
 
-def generate_individual_sound(index):
-    """Generate sound for a specific scene"""
+def generate_individual_sound(index, regenerate=False):
+    """Queue sound generation for a specific scene; the current sound stays until the new one is applied"""
     scene_data = get_scene_data(index)
     if not scene_data or not scene_data["generated_video"]:
         return
     
-    with st.spinner(f"Generating sound for scene {index + 1}..."):
+    if st.session_state.sound_mode == "text_to_audio":
+        # Generated right away; the current sound is replaced once the new track is ready
+        generate_individual_video_and_audio(index, force_audio=regenerate)
+        return
+    
+    request_regeneration(index, "sound")
+    st.rerun()
+
+def generate_individual_video_and_audio(index, force_video=False, force_audio=False):
+    """Generate the missing (or forced) video and/or text-to-audio track of a scene in parallel and mux them"""
+    scene_data = get_scene_data(index)
+    if not scene_data or not scene_data["generated_image"]:
+        return
+    
+    with st.spinner(f"Generating video and sound for scene {index + 1}..."):
         try:
-            sound_url = run_async_function(_generate_sound, scene_data["generated_video"], scene_data["scene_sound_prompt"])
-            if sound_url:
-                update_scene_data(index, "generated_sound", sound_url)
-                update_scene_state(index, "sound_generated", True)
-                st.success(f"Sound generated for scene {index + 1}!")
-                st.rerun()
-            else:
-                st.error("Failed to generate sound")
+            run_with_queue_status(partial(_render_video_and_audio, force_video=force_video, force_audio=force_audio),
+                                  index, st.session_state.render_quality)
+            st.success(f"Video and sound generated for scene {index + 1}!")
+            st.rerun()
         except Exception as e:
-            st.error(f"Error generating sound: {str(e)}")
+            st.error(f"Error generating video and sound: {str(e)}")
 
 def save_project():
     """Save the complete project"""
@@ -1337,64 +2359,88 @@ def save_project():
                 }
                 enhanced_storyboard["scenes"].append(enhanced_scene)
         
-        storyboard_file = os.path.join(project_dir, "storyboard.json")
-        with open(storyboard_file, 'w') as f:
-            json.dump(enhanced_storyboard, f, indent=2)
+        # Metadata is written atomically so an interrupted save never leaves a truncated file
+        write_json_atomic(os.path.join(project_dir, "storyboard.json"), enhanced_storyboard)
         
         # Save original prompt
-        prompt_file = os.path.join(project_dir, "original_prompt.txt")
-        with open(prompt_file, 'w') as f:
-            f.write(st.session_state.initial_prompt)
+        write_text_atomic(os.path.join(project_dir, "original_prompt.txt"), st.session_state.initial_prompt)
         
-        # Calculate total files to save
-        total_files = 0
-        for i in range(len(scenes)):
-            scene_data = get_scene_data(i)
-            if scene_data:
-                if scene_data["generated_image"]:
-                    total_files += 1
-                if scene_data["generated_video"]:
-                    total_files += 1
-                if scene_data["generated_sound"]:
-                    total_files += 1
+        # Let background downloads finish; the files they saved are already in the manifest
+        pending = pending_downloads()
+        if pending:
+            status_text.text(f"Waiting for {len(pending)} background downloads...")
+            wait_for(pending)
         
-        saved_files = 0
-        
-        # Download and save all generated content
+        # Collect generated content; files saved before from the same URL are skipped
+        manifest = load_manifest(project_dir)
+        assets = []
         for i, scene in enumerate(scenes):
             scene_data = get_scene_data(i)
             if not scene_data:
                 continue
-                
             scene_name = safe_filename(scene_data["scene_text"])
-            
-            # Save image
-            if scene_data["generated_image"]:
-                status_text.text(f"Saving image for scene {i+1}...")
-                image_filename = os.path.join(project_dir, f"scene_{i+1}_{scene_name}_image.png")
-                if download_file(scene_data["generated_image"], image_filename):
-                    saved_files += 1
-                progress_bar.progress(saved_files / total_files)
-            
-            # Save video (no sound)
-            if scene_data["generated_video"]:
-                status_text.text(f"Saving video for scene {i+1}...")
-                video_filename = os.path.join(project_dir, f"scene_{i+1}_{scene_name}_video.mp4")
-                if download_file(scene_data["generated_video"], video_filename):
-                    saved_files += 1
-                progress_bar.progress(saved_files / total_files)
-            
-            # Save final video with sound
-            if scene_data["generated_sound"]:
-                status_text.text(f"Saving final video with sound for scene {i+1}...")
-                final_filename = os.path.join(project_dir, f"scene_{i+1}_{scene_name}_final.mp4")
-                if download_file(scene_data["generated_sound"], final_filename):
-                    saved_files += 1
-                progress_bar.progress(saved_files / total_files)
+            for stage, label in [("image", "image"), ("video", "video"), ("sound", "final video with sound")]:
+                url = scene_data[f"generated_{stage}"]
+                kind, extension = STAGE_FILES[stage]
+                filename = f"scene_{i+1}_{scene_name}_{kind}.{extension}"
+                if url and not is_current(project_dir, manifest, filename, url):
+                    assets.append((i, stage, label, filename, url))
+        
+        saved_files = 0
+        for i, stage, label, filename, url in assets:
+            status_text.text(f"Saving {label} for scene {i+1}...")
+            if download_file(url, os.path.join(project_dir, filename)):
+                record_saved(project_dir, filename, url)
+                saved_files += 1
+            progress_bar.progress(saved_files / len(assets))
         
-        status_text.text("All files saved successfully!")
+        status_text.text(f"All files saved successfully! ({saved_files} new or changed)")
         st.success(f"✅ Project saved to: {project_dir}")
         
+        # Per-scene gain to the target loudness; only new or regenerated scenes are measured again
+        if st.session_state.normalize_loudness and ffmpeg_available():
+            status_text.text("Normalizing loudness across scenes...")
+            summary = master_project(project_dir, st.session_state.target_loudness)
+            if summary.get("loudness_before") is not None:
+                st.caption(f"🔊 Loudness {summary['loudness_before']:.1f} → {summary['loudness_after']:.1f} LUFS "
+                           f"({summary['analyzed']} scenes measured, {summary['mastered']} mastered)")
+            for filename, error in summary["failed"]:
+                st.warning(f"Loudness normalization of {filename} failed: {error}")
+        
+        # Platform exports; outputs whose scenes did not change since the last save are skipped
+        if st.session_state.platform_exports:
+            if ffmpeg_available():
+                names = ", ".join(PLATFORM_PRESETS[platform]["name"] for platform in st.session_state.platform_exports)
+                status_text.text(f"Exporting for {names}...")
+                progress_bar.progress(0)
+                summary = export_project(project_dir, st.session_state.platform_exports,
+                                         on_progress=lambda done, total: progress_bar.progress(done / total))
+                status_text.text(f"Exports done: {summary['exported']} written ({summary['copied']} by stream copy), "
+                                 f"{summary['skipped']} unchanged")
+                for relative, error in summary["failed"]:
+                    st.warning(f"Export of {relative} failed: {error}")
+            else:
+                st.info("Install ffmpeg to export the project for TikTok, Reels and Shorts.")
+        
+        # Identical bytes in other projects (duplicates, re-exports) are stored once and hardlinked
+        summary = ingest_project(project_dir, get_blob_store())
+        if summary["linked"]:
+            st.caption(f"🗄️ {summary['linked']} files already saved in other projects, "
+                       f"{summary['freed_bytes'] / 1e6:.1f} MB deduplicated")
+        for relative, error in summary["failed"]:
+            st.warning(f"Could not deduplicate {relative}: {error}")
+        
+        # Catalog entry for the project list; rebuilt from the session, not by reading the files back
+        get_catalog().add_project(project_dir, enhanced_storyboard, st.session_state.initial_prompt,
+                                  st.session_state.selected_format,
+                                  states=[{"seed": scene_data["seed"], "quality": scene_data["quality"],
+                                           "approved": scene_data["approved"]} for scene_data in st.session_state.scene_data])
+        
+        # New and changed scene images become available as existing shots for other projects
+        summary = get_shot_index().update(project_dir)
+        for path in summary["failed"]:
+            st.warning(f"Could not index {os.path.basename(path)}: the image is unreadable")
+        
     except Exception as e:
         st.error(f"Error saving project: {str(e)}")
 
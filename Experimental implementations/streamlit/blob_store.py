@@ -0,0 +1,190 @@
+"""Content-addressed store of saved project files.
+
+Every image, video and sound file of a project is moved into
+final_videos/.blobs/<2 hex>/<sha256> and hardlinked back under its scene_N_*
+name, so a duplicated or re-exported project takes no extra space for bytes
+that are already saved. The SHA-256 in a project's manifest.json is the
+name of the blob its file points to.
+
+A blob's reference count is its hardlink count minus the store's own link;
+deleting a project directory releases its references without any
+bookkeeping. Garbage collection removes blobs nothing links to any more.
+
+Files are only ever replaced (written to a temporary name and renamed into
+place), never rewritten in place, so replacing one project's file never
+changes another project's copy. Where hardlinks are not available (another
+filesystem, some network shares) files are left as plain copies.
+
+    python blob_store.py ingest final_videos/project_YYYYMMDD_HHMMSS
+    python blob_store.py stats
+    python blob_store.py gc
+"""
+import argparse
+import errno
+import logging
+import os
+import time
+
+from manifest import load_manifest, asset_hash, file_hash
+
+DEFAULT_ROOT = "final_videos"
+DEFAULT_STORE_PATH = os.getenv("FLOWLY_BLOB_STORE", os.path.join(DEFAULT_ROOT, ".blobs"))
+MEDIA_EXTENSIONS = (".png", ".mp4", ".wav")
+
+# Unreferenced blobs younger than this are kept, so a blob is not collected between being stored and linked
+GC_GRACE = 3600
+
+logger = logging.getLogger("flowly.blob_store")
+
+class BlobStore:
+    """Hash-named files that project directories hardlink to"""
+
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def blob_path(self, digest):
+        return os.path.join(self.path, digest[:2], digest)
+
+    def ingest(self, path, digest=None):
+        """Point a file at the blob of its content, storing the content first if it is new
+
+        Returns "stored" (first copy), "linked" (duplicate, its bytes freed),
+        "present" (already linked) or "copy" (hardlinks not possible here)."""
+        digest = digest or file_hash(path)
+        blob = self.blob_path(digest)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        for _ in range(3):
+            try:
+                if os.path.exists(blob):
+                    if os.path.samefile(blob, path):
+                        return "present"
+                    # Swap the file for a link to the blob in one rename; readers see old or new, never neither
+                    link = f"{path}.link"
+                    os.link(blob, link)
+                    os.replace(link, path)
+                    return "linked"
+                os.link(path, blob)
+                return "stored"
+            except FileExistsError:
+                # Stored by another thread or process in the meantime, or a stale .link left by a crash
+                if os.path.exists(f"{path}.link"):
+                    os.remove(f"{path}.link")
+            except FileNotFoundError:
+                # Collected between the exists() check and the link; store this copy instead
+                continue
+            except OSError as e:
+                if e.errno in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP, errno.EOPNOTSUPP):
+                    return "copy"
+                raise
+        return "copy"
+
+    def blobs(self):
+        """(path, stat) of every stored blob"""
+        for prefix in os.listdir(self.path):
+            directory = os.path.join(self.path, prefix)
+            if len(prefix) != 2 or not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                yield path, os.stat(path)
+
+    def stats(self):
+        """Blob count, references, bytes stored and bytes the references would take as copies"""
+        blobs = references = stored = referenced = 0
+        for _, stat in self.blobs():
+            blobs += 1
+            references += stat.st_nlink - 1
+            stored += stat.st_size
+            referenced += stat.st_size * (stat.st_nlink - 1)
+        return {"blobs": blobs, "references": references, "stored_bytes": stored, "referenced_bytes": referenced}
+
+    def gc(self, grace=GC_GRACE, dry_run=False):
+        """Remove blobs no project links to; returns the count and bytes freed"""
+        started = time.time()
+        removed = freed = 0
+        now = time.time()
+        for path, stat in list(self.blobs()):
+            # Linking or unlinking updates ctime, so a blob that just lost or gained a reference is left alone
+            if stat.st_nlink > 1 or now - stat.st_ctime < grace:
+                continue
+            if not dry_run:
+                os.remove(path)
+            removed += 1
+            freed += stat.st_size
+        return {"removed": removed, "freed_bytes": freed, "latency": round(time.time() - started, 3)}
+
+    def verify(self):
+        """Blobs whose content no longer matches their name"""
+        return [path for path, _ in self.blobs() if file_hash(path) != os.path.basename(path)]
+
+def project_files(project_dir):
+    """Media files of a project directory and its exports, relative to it"""
+    for directory, _, filenames in os.walk(project_dir):
+        for filename in filenames:
+            if filename.endswith(MEDIA_EXTENSIONS) and ".partial" not in filename:
+                yield os.path.relpath(os.path.join(directory, filename), project_dir)
+
+def ingest_project(project_dir, store=None):
+    """Move a project's media files into the store; files that already share a blob are skipped without hashing"""
+    started = time.time()
+    store = store or BlobStore()
+    manifest = load_manifest(project_dir)
+    summary = {"stored": 0, "linked": 0, "present": 0, "copy": 0, "freed_bytes": 0, "failed": []}
+    for relative in project_files(project_dir):
+        path = os.path.join(project_dir, relative)
+        stat = os.stat(path)
+        if stat.st_nlink > 1:
+            # Only the store links project files
+            summary["present"] += 1
+            continue
+        try:
+            # Saved scene files have their hash in the manifest already
+            digest = asset_hash(project_dir, manifest, relative)
+            result = store.ingest(path, digest)
+        except OSError as e:
+            logger.warning("Could not store %s: %s", path, e)
+            summary["failed"].append((relative, str(e)))
+            continue
+        summary[result] += 1
+        if result == "linked":
+            summary["freed_bytes"] += stat.st_size
+    summary["latency"] = round(time.time() - started, 3)
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Content-addressed store of saved project files")
+    parser.add_argument("--store", default=DEFAULT_STORE_PATH, help="Blob store directory")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    ingest_parser = subparsers.add_parser("ingest", help="Move project files into the store")
+    ingest_parser.add_argument("project_dirs", nargs="+")
+    subparsers.add_parser("stats", help="Show blob count and space saved")
+    gc_parser = subparsers.add_parser("gc", help="Remove blobs no project links to")
+    gc_parser.add_argument("--grace", type=int, default=GC_GRACE, help="Keep unreferenced blobs younger than this (seconds)")
+    gc_parser.add_argument("--dry-run", action="store_true")
+    subparsers.add_parser("verify", help="Re-hash every blob")
+    args = parser.parse_args()
+
+    store = BlobStore(args.store)
+    if args.command == "ingest":
+        for project_dir in args.project_dirs:
+            summary = ingest_project(project_dir, store)
+            print(f"{project_dir}: {summary['stored']} stored, {summary['linked']} deduplicated "
+                  f"({summary['freed_bytes'] / 1e6:.1f} MB freed), {summary['present']} already stored, "
+                  f"{summary['copy']} left as copies, {len(summary['failed'])} failed")
+    elif args.command == "stats":
+        stats = store.stats()
+        print(f"{stats['blobs']} blobs, {stats['references']} references, {stats['stored_bytes'] / 1e6:.1f} MB stored "
+              f"for {stats['referenced_bytes'] / 1e6:.1f} MB of project files")
+    elif args.command == "gc":
+        summary = store.gc(args.grace, args.dry_run)
+        print(f"{'Would remove' if args.dry_run else 'Removed'} {summary['removed']} blobs "
+              f"({summary['freed_bytes'] / 1e6:.1f} MB)")
+    elif args.command == "verify":
+        corrupt = store.verify()
+        for path in corrupt:
+            print(f"corrupt: {path}")
+        print(f"{len(corrupt)} corrupt blobs")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""Catalog of saved projects in SQLite.
+
+Every project directory under final_videos/ (project_YYYYMMDD_HHMMSS from the
+app, run_YYYYMMDD_HHMMSS from the CLI) gets a row with its prompt, format and
+scene count, one row per scene with its prompts, and one row per saved file
+(image, video, final, mastered, audio). The prompt and scene prompts are also
+kept in an FTS5 table for full-text search. The app writes a project's rows
+on every save; a scan picks up directories saved elsewhere and forgets
+deleted ones, reading only directories that changed since the last scan.
+
+Opening a project rebuilds its storyboard from these rows, so it does not
+read storyboard.json or list the directory again.
+
+    python catalog.py scan
+    python catalog.py search "saturn rings"
+"""
+import argparse
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+DEFAULT_ROOT = "final_videos"
+DEFAULT_CATALOG_PATH = os.getenv("FLOWLY_CATALOG", os.path.join(DEFAULT_ROOT, "catalog.db"))
+
+PROJECT_DIR = re.compile(r"^(project|run)_(\d{8}_\d{6})(?:_\d+)?$")
+# scene_N_<text>_<kind>.<ext>; the CLI saves the video with sound as scene_N_<text>.mp4
+ASSET_FILE = re.compile(r"^scene_(\d+)_(.*?)(?:_(image|video|final|mastered|audio))?\.(png|mp4|wav)$")
+ASSET_KINDS = ["image", "video", "final", "mastered", "audio"]
+
+PROMPT_FIELDS = ["scene_image_prompt", "scene_video_prompt", "scene_sound_prompt"]
+WORD = re.compile(r"\w+")
+
+def scan_assets(project_dir):
+    """Saved scene files of a project directory: {scene number: {kind: filename}}"""
+    assets = {}
+    for filename in os.listdir(project_dir):
+        match = ASSET_FILE.match(filename)
+        if not match:
+            continue
+        number, kind, extension = int(match.group(1)), match.group(3), match.group(4)
+        if kind is None:
+            if extension != "mp4":
+                continue
+            kind = "final"
+        assets.setdefault(number, {})[kind] = filename
+    return assets
+
+def scene_text_from_filename(filename):
+    """Scene text as far as safe_filename kept it"""
+    match = ASSET_FILE.match(filename)
+    return match.group(2).replace("_", " ") if match else ""
+
+def created_time(project_dir):
+    """Creation time from a project directory's name, or from the directory itself"""
+    match = PROJECT_DIR.match(os.path.basename(project_dir))
+    try:
+        return time.mktime(time.strptime(match.group(2), "%Y%m%d_%H%M%S"))
+    except (AttributeError, ValueError):
+        return os.path.getctime(project_dir)
+
+def signature(project_dir):
+    """Changes whenever files are added, replaced or removed (saves write via rename)"""
+    storyboard = os.path.join(project_dir, "storyboard.json")
+    return max(os.path.getmtime(project_dir), os.path.getmtime(storyboard) if os.path.exists(storyboard) else 0)
+
+def fts_query(text):
+    """Prefix match of every word, so user input never breaks the FTS5 query syntax"""
+    return " ".join(f'"{word}"*' for word in WORD.findall(text.lower()))
+
+class Catalog:
+    """Projects, scenes and saved files of every project directory"""
+
+    def __init__(self, path=DEFAULT_CATALOG_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.executescript(
+            "CREATE TABLE IF NOT EXISTS projects (dir TEXT PRIMARY KEY, name TEXT NOT NULL, created REAL NOT NULL, "
+            "saved REAL NOT NULL, signature REAL NOT NULL, prompt TEXT NOT NULL, format_type TEXT, "
+            "scene_count INTEGER NOT NULL, thumbnail TEXT);"
+            "CREATE INDEX IF NOT EXISTS projects_created ON projects (created);"
+            "CREATE TABLE IF NOT EXISTS scenes (dir TEXT NOT NULL, number INTEGER NOT NULL, scene TEXT NOT NULL, "
+            "scene_image_prompt TEXT, scene_video_prompt TEXT, scene_sound_prompt TEXT, state TEXT, "
+            "PRIMARY KEY (dir, number));"
+            "CREATE TABLE IF NOT EXISTS assets (dir TEXT NOT NULL, number INTEGER NOT NULL, kind TEXT NOT NULL, "
+            "filename TEXT NOT NULL, PRIMARY KEY (dir, number, kind));"
+        )
+        try:
+            self.conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS project_text USING fts5(dir UNINDEXED, prompt, scenes)")
+            self.fts = True
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5: search falls back to LIKE on the prompts
+            self.fts = False
+
+    def add_project(self, project_dir, storyboard, prompt="", format_type=None, assets=None, states=None):
+        """Write (or replace) a project's rows
+
+        assets maps scene numbers to {kind: filename}; states holds per-scene
+        extras such as the seed and render quality, as a list of dicts."""
+        project_dir = os.path.abspath(project_dir)
+        scenes = storyboard.get("scenes", [])
+        assets = scan_assets(project_dir) if assets is None else assets
+        images = [assets[number]["image"] for number in sorted(assets) if "image" in assets[number]]
+        text = "\n".join(" ".join([scene.get("scene", "")] + [scene.get(field) or "" for field in PROMPT_FIELDS])
+                         for scene in scenes)
+        name = os.path.basename(project_dir)
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._delete(project_dir)
+                self.conn.execute(
+                    "INSERT INTO projects (dir, name, created, saved, signature, prompt, format_type, scene_count, "
+                    "thumbnail) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (project_dir, name, created_time(project_dir), time.time(), signature(project_dir), prompt, format_type, len(scenes), images[0] if images else None)
+                )
+                self.conn.executemany(
+                    "INSERT INTO scenes (dir, number, scene, scene_image_prompt, scene_video_prompt, scene_sound_prompt, "
+                    "state) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(project_dir, number, scene.get("scene", ""), *[scene.get(field) for field in PROMPT_FIELDS],
+                      json.dumps(states[number - 1]) if states and number <= len(states) else None)
+                     for number, scene in enumerate(scenes, 1)]
+                )
+                self.conn.executemany(
+                    "INSERT INTO assets (dir, number, kind, filename) VALUES (?, ?, ?, ?)",
+                    [(project_dir, number, kind, filename)
+                     for number, files in assets.items() for kind, filename in files.items()]
+                )
+                if self.fts:
+                    self.conn.execute("INSERT INTO project_text (dir, prompt, scenes) VALUES (?, ?, ?)",
+                                      (project_dir, prompt, text))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def index_directory(self, project_dir):
+        """Catalog a project directory from its storyboard.json, original_prompt.txt and file names"""
+        assets = scan_assets(project_dir)
+        storyboard = {}
+        path = os.path.join(project_dir, "storyboard.json")
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    storyboard = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                storyboard = {}
+        if not storyboard.get("scenes"):
+            # CLI runs keep no storyboard; the scene text survives in the file names
+            storyboard = {"scenes": [{"scene": scene_text_from_filename(next(iter(assets[number].values())))}
+                                     for number in sorted(assets)]}
+            assets = {position: assets[number] for position, number in enumerate(sorted(assets), 1)}
+        prompt = storyboard.get("original_prompt", "")
+        path = os.path.join(project_dir, "original_prompt.txt")
+        if not prompt and os.path.exists(path):
+            with open(path) as f:
+                prompt = f.read()
+        self.add_project(project_dir, storyboard, prompt, storyboard.get("format_type"), assets)
+
+    def scan(self, root=DEFAULT_ROOT):
+        """Catalog new and changed project directories under root and forget deleted ones"""
+        started = time.time()
+        root = os.path.abspath(root)
+        found = {}
+        if os.path.isdir(root):
+            for name in os.listdir(root):
+                project_dir = os.path.join(root, name)
+                if PROJECT_DIR.match(name) and os.path.isdir(project_dir):
+                    found[project_dir] = signature(project_dir)
+        with self.lock:
+            known = dict(self.conn.execute(
+                "SELECT dir, signature FROM projects WHERE dir >= ? AND dir < ?", (root + os.sep, root + chr(ord(os.sep) + 1))
+            ))
+        changed = [project_dir for project_dir, stamp in found.items() if known.get(project_dir) != stamp]
+        removed = [project_dir for project_dir in known if project_dir not in found]
+        failed = []
+        for project_dir in changed:
+            try:
+                self.index_directory(project_dir)
+            except (OSError, ValueError) as e:
+                failed.append((project_dir, str(e)))
+        with self.lock:
+            for project_dir in removed:
+                self._delete(project_dir)
+        return {"indexed": len(changed) - len(failed), "removed": len(removed), "failed": failed,
+                "total": self.count(), "latency": round(time.time() - started, 3)}
+
+    def _delete(self, project_dir):
+        for table in ["projects", "scenes", "assets"] + (["project_text"] if self.fts else []):
+            self.conn.execute(f"DELETE FROM {table} WHERE dir = ?", (project_dir,))
+
+    def remove(self, project_dir):
+        with self.lock:
+            self._delete(os.path.abspath(project_dir))
+
+    def count(self, query=""):
+        """Number of projects, or of projects matching a search"""
+        sql, params = self._matching(query)
+        with self.lock:
+            return self.conn.execute(f"SELECT COUNT(*) FROM ({sql})", params).fetchone()[0]
+
+    def _matching(self, query):
+        # Directories of the projects matching a search, best match first
+        if not WORD.search(query or ""):
+            return "SELECT dir FROM projects ORDER BY created DESC", ()
+        if self.fts:
+            return "SELECT dir FROM project_text WHERE project_text MATCH ? ORDER BY bm25(project_text)", (fts_query(query),)
+        pattern = f"%{query.strip()}%"
+        return ("SELECT DISTINCT projects.dir FROM projects LEFT JOIN scenes ON scenes.dir = projects.dir "
+                "WHERE projects.prompt LIKE ? OR scenes.scene LIKE ? OR scenes.scene_image_prompt LIKE ? "
+                "OR scenes.scene_video_prompt LIKE ? OR scenes.scene_sound_prompt LIKE ? ORDER BY projects.created DESC",
+                (pattern,) * 5)
+
+    def list_projects(self, query="", limit=20, offset=0):
+        """One page of projects, newest first or best search match first"""
+        sql, params = self._matching(query)
+        with self.lock:
+            page = [row[0] for row in self.conn.execute(f"{sql} LIMIT ? OFFSET ?", (*params, limit, offset))]
+            rows = self.conn.execute(
+                f"SELECT dir, name, created, saved, prompt, format_type, scene_count, thumbnail, "
+                f"(SELECT COUNT(DISTINCT number) FROM assets WHERE assets.dir = projects.dir AND kind IN ('final', 'mastered')) "
+                f"FROM projects WHERE dir IN ({', '.join('?' * len(page))})", page
+            ).fetchall()
+        by_dir = {row[0]: dict(zip(["dir", "name", "created", "saved", "prompt", "format_type", "scene_count", "thumbnail",
+                                    "finished_scenes"], row)) for row in rows}
+        projects = [by_dir[project_dir] for project_dir in page if project_dir in by_dir]
+        for project in projects:
+            if project["thumbnail"]:
+                project["thumbnail"] = os.path.join(project["dir"], project["thumbnail"])
+        return projects
+
+    def open_project(self, project_dir):
+        """A project's prompt, format and scenes with their saved files (absolute paths), or None"""
+        project_dir = os.path.abspath(project_dir)
+        with self.lock:
+            project = self.conn.execute("SELECT prompt, format_type FROM projects WHERE dir = ?", (project_dir,)).fetchone()
+            if project is None:
+                return None
+            scenes = self.conn.execute(
+                f"SELECT number, scene, {', '.join(PROMPT_FIELDS)}, state FROM scenes WHERE dir = ? ORDER BY number",
+                (project_dir,)
+            ).fetchall()
+            assets = self.conn.execute("SELECT number, kind, filename FROM assets WHERE dir = ?", (project_dir,)).fetchall()
+        files = {}
+        for number, kind, filename in assets:
+            files.setdefault(number, {})[kind] = os.path.join(project_dir, filename)
+        return {
+            "dir": project_dir,
+            "prompt": project[0],
+            "format_type": project[1],
+            "scenes": [{"scene": row[1], **{field: row[2 + i] or "" for i, field in enumerate(PROMPT_FIELDS)},
+                        "state": json.loads(row[5]) if row[5] else {}, "files": files.get(row[0], {})}
+                       for row in scenes]
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description="Catalog of saved projects")
+    parser.add_argument("--catalog", default=DEFAULT_CATALOG_PATH, help="Path of the catalog database")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    scan_parser = subparsers.add_parser("scan", help="Catalog new and changed project directories")
+    scan_parser.add_argument("--root", default=DEFAULT_ROOT)
+    search_parser = subparsers.add_parser("search", help="List projects, optionally matching a search")
+    search_parser.add_argument("query", nargs="?", default="")
+    search_parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    catalog = Catalog(args.catalog)
+    if args.command == "scan":
+        summary = catalog.scan(args.root)
+        print(f"{summary['indexed']} indexed, {summary['removed']} removed, {len(summary['failed'])} failed; "
+              f"{summary['total']} projects in {summary['latency']:.2f}s")
+        for project_dir, error in summary["failed"]:
+            print(f"  {project_dir}: {error}")
+    elif args.command == "search":
+        for project in catalog.list_projects(args.query, args.limit):
+            print(f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(project['created']))}  "
+                  f"{project['scene_count']:3d} scenes  {project['name']}  {project['prompt'][:60]!r}")
+
+if __name__ == "__main__":
+    main()
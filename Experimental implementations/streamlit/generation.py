@@ -0,0 +1,215 @@
+import asyncio
+import base64
+import os
+import tempfile
+import time
+from contextlib import ExitStack
+
+import replicate
+import requests
+from replicate.exceptions import ModelError, ReplicateError
+from replicate.helpers import transform_output
+
+import metrics
+from models import MODEL_REGISTRY, get_router
+from prompt_index import remember
+
+# Default (first choice) Replicate model of each generation stage
+STAGE_MODELS = {stage: next(iter(models)) for stage, models in MODEL_REGISTRY.items()}
+
+IMAGE_MODEL = STAGE_MODELS["image"]
+VIDEO_MODEL = STAGE_MODELS["video"]
+SOUND_MODEL = STAGE_MODELS["sound"]
+
+# Fake backend for load tests and offline runs: no Replicate calls, placeholder files after a delay
+FAKE_GENERATION = os.getenv("FLOWLY_FAKE_GENERATION", "") not in ("", "0")
+FAKE_LATENCY = float(os.getenv("FLOWLY_FAKE_LATENCY", "1.0"))
+# Stage arguments that name an input file: an output URL, or a local file once the URL is gone
+# (reopened projects, reused shots and cached outputs)
+FILE_INPUTS = ("image_url", "video_url")
+
+# 1x1 PNG so image widgets can render the placeholder
+FAKE_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
+)
+
+def model_name(model):
+    """Strip the pinned version from a model reference"""
+    return model.split(":")[0]
+
+def output_models(models):
+    """Names the outputs of these models are remembered under in the prompt index"""
+    return ["fake"] if FAKE_GENERATION else [model_name(model) for model in models]
+
+def output_url(output):
+    """URL of a prediction output (file output, list of file outputs or plain URL)"""
+    if isinstance(output, (list, tuple)):
+        output = output[0]
+    return getattr(output, "url", output)
+
+def _download(url, path):
+    response = requests.get(url, stream=True, timeout=60)
+    response.raise_for_status()
+    with open(path, "wb") as f:
+        for chunk in response.iter_content(chunk_size=65536):
+            f.write(chunk)
+
+async def save_output(output, path):
+    """Stream a prediction output straight to disk and return the local path"""
+    if isinstance(output, (list, tuple)):
+        output = output[0]
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    partial = f"{path}.partial"
+    try:
+        if hasattr(output, "__aiter__"):
+            # Reuses the Replicate SDK's HTTP client instead of a second requests.get
+            with open(partial, "wb") as f:
+                async for chunk in output:
+                    f.write(chunk)
+        else:
+            await asyncio.to_thread(_download, output_url(output), partial)
+    except Exception:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    os.replace(partial, path)
+    return path
+
+def open_inputs(kwargs, files):
+    """Stage arguments with local input files opened, so Replicate uploads them instead of getting a path
+
+    The files are closed by the ExitStack files."""
+    return {key: files.enter_context(open(value, "rb"))
+            if key in FILE_INPUTS and isinstance(value, str) and os.path.isfile(value) else value
+            for key, value in kwargs.items()}
+
+def _fake_output(stage):
+    """Local placeholder file standing in for a stage output"""
+    directory = os.path.join(tempfile.gettempdir(), "flowly_fake")
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{stage}.png" if stage == "image" else f"{stage}.mp4")
+    if not os.path.exists(path):
+        with open(path, "wb") as f:
+            f.write(FAKE_PNG if stage == "image" else b"\0" * 1024)
+    return path
+
+def remember_output(stage, model, url, prompt="", quality="final", image_url=None, video_url=None, **_):
+    """Index a finished prediction by its prompt and input asset for near-duplicate reuse"""
+    if url and prompt:
+        remember(stage, model_name(model), quality, prompt, url, image_url or video_url or "")
+
+async def _run_fake(stage, save_to, **kwargs):
+    started = time.time()
+    await asyncio.sleep(FAKE_LATENCY)
+    output = _fake_output(stage)
+    metrics.record("prediction", stage=stage, model="fake", ok=True, latency=round(time.time() - started, 3),
+                   failover=False, quality=kwargs.get("quality", "final"))
+    remember_output(stage, "fake", output, **kwargs)
+    if save_to:
+        with open(output, "rb") as src, open(save_to, "wb") as dst:
+            dst.write(src.read())
+        return output, save_to
+    return output
+
+# Latest versions of unpinned community models, which the official-model endpoint does not serve
+_latest_versions = {}
+
+async def _create_prediction(model, input):
+    name, _, version = model.partition(":")
+    version = version or _latest_versions.get(name)
+    if version:
+        return await replicate.predictions.async_create(version=version, input=input)
+    try:
+        return await replicate.models.predictions.async_create(model=name, input=input)
+    except ReplicateError as e:
+        if e.status != 404:
+            raise
+    latest = (await replicate.models.async_get(name)).latest_version
+    if latest is None:
+        raise RuntimeError(f"{name} has no published version")
+    _latest_versions[name] = latest.id
+    for value in input.values():
+        # Uploaded input files are read again for the retry
+        if hasattr(value, "seek"):
+            value.seek(0)
+    return await replicate.predictions.async_create(version=latest.id, input=input)
+
+async def run_prediction(model, input):
+    """replicate.async_run that keeps the prediction, so cancelling the task also cancels it on Replicate
+
+    Unpinned names run the official model, or the latest version of a community model."""
+    prediction = await _create_prediction(model, input)
+    try:
+        await prediction.async_wait()
+    except asyncio.CancelledError:
+        # Superseded regeneration: stop paying for a result nobody will use
+        try:
+            await prediction.async_cancel()
+        except Exception as e:
+            metrics.record("prediction_cancel_failed", model=model, prediction=prediction.id, error=str(e))
+        raise
+    if prediction.status != "succeeded":
+        raise ModelError(prediction)
+    return transform_output(prediction.output, replicate.default_client)
+
+async def run_stage(stage, save_to=None, routing=None, **kwargs):
+    """Run a stage on the model chosen by its router, failing over to the next model on errors
+
+    routing ({"models": [...], "policy": ...}) replaces the router's default models and policy.
+    Returns the output URL, or (url, local_path) when save_to is given and the file was streamed there."""
+    if FAKE_GENERATION:
+        return await _run_fake(stage, save_to, **kwargs)
+    router = get_router(stage)
+    routing = routing or {}
+    tried = []
+    last_error = None
+    while True:
+        model = router.choose(exclude=tried, models=routing.get("models"), policy=routing.get("policy"))
+        if model is None:
+            if last_error is None:
+                # Nothing was tried, e.g. the session's models are no longer in the registry
+                raise RuntimeError(f"No enabled {stage} model among {routing.get('models')}")
+            raise last_error
+        tried.append(model)
+        started = time.time()
+        try:
+            # Opened again for every model tried, since an upload reads the file to the end
+            with ExitStack() as files:
+                output = await run_prediction(model, router.adapter(model)(**open_inputs(kwargs, files)))
+        except asyncio.CancelledError:
+            metrics.record("prediction", stage=stage, model=model, ok=False, cancelled=True,
+                           latency=round(time.time() - started, 3))
+            raise
+        except Exception as e:
+            router.record_failure(model, e)
+            metrics.record("prediction", stage=stage, model=model, ok=False,
+                           latency=round(time.time() - started, 3), error=str(e))
+            last_error = e
+            continue
+        latency = time.time() - started
+        router.record_success(model, latency)
+        metrics.record("prediction", stage=stage, model=model, ok=True, latency=round(latency, 3),
+                       failover=len(tried) > 1, quality=kwargs.get("quality", "final"))
+        remember_output(stage, model, output_url(output), **kwargs)
+        if save_to:
+            return output_url(output), await save_output(output, save_to)
+        return output_url(output)
+
+# AI Generation Functions (from original code)
+# With save_to the output is also streamed to that path and (url, local_path) is returned;
+# routing picks the models and policy for this call (see run_stage)
+async def _generate_image(prompt, quality="final", seed=None, save_to=None, routing=None):
+    """Generate image using Replicate"""
+    return await run_stage("image", save_to, routing, prompt=prompt, quality=quality, seed=seed)
+
+async def _generate_video(prompt, image_url, quality="final", save_to=None, routing=None):
+    """Generate video using Replicate"""
+    return await run_stage("video", save_to, routing, prompt=prompt, image_url=image_url, quality=quality)
+
+async def _generate_sound(video_url, prompt, quality="final", save_to=None, routing=None):
+    """Generate sound using Replicate"""
+    return await run_stage("sound", save_to, routing, prompt=prompt, video_url=video_url, quality=quality)
+
+async def _generate_audio(prompt, quality="final", save_to=None, routing=None):
+    """Generate a sound track from the sound prompt alone, so it can run alongside the video"""
+    return await run_stage("audio", save_to, routing, prompt=prompt, quality=quality)
@@ -0,0 +1,155 @@
+"""Process-wide generation service shared by every browser session.
+
+All predictions of the deployment run on one event loop owned by the
+service, under global per-stage concurrency limits. Waiting jobs are queued
+per session and dispatched with deficit round robin: on its turn a session
+receives QUANTUM * weight credit and may start jobs until their cost uses it
+up, so a long batch from one user cannot starve everyone else.
+"""
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import CancelledError, Future
+
+# Predictions allowed in flight at once for the whole deployment
+STAGE_CONCURRENCY = {"image": 8, "video": 4, "sound": 4, "audio": 4}
+
+# Scheduling cost of a job; a final render takes about twice the model time of a draft
+JOB_COST = {"draft": 1, "final": 2}
+QUANTUM = 2
+
+class Job:
+    def __init__(self, session, stage, cost, func, args):
+        self.session = session
+        self.stage = stage
+        self.cost = cost
+        self.func = func
+        self.args = args
+        self.future = Future()
+        self.task = None
+
+def next_job(queues, deficits, weights):
+    """Take the next job in deficit round robin order (mutates queues and deficits)"""
+    while queues:
+        session, jobs = next(iter(queues.items()))
+        if deficits.get(session, 0) >= jobs[0].cost:
+            deficits[session] -= jobs[0].cost
+            job = jobs.popleft()
+            if not jobs:
+                # An idle session does not keep its credit
+                del queues[session]
+                deficits.pop(session, None)
+            return job
+        # Out of credit: the turn passes and the session is topped up for the next round
+        queues.move_to_end(session)
+        deficits[session] = deficits.get(session, 0) + QUANTUM * weights.get(session, 1)
+    return None
+
+class GenerationService:
+    """Runs generation coroutines for all sessions under shared limits with fair scheduling"""
+
+    def __init__(self, limits=None):
+        self.limits = dict(STAGE_CONCURRENCY if limits is None else limits)
+        self.lock = threading.Lock()
+        self.queues = {stage: OrderedDict() for stage in self.limits}
+        self.deficits = {stage: {} for stage in self.limits}
+        self.running = {stage: [] for stage in self.limits}
+        self.weights = {}
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="flowly-generation", daemon=True)
+        self.thread.start()
+
+    def set_weight(self, session, weight):
+        """Give a session a larger (or smaller) share of every stage"""
+        # A session without credit would never be served, and the scheduler would spin looking for credit
+        if not weight > 0:
+            raise ValueError(f"Session weight must be positive, got {weight}")
+        with self.lock:
+            self.weights[session] = weight
+
+    def submit(self, session, stage, quality, func, *args):
+        """Queue func(*args) for a session; returns a concurrent.futures.Future with its result"""
+        job = Job(session, stage, JOB_COST.get(quality, JOB_COST["final"]), func, args)
+        with self.lock:
+            self.queues[stage].setdefault(session, deque()).append(job)
+        self.loop.call_soon_threadsafe(self._dispatch, stage)
+        return job.future
+
+    def _dispatch(self, stage):
+        """Start queued jobs while the stage has free slots (runs on the service loop)"""
+        with self.lock:
+            while len(self.running[stage]) < self.limits[stage]:
+                job = next_job(self.queues[stage], self.deficits[stage], self.weights)
+                if job is None:
+                    break
+                # The session gave up on this job (e.g. the script was stopped)
+                if not job.future.set_running_or_notify_cancel():
+                    continue
+                self.running[stage].append(job)
+                job.task = self.loop.create_task(self._run(job))
+
+    async def _run(self, job):
+        try:
+            job.future.set_result(await job.func(*job.args))
+        except asyncio.CancelledError:
+            # cancel() stopped the prediction; its waiter sees a cancelled job
+            job.future.set_exception(CancelledError())
+        except Exception as e:
+            job.future.set_exception(e)
+        finally:
+            with self.lock:
+                self.running[job.stage].remove(job)
+            self._dispatch(job.stage)
+
+    def cancel(self, future):
+        """Drop a queued job or cancel a running one (which cancels its prediction); returns False if it already finished"""
+        with self.lock:
+            for stage in self.limits:
+                for session, jobs in self.queues[stage].items():
+                    for job in jobs:
+                        if job.future is future:
+                            jobs.remove(job)
+                            if not jobs:
+                                del self.queues[stage][session]
+                                self.deficits[stage].pop(session, None)
+                            future.cancel()
+                            return True
+                for job in self.running[stage]:
+                    if job.future is future:
+                        self.loop.call_soon_threadsafe(job.task.cancel)
+                        return True
+        return False
+
+    def status(self, session):
+        """Running and queued jobs of a session and how many jobs will start before its next one"""
+        with self.lock:
+            running = sum(1 for stage in self.limits for job in self.running[stage] if job.session == session)
+            queued = sum(len(self.queues[stage].get(session, ())) for stage in self.limits)
+            ahead = None
+            for stage in self.limits:
+                if session not in self.queues[stage]:
+                    continue
+                # Replay the scheduler on a copy of the queues to find the session's next dispatch
+                queues = OrderedDict((s, deque(jobs)) for s, jobs in self.queues[stage].items())
+                deficits = dict(self.deficits[stage])
+                position = 0
+                while True:
+                    job = next_job(queues, deficits, self.weights)
+                    if job is None or job.session == session:
+                        break
+                    position += 1
+                ahead = position if ahead is None else min(ahead, position)
+        return {"running": running, "queued": queued, "ahead": ahead}
+
+    def snapshot(self):
+        """In-flight and queued jobs per stage for the whole deployment"""
+        with self.lock:
+            return {
+                stage: {
+                    "running": len(self.running[stage]),
+                    "limit": self.limits[stage],
+                    "queued": sum(len(jobs) for jobs in self.queues[stage].values()),
+                    "sessions": len(self.queues[stage])
+                }
+                for stage in self.limits
+            }
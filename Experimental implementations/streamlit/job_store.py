@@ -0,0 +1,341 @@
+"""SQLite job store shared by generation worker processes.
+
+Every scene is split into an image, a video and a sound job. Workers claim
+a job under a lease, renew it with heartbeats while the prediction runs and
+then complete or fail it. A lease that stops being renewed expires and the
+job goes back to the queue, so stages held by a dead worker are retried.
+
+Claims run inside one write transaction, which is also where the per-model
+limits are checked, so the limits hold across every process (and machine)
+that opens the same database file. The claim also picks the model the job
+runs on: the first model in the stage's routing order that is healthy and
+under its limits. Model health is kept in the store as well: failed jobs
+count against their model, and after FAILURES_BEFORE_COOLDOWN failures in a
+row every worker routes around it for FAILURE_COOLDOWN seconds. A job that
+fails is retried on the next model, so failover happens between attempts and
+every prediction counts against the limits of the model that actually ran
+it. Only the latency ranking of the "latency" policy stays per worker.
+"""
+import json
+import os
+import sqlite3
+import time
+import uuid
+
+from generation import STAGE_MODELS, model_name
+from models import FAILURE_COOLDOWN, FAILURES_BEFORE_COOLDOWN, get_router
+
+STAGES = ["image", "video", "sound"]
+
+DEFAULT_STORE_PATH = os.getenv("FLOWLY_JOB_STORE", "jobs.db")
+DEFAULT_LEASE_SECONDS = 60
+MAX_ATTEMPTS = 3
+
+# Global per-model limits: predictions in flight and predictions started per minute
+MODEL_RATE_LIMITS = {
+    "bytedance/seedream-3": {"max_in_flight": 8, "per_minute": 60},
+    "black-forest-labs/flux-schnell": {"max_in_flight": 8, "per_minute": 60},
+    "kwaivgi/kling-v2.1": {"max_in_flight": 4, "per_minute": 20},
+    "kwaivgi/kling-v1.6-pro": {"max_in_flight": 4, "per_minute": 20},
+    "bytedance/seedance-1-lite": {"max_in_flight": 4, "per_minute": 20},
+    "zsxkib/thinksound": {"max_in_flight": 4, "per_minute": 30},
+    "zsxkib/mmaudio": {"max_in_flight": 4, "per_minute": 30},
+    "sepal/audiogen": {"max_in_flight": 4, "per_minute": 30},
+    "declare-lab/tango": {"max_in_flight": 4, "per_minute": 30}
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    project TEXT NOT NULL,
+    scene_index INTEGER NOT NULL,
+    stage TEXT NOT NULL,
+    model TEXT NOT NULL,
+    depends_on TEXT,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_expires REAL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);
+CREATE INDEX IF NOT EXISTS jobs_project ON jobs (project, scene_index);
+CREATE TABLE IF NOT EXISTS model_starts (
+    model TEXT NOT NULL,
+    started REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS model_starts_model ON model_starts (model, started);
+CREATE TABLE IF NOT EXISTS model_health (
+    model TEXT PRIMARY KEY,
+    failures INTEGER NOT NULL DEFAULT 0,
+    unhealthy_until REAL NOT NULL DEFAULT 0
+);
+"""
+
+class JobStore:
+    """Job queue with leases, heartbeats and global per-model rate limits"""
+
+    def __init__(self, path=DEFAULT_STORE_PATH, lease_seconds=DEFAULT_LEASE_SECONDS, rate_limits=None):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.rate_limits = MODEL_RATE_LIMITS if rate_limits is None else rate_limits
+        # Autocommit mode so every write takes the lock explicitly with BEGIN IMMEDIATE.
+        # The default rollback journal is kept because WAL needs shared memory on a single host.
+        # A store is used by one task at a time, but workers call it through asyncio.to_thread.
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def _transaction(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+
+    def enqueue_scene(self, project, scene_index, scene):
+        """Queue the image, video and sound jobs for one scene"""
+        prompts = {
+            "image": scene["scene_image_prompt"],
+            "video": scene["scene_video_prompt"],
+            "sound": scene["scene_sound_prompt"]
+        }
+        now = time.time()
+        job_ids = []
+        parent = None
+        self._transaction()
+        try:
+            for stage in STAGES:
+                job_id = uuid.uuid4().hex
+                # The model is chosen again when the job is claimed
+                self.conn.execute(
+                    "INSERT INTO jobs (id, project, scene_index, stage, model, depends_on, payload, created, updated) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, project, scene_index, stage, STAGE_MODELS[stage], parent,
+                     json.dumps({"prompt": prompts[stage]}), now, now)
+                )
+                job_ids.append(job_id)
+                parent = job_id
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return job_ids
+
+    def enqueue_storyboard(self, project, scenes):
+        """Queue every scene of a storyboard"""
+        return [self.enqueue_scene(project, i, scene) for i, scene in enumerate(scenes)]
+
+    def _expire_leases(self, now):
+        """Return jobs with expired leases to the queue (caller holds the write lock)"""
+        self.conn.execute(
+            "UPDATE jobs SET status = 'pending', worker = NULL, lease_expires = NULL, "
+            "error = 'lease expired', updated = ? "
+            "WHERE status = 'leased' AND lease_expires < ? AND attempts < ?",
+            (now, now, MAX_ATTEMPTS)
+        )
+        expired = self.conn.execute(
+            "SELECT id FROM jobs WHERE status = 'leased' AND lease_expires < ?", (now,)
+        ).fetchall()
+        for row in expired:
+            self._mark_failed(row["id"], "lease expired too many times", now)
+
+    def _mark_failed(self, job_id, error, now):
+        """Fail a job and every job that depends on it"""
+        pending = [(job_id, error)]
+        while pending:
+            current, reason = pending.pop()
+            self.conn.execute(
+                "UPDATE jobs SET status = 'failed', worker = NULL, lease_expires = NULL, error = ?, updated = ? WHERE id = ?",
+                (reason, now, current)
+            )
+            children = self.conn.execute("SELECT id FROM jobs WHERE depends_on = ?", (current,)).fetchall()
+            pending.extend((child["id"], f"dependency {current} failed") for child in children)
+
+    def _model_allowed(self, model, now):
+        """Check the global limits for a model (caller holds the write lock)"""
+        limits = self.rate_limits.get(model_name(model))
+        if not limits:
+            return True
+        if "max_in_flight" in limits:
+            in_flight = self.conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'leased' AND model = ?", (model,)
+            ).fetchone()[0]
+            if in_flight >= limits["max_in_flight"]:
+                return False
+        if "per_minute" in limits:
+            started = self.conn.execute(
+                "SELECT COUNT(*) FROM model_starts WHERE model = ? AND started > ?", (model, now - 60)
+            ).fetchone()[0]
+            if started >= limits["per_minute"]:
+                return False
+        return True
+
+    def _choose_model(self, stage, now, blocked_models):
+        """First model in the stage's routing order that is healthy and under its limits (caller holds the write lock)
+
+        When every model under its limits is cooling down, the one that recovers first is used."""
+        router = get_router(stage)
+        cooling = dict(self.conn.execute(
+            "SELECT model, unhealthy_until FROM model_health WHERE unhealthy_until > ?", (now,)
+        ).fetchall())
+        tried = []
+        allowed = []
+        while True:
+            model = router.choose(exclude=tried)
+            if model is None:
+                break
+            tried.append(model)
+            if model in blocked_models:
+                continue
+            if not self._model_allowed(model, now):
+                blocked_models.add(model)
+                continue
+            if model not in cooling:
+                return model
+            allowed.append(model)
+        return min(allowed, key=cooling.get) if allowed else None
+
+    def _record_model_result(self, model, ok, now):
+        """Count a failure of a model, or reset its failures after a success (caller holds the write lock)"""
+        if ok:
+            self.conn.execute("UPDATE model_health SET failures = 0 WHERE model = ?", (model,))
+            return
+        self.conn.execute(
+            "INSERT INTO model_health (model, failures) VALUES (?, 1) "
+            "ON CONFLICT(model) DO UPDATE SET failures = failures + 1",
+            (model,)
+        )
+        self.conn.execute(
+            "UPDATE model_health SET unhealthy_until = ? WHERE model = ? AND failures >= ?",
+            (now + FAILURE_COOLDOWN, model, FAILURES_BEFORE_COOLDOWN)
+        )
+
+    def claim(self, worker_id, stages=None):
+        """Lease the oldest runnable job whose model is under its limits, or return None"""
+        now = time.time()
+        self._transaction()
+        try:
+            self._expire_leases(now)
+            self.conn.execute("DELETE FROM model_starts WHERE started < ?", (now - 60,))
+            candidates = self.conn.execute(
+                "SELECT j.*, p.result AS parent_result FROM jobs j "
+                "LEFT JOIN jobs p ON p.id = j.depends_on "
+                "WHERE j.status = 'pending' AND (j.depends_on IS NULL OR p.status = 'done') "
+                "ORDER BY j.created, j.scene_index"
+            ).fetchall()
+            job = None
+            model = None
+            blocked_models = set()
+            for row in candidates:
+                if stages and row["stage"] not in stages:
+                    continue
+                model = self._choose_model(row["stage"], now, blocked_models)
+                if model is None:
+                    continue
+                job = row
+                break
+            if job is None:
+                self.conn.execute("COMMIT")
+                return None
+            self.conn.execute(
+                "UPDATE jobs SET status = 'leased', model = ?, worker = ?, lease_expires = ?, attempts = attempts + 1, "
+                "updated = ? WHERE id = ?",
+                (model, worker_id, now + self.lease_seconds, now, job["id"])
+            )
+            self.conn.execute("INSERT INTO model_starts (model, started) VALUES (?, ?)", (model, now))
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return {
+            "id": job["id"],
+            "project": job["project"],
+            "scene_index": job["scene_index"],
+            "stage": job["stage"],
+            "model": model,
+            "payload": json.loads(job["payload"]),
+            "parent_result": json.loads(job["parent_result"]) if job["parent_result"] else None,
+            "attempts": job["attempts"] + 1
+        }
+
+    def heartbeat(self, job_id, worker_id):
+        """Extend a lease; returns False when the worker no longer owns the job"""
+        now = time.time()
+        cursor = self.conn.execute(
+            "UPDATE jobs SET lease_expires = ?, updated = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+            (now + self.lease_seconds, now, job_id, worker_id)
+        )
+        return cursor.rowcount == 1
+
+    def complete(self, job_id, worker_id, result):
+        """Store a job result; returns False when the lease was lost in the meantime"""
+        now = time.time()
+        self._transaction()
+        try:
+            row = self.conn.execute(
+                "SELECT model FROM jobs WHERE id = ? AND worker = ? AND status = 'leased'", (job_id, worker_id)
+            ).fetchone()
+            if row is not None:
+                self.conn.execute(
+                    "UPDATE jobs SET status = 'done', result = ?, error = NULL, worker = NULL, lease_expires = NULL, "
+                    "updated = ? WHERE id = ?",
+                    (json.dumps(result), now, job_id)
+                )
+                self._record_model_result(row["model"], True, now)
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return row is not None
+
+    def fail(self, job_id, worker_id, error):
+        """Count the failure against the job's model and release the job for retry, or fail it for good after MAX_ATTEMPTS"""
+        now = time.time()
+        self._transaction()
+        try:
+            row = self.conn.execute(
+                "SELECT attempts, model FROM jobs WHERE id = ? AND worker = ? AND status = 'leased'", (job_id, worker_id)
+            ).fetchone()
+            if row is None:
+                self.conn.execute("COMMIT")
+                return False
+            self._record_model_result(row["model"], False, now)
+            if row["attempts"] >= MAX_ATTEMPTS:
+                self._mark_failed(job_id, error, now)
+            else:
+                self.conn.execute(
+                    "UPDATE jobs SET status = 'pending', worker = NULL, lease_expires = NULL, error = ?, updated = ? WHERE id = ?",
+                    (error, now, job_id)
+                )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return True
+
+    def project_status(self, project):
+        """Return every job of a project in scene and stage order"""
+        rows = self.conn.execute(
+            "SELECT id, scene_index, stage, model, status, result, error, attempts, worker FROM jobs WHERE project = ?",
+            (project,)
+        ).fetchall()
+        jobs = []
+        for row in rows:
+            job = dict(row)
+            job["result"] = json.loads(job["result"]) if job["result"] else None
+            jobs.append(job)
+        jobs.sort(key=lambda job: (job["scene_index"], STAGES.index(job["stage"])))
+        return jobs
+
+    def has_unfinished(self, project=None):
+        """Check whether any job is still pending or leased"""
+        query = "SELECT COUNT(*) FROM jobs WHERE status IN ('pending', 'leased')"
+        params = ()
+        if project:
+            query += " AND project = ?"
+            params = (project,)
+        return self.conn.execute(query, params).fetchone()[0] > 0
@@ -0,0 +1,220 @@
+"""Concurrent-user load test for the Streamlit app.
+
+Drives N simulated sessions through the real app.py flow (enter a concept,
+demo storyboard, generate all, edit a prompt, save) with Streamlit's AppTest
+against the fake generation backend, and reports rerun latency, memory per
+session and throughput for each N.
+
+    python loadtest.py --sessions 1 2 4 8 --latency 0.5 --output loadtest.json
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_FILE = os.path.join(APP_DIR, "app.py")
+
+def rss_mb():
+    """Resident memory of this process in MB"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # Peak RSS (KB on Linux) where /proc is not available
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def allow_concurrent_sessions():
+    """Make AppTest usable from several threads at once
+
+    AppTest is built for one test at a time: every run installs a process-wide
+    mock runtime and the global.appTest option and removes them at the end,
+    which pulls them out from under the sessions still running, and each test
+    compiles the script itself. A real server shares one runtime and one script
+    cache between all its sessions, so that is what the simulated sessions get.
+    """
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+
+    # The option is restored to its previous value after each run, so it stays on
+    config.set_option("global.appTest", True)
+
+    pinned = {}
+    original_instance = Runtime.instance.__func__
+
+    def instance(cls):
+        if cls._instance is not None:
+            pinned.setdefault("runtime", cls._instance)
+        if "runtime" in pinned:
+            return pinned["runtime"]
+        return original_instance(cls)
+
+    def exists(cls):
+        return cls._instance is not None or "runtime" in pinned
+
+    Runtime.instance = classmethod(instance)
+    Runtime.exists = classmethod(exists)
+
+    # Compiling the same script in several threads at once is not safe on every Python version
+    lock = threading.Lock()
+    compiled = {}
+    original_get_bytecode = ScriptCache.get_bytecode
+
+    def get_bytecode(self, script_path):
+        with lock:
+            if script_path not in compiled:
+                compiled[script_path] = original_get_bytecode(self, script_path)
+            return compiled[script_path]
+
+    ScriptCache.get_bytecode = get_bytecode
+
+def find_button(at, label):
+    for button in at.button:
+        if button.label == label:
+            return button
+    raise RuntimeError(f"Button not found: {label}")
+
+def run_session(session_number, timeout, results):
+    """One simulated user going through the whole flow; records the latency of every rerun"""
+    from streamlit.testing.v1 import AppTest
+
+    reruns = []
+
+    def step(name, action):
+        started = time.perf_counter()
+        try:
+            action()
+        except Exception as e:
+            raise RuntimeError(f"{name}: {e!r}") from e
+        reruns.append({"step": name, "latency": time.perf_counter() - started})
+        if at.exception:
+            raise RuntimeError(f"{name}: {at.exception[0].value}")
+
+    at = AppTest.from_file(APP_FILE, default_timeout=timeout)
+    started = time.perf_counter()
+    try:
+        step("open", at.run)
+        step("input", lambda: at.text_area[0].input(f"Load test concept {session_number}").run())
+        step("demo storyboard", lambda: find_button(at, "🎬 Demo Storyboard").click().run())
+        step("generate all", lambda: find_button(at, "▶️ Generate All").click().run())
+        if not all(state["sound_generated"] for state in at.session_state.scene_states):
+            errors = [element.value for element in at.error]
+            raise RuntimeError(f"generate all: scenes left unrendered {errors}")
+        step("open prompt editor", lambda: at.button(key="edit_0").click().run())
+        step("edit prompt", lambda: at.text_area(key="popup_img_prompt_0").input(f"Edited prompt {session_number}").run())
+        step("save prompt", lambda: find_button(at, "💾 Save Changes").click().run())
+        step("save project", lambda: find_button(at, "💾 Save").click().run())
+        error = None
+    except Exception as e:
+        error = str(e)
+    results.append({
+        "session": session_number,
+        "duration": time.perf_counter() - started,
+        "reruns": reruns,
+        "error": error
+    })
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def run_level(sessions, timeout):
+    """Run N sessions concurrently and summarize them"""
+    results = []
+    rss_before = rss_mb()
+    threads = [threading.Thread(target=run_session, args=(i, timeout, results)) for i in range(sessions)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    rss_after = rss_mb()
+
+    latencies = [rerun["latency"] for result in results for rerun in result["reruns"]]
+    # Generation waits on the fake predictions; the other reruns are pure app overhead
+    interactive = [rerun["latency"] for result in results for rerun in result["reruns"]
+                   if rerun["step"] != "generate all"]
+    completed = [result for result in results if not result["error"]]
+    steps = {}
+    for result in results:
+        for rerun in result["reruns"]:
+            steps.setdefault(rerun["step"], []).append(rerun["latency"])
+    return {
+        "sessions": sessions,
+        "completed": len(completed),
+        "errors": [result["error"] for result in results if result["error"]],
+        "elapsed": elapsed,
+        "flows_per_minute": 60 * len(completed) / elapsed if elapsed else 0.0,
+        "reruns_per_second": len(latencies) / elapsed if elapsed else 0.0,
+        "rerun_p50": statistics.median(interactive) if interactive else 0.0,
+        "rerun_p95": percentile(interactive, 0.95),
+        "rerun_max": max(interactive, default=0.0),
+        "generate_all_p50": statistics.median([rerun["latency"] for result in results for rerun in result["reruns"]
+                                               if rerun["step"] == "generate all"] or [0.0]),
+        "step_p50": {step: statistics.median(values) for step, values in steps.items()},
+        "rss_mb": rss_after,
+        "memory_per_session_mb": max(0.0, rss_after - rss_before) / sessions
+    }
+
+def print_summary(summary):
+    print(f"{summary['sessions']:>4} sessions  {summary['completed']:>4} ok  "
+          f"rerun p50 {summary['rerun_p50'] * 1000:7.0f}ms  p95 {summary['rerun_p95'] * 1000:7.0f}ms  "
+          f"generate p50 {summary['generate_all_p50']:6.1f}s  "
+          f"{summary['flows_per_minute']:6.1f} flows/min  {summary['reruns_per_second']:5.1f} reruns/s  "
+          f"{summary['memory_per_session_mb']:6.1f} MB/session")
+    if summary["step_p50"]:
+        slowest = max(summary["step_p50"], key=summary["step_p50"].get)
+        print(f"      slowest step: {slowest} ({summary['step_p50'][slowest] * 1000:.0f}ms p50)")
+    for error in summary["errors"][:3]:
+        print(f"      error: {error}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test app.py with N concurrent simulated sessions")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 4, 8], help="Concurrent sessions per level")
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds each fake prediction takes")
+    parser.add_argument("--timeout", type=float, default=300, help="Timeout of a single rerun in seconds")
+    parser.add_argument("--workdir", help="Directory for projects, state and metrics (default: a temp dir)")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    # Configure the app before it is first imported by AppTest
+    workdir = args.workdir or tempfile.mkdtemp(prefix="flowly_loadtest_")
+    os.environ["FLOWLY_FAKE_GENERATION"] = "1"
+    os.environ["FLOWLY_FAKE_LATENCY"] = str(args.latency)
+    os.environ.setdefault("FLOWLY_STATE_BACKEND", "memory")
+    os.environ.setdefault("FLOWLY_METRICS_FILE", os.path.join(workdir, "metrics.jsonl"))
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    sys.path.insert(0, APP_DIR)
+
+    print(f"Load testing {APP_FILE} (fake predictions take {args.latency}s, working in {workdir})")
+    allow_concurrent_sessions()
+    # One session on its own first, so imports and the pinned runtime are not part of the measurements
+    warmup = run_level(1, args.timeout)
+    if warmup["errors"]:
+        print(f"Warm-up session failed: {warmup['errors'][0]}")
+        sys.exit(1)
+    summaries = []
+    for sessions in args.sessions:
+        summary = run_level(sessions, args.timeout)
+        summaries.append(summary)
+        print_summary(summary)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summaries, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+"""Loudness analysis and normalization of scene audio.
+
+Each scene's audio is decoded by ffmpeg into float32 blocks and measured
+with vectorized NumPy/SciPy code as it streams in: ITU-R BS.1770 K-weighting,
+gated integrated loudness over 400 ms blocks and true peak from 4x
+oversampling (windowed-sinc polyphase interpolation). Per-scene gains then bring every scene to the target loudness
+(limited so no scene clips past the peak ceiling), and the gained audio is
+written next to the scene as scene_<n>_<name>_mastered.mp4 with the video
+stream copied. loudness.json in the project directory caches the analysis by
+file hash, so only new or regenerated scenes are decoded again.
+
+    python loudness.py final_videos/project_20250713_133455 --target -14
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy.signal import sosfilt
+
+import metrics
+from manifest import asset_hash, load_manifest, write_json_atomic
+from media import FFMPEG, FFPROBE, _partial_path
+
+LOUDNESS_FILE = "loudness.json"
+
+TARGET_LOUDNESS = -14.0
+PEAK_CEILING = -1.0
+
+SAMPLE_RATE = 48000
+# Audio read from ffmpeg per step
+READ_SECONDS = 5
+# Gating segments of 100 ms; four of them make one 400 ms block (75% overlap)
+SEGMENT = SAMPLE_RATE // 10
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+OVERSAMPLING = 4
+# Length of the interpolation filter; the last TRUE_PEAK_TAPS samples of a read are kept for the next one
+TRUE_PEAK_TAPS = 16
+# Gains smaller than this are not worth re-encoding the audio for
+MIN_GAIN = 0.1
+
+# BS.1770 K-weighting at 48 kHz: high shelf followed by high-pass, as second-order sections
+K_WEIGHTING = np.array([
+    [1.53512485958697, -2.69169618940638, 1.19839281085285, 1.0, -1.69065929318241, 0.73248077421585],
+    [1.0, -2.0, 1.0, 1.0, -1.99004745483398, 0.99007225036621]
+])
+
+def interpolation_phases(taps=TRUE_PEAK_TAPS, oversampling=OVERSAMPLING, beta=5.0):
+    """Kaiser-windowed sinc coefficients of the points between two samples, one row per fraction"""
+    half = taps // 2
+    offsets = np.arange(-half + 1, half + 1)
+    fractions = np.arange(1, oversampling) / oversampling
+    t = fractions[:, None] - offsets[None, :]
+    window = np.i0(beta * np.sqrt(np.clip(1 - (t / half) ** 2, 0, None))) / np.i0(beta)
+    # Reversed so np.convolve applies them as a correlation
+    return (np.sinc(t) * window)[:, ::-1]
+
+INTERPOLATION = interpolation_phases()
+
+SCENE_FINAL = re.compile(r"^scene_(\d+)_.*_final\.mp4$")
+
+class LoudnessMeter:
+    """Streaming loudness and true peak meter; feed() blocks of shape (frames, channels)"""
+
+    def __init__(self, channels):
+        self.zi = np.zeros((K_WEIGHTING.shape[0], 2, channels))
+        self.remainder = np.zeros((0, channels))
+        self.segments = []
+        self.history = np.zeros((TRUE_PEAK_TAPS, channels))
+        self.peak = 0.0
+        self.frames = 0
+
+    def feed(self, samples):
+        self.frames += len(samples)
+        weighted, self.zi = sosfilt(K_WEIGHTING, samples, axis=0, zi=self.zi)
+        # Mean square per channel of every complete 100 ms segment, summed over channels
+        weighted = np.concatenate([self.remainder, weighted])
+        complete = len(weighted) // SEGMENT * SEGMENT
+        if complete:
+            power = np.square(weighted[:complete]).reshape(-1, SEGMENT, weighted.shape[1]).mean(axis=1).sum(axis=1)
+            self.segments.append(power)
+        self.remainder = weighted[complete:]
+        # True peak: the samples themselves and the interpolated points between them
+        self.peak = max(self.peak, float(np.abs(samples).max(initial=0.0)))
+        padded = np.concatenate([self.history, samples])
+        for channel in range(padded.shape[1]):
+            signal = np.ascontiguousarray(padded[:, channel])
+            for phase in INTERPOLATION:
+                self.peak = max(self.peak, float(np.abs(np.convolve(signal, phase, mode="valid")).max()))
+        self.history = padded[-TRUE_PEAK_TAPS:]
+
+    def block_powers(self):
+        """Mean square of every 400 ms gating block"""
+        if not self.segments:
+            return np.zeros(0)
+        segments = np.concatenate(self.segments)
+        if len(segments) < 4:
+            # Shorter than one block: measure what there is
+            return np.array([segments.mean()])
+        return np.convolve(segments, np.full(4, 0.25), mode="valid")
+
+    def result(self):
+        return {
+            "loudness": integrated_loudness(self.block_powers()),
+            "true_peak": 20 * np.log10(self.peak) if self.peak > 0 else None,
+            "duration": self.frames / SAMPLE_RATE
+        }
+
+def block_loudness(powers):
+    with np.errstate(divide="ignore"):
+        return -0.691 + 10 * np.log10(powers)
+
+def integrated_loudness(powers):
+    """Gated integrated loudness (LUFS) of block powers, or None when everything is below the gate"""
+    powers = np.asarray(powers, dtype=float)
+    gated = powers[block_loudness(powers) > ABSOLUTE_GATE]
+    if not gated.size:
+        return None
+    relative = block_loudness(gated.mean()) + RELATIVE_GATE
+    gated = gated[block_loudness(gated) > relative]
+    return float(block_loudness(gated.mean()))
+
+def audio_channels(path):
+    """Channel count of a file's first audio stream, or 0 when it has none"""
+    result = subprocess.run(
+        [FFPROBE, "-v", "error", "-select_streams", "a:0", "-show_entries", "stream=channels", "-of", "csv=p=0", path],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe failed on {os.path.basename(path)}: {result.stderr.strip()}")
+    return int(result.stdout.strip() or 0)
+
+def decode_blocks(path, channels):
+    """Yield the first audio stream of a file as float32 arrays of shape (frames, channels) at 48 kHz"""
+    process = subprocess.Popen(
+        [FFMPEG, "-v", "error", "-i", path, "-map", "0:a:0", "-f", "f32le", "-acodec", "pcm_f32le",
+         "-ar", str(SAMPLE_RATE), "-"],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    frame_bytes = 4 * channels
+    read_size = SAMPLE_RATE * READ_SECONDS * frame_bytes
+    pending = b""
+    try:
+        while True:
+            data = process.stdout.read(read_size)
+            if not data:
+                break
+            data = pending + data
+            usable = len(data) // frame_bytes * frame_bytes
+            pending = data[usable:]
+            if usable:
+                yield np.frombuffer(data[:usable], dtype=np.float32).reshape(-1, channels).astype(np.float64)
+    finally:
+        process.stdout.close()
+        stderr = process.stderr.read().decode(errors="replace")
+        process.stderr.close()
+        if process.wait() != 0:
+            raise RuntimeError(f"ffmpeg could not decode {os.path.basename(path)}: {stderr.strip()}")
+
+def analyze_file(path):
+    """Integrated loudness, true peak, duration and gating block powers of a file's audio"""
+    channels = audio_channels(path)
+    if not channels:
+        return None
+    meter = LoudnessMeter(channels)
+    for samples in decode_blocks(path, channels):
+        meter.feed(samples)
+    return {**meter.result(), "powers": meter.block_powers().tolist()}
+
+def gain_to_target(analysis, target=TARGET_LOUDNESS, ceiling=PEAK_CEILING):
+    """Gain in dB that brings a scene to the target without pushing its true peak above the ceiling"""
+    if not analysis or analysis["loudness"] is None:
+        return 0.0
+    gain = target - analysis["loudness"]
+    if analysis["true_peak"] is not None:
+        gain = min(gain, ceiling - analysis["true_peak"])
+    return round(gain, 2)
+
+def project_loudness(analyses, gains):
+    """Integrated loudness of all scenes played in order, after applying the gains"""
+    powers = [np.asarray(analysis["powers"]) * 10 ** (gains.get(filename, 0.0) / 10)
+              for filename, analysis in analyses.items() if analysis and analysis["powers"]]
+    return integrated_loudness(np.concatenate(powers)) if powers else None
+
+def apply_gain(source, output, gain):
+    """Copy the video and re-encode the audio with a gain in dB"""
+    partial = _partial_path(output)
+    result = subprocess.run(
+        [FFMPEG, "-y", "-loglevel", "error", "-i", source, "-map", "0:v:0", "-map", "0:a:0",
+         "-c:v", "copy", "-af", f"volume={gain:.2f}dB", "-c:a", "aac", "-b:a", "192k", "-ar", str(SAMPLE_RATE),
+         "-movflags", "+faststart", partial],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise RuntimeError(f"ffmpeg failed on {os.path.basename(output)}: {result.stderr.strip()[-500:]}")
+    os.replace(partial, output)
+    return output
+
+def mastered_name(filename):
+    return filename[:-len("_final.mp4")] + "_mastered.mp4"
+
+def load_loudness(project_dir):
+    path = os.path.join(project_dir, LOUDNESS_FILE)
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {"scenes": {}}
+
+def master_project(project_dir, target=TARGET_LOUDNESS, ceiling=PEAK_CEILING, workers=None):
+    """Measure every scene final of a project and write gained copies that hit the target loudness
+
+    Returns a summary with the scenes analyzed, the gains applied and the project loudness before and after."""
+    started = time.time()
+    finals = sorted((filename for filename in os.listdir(project_dir) if SCENE_FINAL.match(filename)),
+                    key=lambda filename: int(SCENE_FINAL.match(filename).group(1)))
+    summary = {"scenes": len(finals), "analyzed": 0, "mastered": 0, "failed": [], "gains": {}}
+    if not finals:
+        return summary
+    manifest = load_manifest(project_dir)
+    state = load_loudness(project_dir)
+    workers = workers or min(32, (os.cpu_count() or 1) * 2)
+
+    # Decoding and filtering release the GIL, so threads keep every core busy
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        hashes = dict(zip(finals, executor.map(lambda filename: asset_hash(project_dir, manifest, filename), finals)))
+        stale = [filename for filename in finals
+                 if state["scenes"].get(filename, {}).get("sha256") != hashes[filename]]
+        for filename, analysis in zip(stale, executor.map(
+                lambda filename: _try(analyze_file, os.path.join(project_dir, filename)), stale)):
+            if isinstance(analysis, Exception):
+                summary["failed"].append((filename, str(analysis)))
+                state["scenes"].pop(filename, None)
+                continue
+            state["scenes"][filename] = {"sha256": hashes[filename], "analysis": analysis}
+            summary["analyzed"] += 1
+
+        analyses = {filename: state["scenes"][filename]["analysis"] for filename in finals if filename in state["scenes"]}
+        gains = {filename: gain_to_target(analysis, target, ceiling) for filename, analysis in analyses.items()}
+        summary["gains"] = gains
+
+        # Only write copies whose source or gain changed since the last run
+        jobs = []
+        for filename, gain in gains.items():
+            entry = state["scenes"][filename]
+            output = os.path.join(project_dir, mastered_name(filename))
+            if abs(gain) < MIN_GAIN:
+                if os.path.exists(output):
+                    os.remove(output)
+                entry.pop("gain", None)
+                continue
+            if entry.get("gain") == gain and os.path.exists(output):
+                continue
+            jobs.append((filename, gain, output))
+        results = executor.map(lambda job: _try(apply_gain, os.path.join(project_dir, job[0]), job[2], job[1]), jobs)
+        for (filename, gain, _), result in zip(jobs, results):
+            if isinstance(result, Exception):
+                summary["failed"].append((filename, str(result)))
+                continue
+            state["scenes"][filename]["gain"] = gain
+            summary["mastered"] += 1
+
+    summary["loudness_before"] = project_loudness(analyses, {})
+    summary["loudness_after"] = project_loudness(analyses, gains)
+    summary["latency"] = round(time.time() - started, 3)
+    state.update(target=target, ceiling=ceiling, updated=time.time())
+    write_json_atomic(os.path.join(project_dir, LOUDNESS_FILE), state)
+    metrics.record("loudness_master", scenes=len(finals), analyzed=summary["analyzed"], mastered=summary["mastered"],
+                   failed=len(summary["failed"]), loudness_before=summary["loudness_before"],
+                   loudness_after=summary["loudness_after"], latency=summary["latency"])
+    return summary
+
+def _try(func, *args):
+    try:
+        return func(*args)
+    except Exception as e:
+        return e
+
+def main():
+    parser = argparse.ArgumentParser(description="Normalize the loudness of a saved project's scenes")
+    parser.add_argument("project_dir")
+    parser.add_argument("--target", type=float, default=TARGET_LOUDNESS, help="Target loudness in LUFS")
+    parser.add_argument("--ceiling", type=float, default=PEAK_CEILING, help="Maximum true peak in dBTP")
+    parser.add_argument("--workers", type=int, help="Parallel decodes")
+    args = parser.parse_args()
+
+    summary = master_project(args.project_dir, args.target, args.ceiling, args.workers)
+    for filename, gain in summary["gains"].items():
+        print(f"{filename}: {gain:+.2f} dB")
+    before, after = summary.get("loudness_before"), summary.get("loudness_after")
+    if before is not None:
+        print(f"Project loudness {before:.1f} LUFS -> {after:.1f} LUFS")
+    print(f"{summary['analyzed']} of {summary['scenes']} scenes analyzed, {summary['mastered']} mastered, "
+          f"{len(summary['failed'])} failed in {summary.get('latency', 0):.1f}s")
+    for filename, error in summary["failed"]:
+        print(f"  {filename}: {error}")
+
+if __name__ == "__main__":
+    main()
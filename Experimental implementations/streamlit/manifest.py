@@ -0,0 +1,82 @@
+"""Asset manifest of a saved project.
+
+manifest.json in the project directory records, for every saved file, the
+URL it came from, its size, modification time and SHA-256. A repeat save
+skips every file whose source URL is unchanged and whose size still matches,
+so only new or regenerated assets are transferred. The recorded hash is only
+trusted while the file's size and modification time both match, since a
+file rewritten in place (a scene video muxed again) keeps its URL and often
+its size.
+"""
+import hashlib
+import json
+import os
+import time
+
+MANIFEST_FILE = "manifest.json"
+
+def write_json_atomic(path, data):
+    """Write JSON to a temporary file and move it into place"""
+    partial = f"{path}.partial"
+    with open(partial, "w") as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(partial, path)
+
+def write_text_atomic(path, text):
+    partial = f"{path}.partial"
+    with open(partial, "w") as f:
+        f.write(text)
+    os.replace(partial, path)
+
+def file_hash(path):
+    """SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_manifest(project_dir):
+    """Read a project's manifest, or start an empty one"""
+    path = os.path.join(project_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {"assets": {}}
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {"assets": {}}
+    manifest.setdefault("assets", {})
+    return manifest
+
+def save_manifest(project_dir, manifest):
+    manifest["updated"] = time.time()
+    write_json_atomic(os.path.join(project_dir, MANIFEST_FILE), manifest)
+
+def is_current(project_dir, manifest, filename, url):
+    """Check whether a file was already saved from this URL and is still intact on disk"""
+    entry = manifest["assets"].get(filename)
+    path = os.path.join(project_dir, filename)
+    if not entry or entry["url"] != url or not os.path.exists(path):
+        return False
+    return os.path.getsize(path) == entry["size"]
+
+def record_asset(project_dir, manifest, filename, url):
+    """Add or update the manifest entry of a saved file"""
+    path = os.path.join(project_dir, filename)
+    stat = os.stat(path)
+    entry = {"url": url, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": file_hash(path),
+             "saved": time.time()}
+    manifest["assets"][filename] = entry
+    return entry
+
+def asset_hash(project_dir, manifest, filename):
+    """SHA-256 of a saved file, taken from the manifest while its size and modification time still match"""
+    entry = manifest["assets"].get(filename)
+    path = os.path.join(project_dir, filename)
+    stat = os.stat(path)
+    if entry and entry.get("sha256") and entry.get("size") == stat.st_size and entry.get("mtime_ns") == stat.st_mtime_ns:
+        return entry["sha256"]
+    return file_hash(path)
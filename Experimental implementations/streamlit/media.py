@@ -0,0 +1,46 @@
+import asyncio
+import os
+import shutil
+
+# Local ffmpeg tools used for muxing and post-processing
+FFMPEG = os.getenv("FFMPEG_BINARY", "ffmpeg")
+FFPROBE = os.getenv("FFPROBE_BINARY", "ffprobe")
+
+def ffmpeg_available():
+    """Check that ffmpeg is installed"""
+    return shutil.which(FFMPEG) is not None
+
+def mux_command(video, audio, output):
+    """ffmpeg arguments that copy the video stream and encode only the audio"""
+    return [
+        FFMPEG, "-y", "-loglevel", "error",
+        "-i", video, "-i", audio,
+        "-map", "0:v:0", "-map", "1:a:0",
+        "-c:v", "copy",
+        "-c:a", "aac", "-b:a", "192k",
+        "-shortest", "-movflags", "+faststart",
+        output
+    ]
+
+def _partial_path(output):
+    # Keep the container extension so ffmpeg can pick the muxer
+    root, ext = os.path.splitext(output)
+    return f"{root}.partial{ext}"
+
+async def mux_audio(video, audio, output):
+    """Mux an audio track into a video (local paths or URLs) and return the output path"""
+    if not ffmpeg_available():
+        raise RuntimeError("ffmpeg is required to mux audio; install it or use video-to-audio sound")
+    partial = _partial_path(output)
+    process = await asyncio.create_subprocess_exec(
+        *mux_command(video, audio, partial),
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE
+    )
+    _, stderr = await process.communicate()
+    if process.returncode != 0:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise RuntimeError(f"ffmpeg mux failed: {stderr.decode(errors='replace').strip()}")
+    os.replace(partial, output)
+    return output
@@ -0,0 +1,82 @@
+import json
+import logging
+import os
+import threading
+import time
+
+# Append-only JSON lines log shared by the app, the CLIs and the workers, kept with the runtime data
+METRICS_FILE = os.getenv("FLOWLY_METRICS_FILE", os.path.join("final_videos", "metrics.jsonl"))
+
+logger = logging.getLogger("flowly.metrics")
+_lock = threading.Lock()
+
+def record(event, **fields):
+    """Append one metrics event and log it"""
+    entry = {"ts": time.time(), "event": event, **fields}
+    logger.info("%s %s", event, json.dumps(fields, default=str))
+    with _lock:
+        try:
+            os.makedirs(os.path.dirname(METRICS_FILE) or ".", exist_ok=True)
+            with open(METRICS_FILE, "a") as f:
+                f.write(json.dumps(entry, default=str) + "\n")
+        except OSError as e:
+            logger.warning("Could not write metrics to %s: %s", METRICS_FILE, e)
+    return entry
+
+def load(event=None):
+    """Read recorded events, optionally filtered by event name"""
+    if not os.path.exists(METRICS_FILE):
+        return []
+    entries = []
+    with open(METRICS_FILE) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if event is None or entry.get("event") == event:
+                entries.append(entry)
+    return entries
+
+def summarize_llm_calls(call=None):
+    """Total and cached prompt tokens, completion tokens and latency of logged LLM calls"""
+    entries = [e for e in load("llm_call") if call is None or e.get("call") == call]
+    summary = {
+        "calls": len(entries),
+        "prompt_tokens": sum(e.get("prompt_tokens", 0) for e in entries),
+        "cached_tokens": sum(e.get("cached_tokens", 0) for e in entries),
+        "completion_tokens": sum(e.get("completion_tokens", 0) for e in entries),
+        "avg_latency": sum(e.get("latency", 0) for e in entries) / len(entries) if entries else 0.0
+    }
+    summary["cache_hit_ratio"] = summary["cached_tokens"] / summary["prompt_tokens"] if summary["prompt_tokens"] else 0.0
+    return summary
+
+def summarize_storyboard_parses():
+    """First-try success rate of storyboard responses and how the rest were repaired"""
+    entries = load("storyboard_parse")
+    total = len(entries)
+    summary = {
+        "storyboards": total,
+        "first_try": sum(1 for e in entries if e.get("first_try")),
+        "repaired_locally": sum(1 for e in entries if e.get("repaired_locally")),
+        "rerequested_scenes": sum(e.get("rerequested_scenes", 0) for e in entries),
+        "failed": sum(1 for e in entries if not e.get("ok", True))
+    }
+    summary["first_try_rate"] = summary["first_try"] / total if total else 0.0
+    return summary
+
+def summarize_prompt_cache():
+    """How often a near-duplicate cached output was available and how often it was reused
+
+    Every generation logs a lookup; reusing a cached output instead of generating logs a reuse."""
+    lookups = load("prompt_cache_lookup")
+    reuses = load("prompt_cache_reuse")
+    requests = len(lookups) + len(reuses)
+    hits = sum(1 for e in lookups if e.get("hit")) + len(reuses)
+    return {
+        "requests": requests,
+        "hits": hits,
+        "reuses": len(reuses),
+        "hit_rate": hits / requests if requests else 0.0,
+        "reuse_rate": len(reuses) / requests if requests else 0.0
+    }
@@ -0,0 +1,258 @@
+"""Model registry and latency-aware routing for each generation stage.
+
+Every stage maps candidate Replicate models to an input adapter that turns
+the stage arguments (prompt, image_url, video_url) into that model's input.
+A router per stage picks the model to call, either the first healthy model
+in the configured preference order or the healthy model with the best
+recent latency, and takes a model out of rotation for a while after
+repeated errors or a latency spike.
+
+Health is tracked once per process, since every session calls the same
+models. The enabled models and the policy a router is configured with are
+only the defaults: each call can pass its own, so one session's settings do
+not change the routing of the others.
+"""
+import logging
+import os
+import threading
+import time
+
+# Length in seconds of each generated scene clip
+SCENE_DURATION = 5
+
+# Input adapters. "draft" quality trades resolution and detail for speed and cost;
+# the image seed is passed through so a draft image can be re-rendered at full quality.
+def seedream3_input(prompt, quality="final", seed=None, **_):
+    input = {
+        "prompt": prompt,
+        "aspect_ratio": "9:16",
+        "safety_filter_level": "block_medium_and_above",
+        "size": "big" if quality == "final" else "small",
+        "guidance_scale": 2.5
+    }
+    if seed is not None:
+        input["seed"] = seed
+    return input
+
+def flux_schnell_input(prompt, quality="final", seed=None, **_):
+    input = {
+        "prompt": prompt,
+        "aspect_ratio": "9:16",
+        "output_format": "png",
+        "num_outputs": 1,
+        "go_fast": quality != "final"
+    }
+    if seed is not None:
+        input["seed"] = seed
+    return input
+
+def kling_v21_input(prompt, image_url, quality="final", **_):
+    return {
+        "prompt": prompt,
+        "start_image": image_url,
+        "mode": "pro" if quality == "final" else "standard",
+        "duration": SCENE_DURATION
+    }
+
+def kling_v16_pro_input(prompt, image_url, **_):
+    return {
+        "prompt": prompt,
+        "start_image": image_url,
+        "duration": SCENE_DURATION,
+        "aspect_ratio": "9:16"
+    }
+
+def seedance_lite_input(prompt, image_url, quality="final", **_):
+    return {
+        "prompt": prompt,
+        "image": image_url,
+        "duration": SCENE_DURATION,
+        "resolution": "720p" if quality == "final" else "480p"
+    }
+
+def thinksound_input(prompt, video_url, quality="final", **_):
+    return {
+        "caption": prompt,
+        "cfg": 5,
+        "num_inference_steps": 24 if quality == "final" else 12,
+        "video": video_url,
+        "cot": prompt
+    }
+
+def mmaudio_input(prompt, video_url, quality="final", **_):
+    return {
+        "seed": -1,
+        "video": video_url,
+        "prompt": prompt,
+        "num_steps": 25 if quality == "final" else 12
+    }
+
+# Text-to-audio models for the sound track generated alongside the video
+def audiogen_input(prompt, quality="final", duration=SCENE_DURATION, **_):
+    return {
+        "prompt": prompt,
+        "duration": duration,
+        "top_k": 250,
+        "classifier_free_guidance": 3 if quality == "final" else 2
+    }
+
+def tango_input(prompt, quality="final", **_):
+    return {
+        "prompt": prompt,
+        "steps": 100 if quality == "final" else 50,
+        "guidance": 3
+    }
+
+# Candidate models per stage, in default preference order
+MODEL_REGISTRY = {
+    "image": {
+        "bytedance/seedream-3": seedream3_input,
+        "black-forest-labs/flux-schnell": flux_schnell_input
+    },
+    "video": {
+        "kwaivgi/kling-v2.1": kling_v21_input,
+        "kwaivgi/kling-v1.6-pro": kling_v16_pro_input,
+        "bytedance/seedance-1-lite": seedance_lite_input
+    },
+    "sound": {
+        "zsxkib/thinksound:40d08f9f569e91a5d72f6795ebed75178c185b0434699a98c07fc5f566efb2d4": thinksound_input,
+        "zsxkib/mmaudio:62871fb59889b2d7c13777f08deb3b36bdff88f7e1d53a50ad7694548a41b484": mmaudio_input
+    },
+    "audio": {
+        "sepal/audiogen": audiogen_input,
+        "declare-lab/tango": tango_input
+    }
+}
+
+ROUTING_POLICIES = ["preference", "latency"]
+
+QUALITY_LEVELS = ["draft", "final"]
+
+# Health tracking
+LATENCY_SMOOTHING = 0.3      # weight of the newest sample in the moving average
+FAILURES_BEFORE_COOLDOWN = 2
+FAILURE_COOLDOWN = 300       # seconds a failing model is skipped
+SPIKE_FACTOR = 3.0           # a call this many times slower than average counts as a spike
+SPIKE_COOLDOWN = 120
+MIN_SAMPLES_FOR_SPIKE = 3
+
+logger = logging.getLogger("flowly.models")
+
+def _env_models(stage):
+    """Preference order from FLOWLY_<STAGE>_MODELS (comma separated), if set; unknown models are dropped"""
+    name = f"FLOWLY_{stage.upper()}_MODELS"
+    models = []
+    for model in os.getenv(name, "").split(","):
+        model = model.strip()
+        if not model:
+            continue
+        if model not in MODEL_REGISTRY[stage]:
+            # A typo (or a missing version pin) must not take every importer down with it
+            logger.warning("Ignoring unknown %s model in %s: %s", stage, name, model)
+            continue
+        models.append(model)
+    return models
+
+def _env_policy():
+    """Routing policy from FLOWLY_ROUTING, if set and known"""
+    policy = os.getenv("FLOWLY_ROUTING", "preference")
+    if policy not in ROUTING_POLICIES:
+        logger.warning("Ignoring unknown routing policy in FLOWLY_ROUTING: %s", policy)
+        return "preference"
+    return policy
+
+class ModelRouter:
+    """Chooses the model for one stage and tracks each model's latency and health"""
+
+    def __init__(self, stage, models=None, policy=None):
+        self.stage = stage
+        self.lock = threading.Lock()
+        self.models = []
+        self.policy = "preference"
+        self.stats = {}
+        self.configure(models or _env_models(stage) or list(MODEL_REGISTRY[stage]), policy or _env_policy())
+
+    def configure(self, models=None, policy=None):
+        """Set the default enabled models (in preference order) and routing policy"""
+        with self.lock:
+            if models is not None:
+                unknown = [model for model in models if model not in MODEL_REGISTRY[self.stage]]
+                if unknown:
+                    raise ValueError(f"Unknown {self.stage} models: {unknown}")
+                if not models:
+                    raise ValueError(f"At least one {self.stage} model must be enabled")
+                self.models = list(models)
+            if policy is not None:
+                if policy not in ROUTING_POLICIES:
+                    raise ValueError(f"Unknown routing policy: {policy}")
+                self.policy = policy
+            # Every model is tracked, so a call that enables more than the defaults has stats too
+            for model in MODEL_REGISTRY[self.stage]:
+                self.stats.setdefault(model, {
+                    "latency": None, "samples": 0, "failures": 0, "errors": 0,
+                    "calls": 0, "unhealthy_until": 0.0, "last_error": None
+                })
+
+    def adapter(self, model):
+        return MODEL_REGISTRY[self.stage][model]
+
+    def _healthy(self, model, now):
+        return self.stats[model]["unhealthy_until"] <= now
+
+    def choose(self, exclude=(), models=None, policy=None):
+        """Pick the next model to try, or None when every enabled model was excluded
+
+        models and policy override the router's defaults for this call."""
+        now = time.time()
+        with self.lock:
+            candidates = [model for model in (models or self.models) if model in self.stats and model not in exclude]
+            if not candidates:
+                return None
+            healthy = [model for model in candidates if self._healthy(model, now)]
+            # When everything is cooling down, try the one that recovers first
+            if not healthy:
+                return min(candidates, key=lambda model: self.stats[model]["unhealthy_until"])
+            if (policy or self.policy) == "latency":
+                # Models without samples are tried in preference order before being ranked
+                unmeasured = [model for model in healthy if self.stats[model]["latency"] is None]
+                if unmeasured:
+                    return unmeasured[0]
+                return min(healthy, key=lambda model: self.stats[model]["latency"])
+            return healthy[0]
+
+    def record_success(self, model, latency):
+        with self.lock:
+            stats = self.stats[model]
+            stats["calls"] += 1
+            stats["failures"] = 0
+            previous = stats["latency"]
+            if previous is not None and stats["samples"] >= MIN_SAMPLES_FOR_SPIKE and latency > SPIKE_FACTOR * previous:
+                # Queue times spiked: route around this model for a while
+                stats["unhealthy_until"] = time.time() + SPIKE_COOLDOWN
+            stats["latency"] = latency if previous is None else (
+                LATENCY_SMOOTHING * latency + (1 - LATENCY_SMOOTHING) * previous)
+            stats["samples"] += 1
+
+    def record_failure(self, model, error):
+        with self.lock:
+            stats = self.stats[model]
+            stats["calls"] += 1
+            stats["errors"] += 1
+            stats["failures"] += 1
+            stats["last_error"] = str(error)
+            if stats["failures"] >= FAILURES_BEFORE_COOLDOWN:
+                stats["unhealthy_until"] = time.time() + FAILURE_COOLDOWN
+
+    def snapshot(self, models=None):
+        """Current stats of the enabled (or the given) models, for display"""
+        now = time.time()
+        with self.lock:
+            return [
+                {"model": model, "healthy": self._healthy(model, now), **self.stats[model]}
+                for model in (models or self.models) if model in self.stats
+            ]
+
+ROUTERS = {stage: ModelRouter(stage) for stage in MODEL_REGISTRY}
+
+def get_router(stage):
+    return ROUTERS[stage]
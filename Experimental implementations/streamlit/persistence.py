@@ -0,0 +1,73 @@
+"""Background persistence of generated assets.
+
+Each output is queued for download into the project directory the moment
+its prediction finishes, while the remaining stages keep generating.
+Finished files are recorded in the project manifest, so by the time the
+user saves, only the metadata is left to write.
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import requests
+
+import metrics
+from manifest import load_manifest, save_manifest, record_asset
+
+MAX_DOWNLOADS = 4
+
+_executor = ThreadPoolExecutor(max_workers=MAX_DOWNLOADS, thread_name_prefix="flowly-persist")
+# Serializes manifest updates from the download threads and the save step
+_manifest_lock = threading.Lock()
+
+def fetch(url, path):
+    """Stream a URL (or copy a local file) to a temporary file and move it into place"""
+    # A temporary file of its own, so concurrent writers of the same path (a background
+    # persist and a save) never write into or rename each other's half-written file
+    fd, partial = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=f"{os.path.basename(path)}.",
+                                   suffix=".partial")
+    try:
+        os.chmod(partial, 0o644)
+        with os.fdopen(fd, "wb") as f:
+            if os.path.exists(url):
+                with open(url, "rb") as src:
+                    shutil.copyfileobj(src, f, 1 << 20)
+            else:
+                response = requests.get(url, stream=True, timeout=60)
+                response.raise_for_status()
+                for chunk in response.iter_content(chunk_size=65536):
+                    f.write(chunk)
+    except Exception:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    os.replace(partial, path)
+    return path
+
+def record_saved(project_dir, filename, url):
+    """Record a saved file in the project manifest"""
+    with _manifest_lock:
+        manifest = load_manifest(project_dir)
+        entry = record_asset(project_dir, manifest, filename, url)
+        save_manifest(project_dir, manifest)
+    return entry
+
+def _persist(project_dir, filename, url):
+    started = time.time()
+    path = fetch(url, os.path.join(project_dir, filename))
+    entry = record_saved(project_dir, filename, url)
+    metrics.record("asset_persisted", file=filename, bytes=entry["size"], latency=round(time.time() - started, 3))
+    return path
+
+def persist(project_dir, filename, url):
+    """Queue a download into the project directory; the future resolves to the local path"""
+    return _executor.submit(_persist, project_dir, filename, url)
+
+def wait_for(futures, timeout=None):
+    """Block until the given downloads have finished (successfully or not)"""
+    futures = [future for future in futures if future is not None]
+    if futures:
+        wait(futures, timeout=timeout)
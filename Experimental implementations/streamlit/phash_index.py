@@ -0,0 +1,233 @@
+"""Perceptual-hash index of the scene images saved under final_videos/.
+
+Each *_image.png gets a 64-bit pHash (sign of the low 8x8 DCT coefficients of
+a 32x32 grayscale thumbnail against their median) and a 64-bit dHash
+(brightness gradient of a 9x8 thumbnail). Thumbnails are decoded in threads
+and hashed a batch at a time with NumPy matrix operations. Hashes are stored
+in SQLite with the file's size and modification time, so an update only
+hashes new or changed files and drops deleted ones. Lookups compute the
+Hamming distance to every indexed image at once.
+
+A near-duplicate of a scene's image in another project usually comes with
+that scene's video and final video next to it, which the app offers as an
+existing shot to reuse instead of generating the video again.
+
+    python phash_index.py update
+    python phash_index.py lookup some_image.png
+"""
+import argparse
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image
+
+DEFAULT_ROOT = "final_videos"
+DEFAULT_INDEX_PATH = os.getenv("FLOWLY_PHASH_INDEX", os.path.join(DEFAULT_ROOT, "phash_index.db"))
+IMAGE_SUFFIX = "_image.png"
+
+# Largest Hamming distances (out of 64 bits) that still count as the same shot
+PHASH_DISTANCE = 8
+DHASH_DISTANCE = 10
+
+BATCH_SIZE = 256
+PHASH_SIZE = 32
+
+def dct_matrix(size=PHASH_SIZE):
+    """Orthonormal DCT-II basis as a matrix, so a 2D DCT is C @ X @ C.T"""
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    matrix = np.sqrt(2 / size) * np.cos(np.pi * (2 * n + 1) * k / (2 * size))
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+DCT = dct_matrix()
+
+def load_thumbnails(path):
+    """Grayscale pHash and dHash thumbnails of one image"""
+    with Image.open(path) as image:
+        gray = image.convert("L")
+        return (np.asarray(gray.resize((PHASH_SIZE, PHASH_SIZE), Image.LANCZOS), dtype=np.float32),
+                np.asarray(gray.resize((9, 8), Image.LANCZOS), dtype=np.float32))
+
+def pack_bits(bits):
+    """(N, 64) booleans to N unsigned 64-bit integers"""
+    return np.packbits(bits.reshape(len(bits), 64), axis=1).view(">u8").ravel().astype(np.uint64)
+
+def phash_batch(thumbnails):
+    """pHash of a stack of 32x32 thumbnails"""
+    coefficients = DCT @ thumbnails @ DCT.T
+    low = coefficients[:, :8, :8].reshape(len(thumbnails), 64)
+    return pack_bits(low > np.median(low, axis=1, keepdims=True))
+
+def dhash_batch(thumbnails):
+    """dHash of a stack of 9x8 thumbnails"""
+    return pack_bits(thumbnails[:, :, 1:] > thumbnails[:, :, :-1])
+
+def hash_images(paths, executor=None):
+    """(phash, dhash, unreadable) of image files: hash arrays of the readable ones and the other paths"""
+    load = executor.map if executor else map
+    loaded = list(load(_try_thumbnails, paths))
+    readable = [thumbs for thumbs in loaded if thumbs is not None]
+    errors = [path for path, thumbs in zip(paths, loaded) if thumbs is None]
+    if not readable:
+        return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.uint64), errors
+    return (phash_batch(np.stack([thumbs[0] for thumbs in readable])),
+            dhash_batch(np.stack([thumbs[1] for thumbs in readable])), errors)
+
+@lru_cache(maxsize=256)
+def file_hashes(path, mtime):
+    """(phash, dhash) of one image file, or None if it cannot be read; mtime keys the cache"""
+    phashes, dhashes, errors = hash_images([path])
+    return None if errors else (phashes[0], dhashes[0])
+
+def _try_thumbnails(path):
+    try:
+        return load_thumbnails(path)
+    except (OSError, ValueError):
+        return None
+
+if hasattr(np, "bitwise_count"):
+    def popcount(values):
+        return np.bitwise_count(values)
+else:
+    _BITS = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def popcount(values):
+        return _BITS[values.view(np.uint8).reshape(-1, 8)].sum(axis=1)
+
+def hamming(hashes, value):
+    """Hamming distance of every hash to one value"""
+    return popcount(np.bitwise_xor(hashes, np.uint64(value))).astype(np.int64)
+
+def _signed(value):
+    # SQLite integers are signed 64-bit
+    return int(np.uint64(value).astype(np.int64))
+
+class ShotIndex:
+    """Incrementally updated perceptual-hash index of saved scene images"""
+
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS images (path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime REAL NOT NULL, "
+            "phash INTEGER NOT NULL, dhash INTEGER NOT NULL)"
+        )
+        self.arrays = None
+
+    def update(self, root=DEFAULT_ROOT, workers=None):
+        """Hash new and changed images under root and forget deleted ones"""
+        started = time.time()
+        root = os.path.abspath(root)
+        found = {}
+        for directory, _, filenames in os.walk(root):
+            for filename in filenames:
+                if filename.endswith(IMAGE_SUFFIX):
+                    path = os.path.join(directory, filename)
+                    stat = os.stat(path)
+                    found[path] = (stat.st_size, stat.st_mtime)
+        with self.lock:
+            known = {path: (size, mtime) for path, size, mtime in self.conn.execute(
+                "SELECT path, size, mtime FROM images WHERE path >= ? AND path < ?", (root + os.sep, root + chr(ord(os.sep) + 1))
+            )}
+        removed = [path for path in known if path not in found]
+        changed = [path for path, stat in found.items() if known.get(path) != stat]
+
+        failed = []
+        with ThreadPoolExecutor(max_workers=workers or min(32, (os.cpu_count() or 1) * 2)) as executor:
+            for start in range(0, len(changed), BATCH_SIZE):
+                batch = changed[start:start + BATCH_SIZE]
+                phashes, dhashes, errors = hash_images(batch, executor)
+                failed += errors
+                hashed = [path for path in batch if path not in errors]
+                with self.lock:
+                    self.conn.executemany(
+                        "INSERT OR REPLACE INTO images (path, size, mtime, phash, dhash) VALUES (?, ?, ?, ?, ?)",
+                        [(path, *found[path], _signed(p), _signed(d)) for path, p, d in zip(hashed, phashes, dhashes)]
+                    )
+        with self.lock:
+            self.conn.executemany("DELETE FROM images WHERE path = ?", [(path,) for path in removed])
+            self.arrays = None
+        failed_paths = set(failed)
+        return {"added": sum(1 for path in changed if path not in known and path not in failed_paths),
+                "updated": sum(1 for path in changed if path in known and path not in failed_paths),
+                "removed": len(removed),
+                "failed": failed, "total": self.count(), "latency": round(time.time() - started, 3)}
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def _load(self):
+        if self.arrays is None:
+            rows = self.conn.execute("SELECT path, phash, dhash FROM images").fetchall()
+            self.arrays = ([row[0] for row in rows],
+                           np.array([row[1] for row in rows], dtype=np.int64).view(np.uint64),
+                           np.array([row[2] for row in rows], dtype=np.int64).view(np.uint64))
+        return self.arrays
+
+    def lookup_hashes(self, phash, dhash, max_phash=PHASH_DISTANCE, max_dhash=DHASH_DISTANCE, limit=5, exclude=()):
+        """Indexed images within both distances, closest first"""
+        with self.lock:
+            paths, phashes, dhashes = self._load()
+        if not paths:
+            return []
+        phash_distances = hamming(phashes, phash)
+        dhash_distances = hamming(dhashes, dhash)
+        matches = np.nonzero((phash_distances <= max_phash) & (dhash_distances <= max_dhash))[0]
+        matches = matches[np.argsort(phash_distances[matches] + dhash_distances[matches], kind="stable")]
+        exclude = {os.path.abspath(path) for path in exclude}
+        results = []
+        for position in matches:
+            if paths[position] in exclude:
+                continue
+            results.append({"path": paths[position], "phash_distance": int(phash_distances[position]),
+                            "dhash_distance": int(dhash_distances[position])})
+            if len(results) == limit:
+                break
+        return results
+
+    def lookup(self, image_path, max_phash=PHASH_DISTANCE, max_dhash=DHASH_DISTANCE, limit=5, exclude=()):
+        """Indexed near-duplicates of an image file (the file itself excluded)"""
+        phashes, dhashes, errors = hash_images([image_path])
+        if errors:
+            raise ValueError(f"Cannot read image {image_path}")
+        return self.lookup_hashes(phashes[0], dhashes[0], max_phash, max_dhash, limit, [image_path, *exclude])
+
+def shot_files(image_path):
+    """Video files saved next to an indexed scene image"""
+    prefix = image_path[:-len(IMAGE_SUFFIX)]
+    return {kind: f"{prefix}_{kind}.mp4" for kind in ["video", "final", "mastered"]
+            if os.path.exists(f"{prefix}_{kind}.mp4")}
+
+def main():
+    parser = argparse.ArgumentParser(description="Perceptual-hash index of saved scene images")
+    parser.add_argument("--index", default=DEFAULT_INDEX_PATH, help="Path of the index database")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    update_parser = subparsers.add_parser("update", help="Hash new and changed images")
+    update_parser.add_argument("--root", default=DEFAULT_ROOT)
+    lookup_parser = subparsers.add_parser("lookup", help="Find near-duplicates of an image")
+    lookup_parser.add_argument("image")
+    lookup_parser.add_argument("--max-distance", type=int, default=PHASH_DISTANCE, help="Largest pHash distance")
+    lookup_parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    index = ShotIndex(args.index)
+    if args.command == "update":
+        summary = index.update(args.root)
+        print(f"{summary['added']} added, {summary['updated']} updated, {summary['removed']} removed, "
+              f"{len(summary['failed'])} unreadable; {summary['total']} images indexed in {summary['latency']:.1f}s")
+    elif args.command == "lookup":
+        for match in index.lookup(args.image, args.max_distance, limit=args.limit):
+            files = ", ".join(shot_files(match["path"])) or "image only"
+            print(f"{match['phash_distance']:2d}/{match['dhash_distance']:2d}  {match['path']}  ({files})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+"""Platform exports of a saved project.
+
+Every scene video and the final cut (all scenes joined in order) are
+converted for TikTok, Reels and Shorts: 1080x1920 H.264/AAC under the
+platform's bitrate cap, with the audio gained to its loudness target
+(measured by loudness.py; mastered scenes are used when they exist).
+Transcodes run as ffmpeg jobs on a process pool sized to the available
+cores. exports/exports.json records a key per output derived from the
+input contents and the preset, so outputs whose inputs have not changed are
+skipped; streams that already match a preset are copied instead of encoded.
+
+    python postprocess.py final_videos/project_20250713_133455 --platforms tiktok reels
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import subprocess
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import metrics
+from loudness import analyze_file, gain_to_target
+from manifest import asset_hash, load_manifest, write_json_atomic
+from media import FFMPEG, FFPROBE, _partial_path
+
+PLATFORM_PRESETS = {
+    "tiktok": {"name": "TikTok", "width": 1080, "height": 1920, "fps": 30, "max_bitrate": 8_000_000,
+               "audio_bitrate": "192k", "sample_rate": 48000, "loudness": -14.0, "true_peak": -1.0},
+    "reels": {"name": "Instagram Reels", "width": 1080, "height": 1920, "fps": 30, "max_bitrate": 5_000_000,
+              "audio_bitrate": "128k", "sample_rate": 48000, "loudness": -14.0, "true_peak": -1.0},
+    "shorts": {"name": "YouTube Shorts", "width": 1080, "height": 1920, "fps": 30, "max_bitrate": 10_000_000,
+               "audio_bitrate": "192k", "sample_rate": 48000, "loudness": -14.0, "true_peak": -1.0}
+}
+
+EXPORT_DIR = "exports"
+EXPORTS_FILE = "exports.json"
+FINAL_CUT = "final_cut.mp4"
+
+# Bump when the ffmpeg commands change so existing exports are redone
+EXPORT_VERSION = 2
+
+# Measured loudness within this many LU of the target counts as matching
+LOUDNESS_TOLERANCE = 1.0
+
+# scene_N_<text>_<kind>.mp4; the CLI saves the video with sound as scene_N_<text>.mp4
+SCENE_FILE = re.compile(r"^scene_(\d+)_.*?(?:_(mastered|final|video))?\.mp4$")
+# Version of a scene used for export, best first
+SOURCE_PREFERENCE = ["mastered", "final", "video"]
+
+def scene_sources(project_dir):
+    """Scene videos of a project in order, preferring the loudness-mastered version, then the one with sound"""
+    sources = {}
+    for filename in os.listdir(project_dir):
+        match = SCENE_FILE.match(filename)
+        # Files still being written end in .partial.mp4
+        if not match or ".partial" in filename:
+            continue
+        number, rank = int(match.group(1)), SOURCE_PREFERENCE.index(match.group(2) or "final")
+        if number not in sources or rank < sources[number][0]:
+            sources[number] = (rank, filename)
+    return [(number, sources[number][1]) for number in sorted(sources)]
+
+def probe(path):
+    """Stream and container details of a media file from ffprobe"""
+    result = subprocess.run(
+        [FFPROBE, "-v", "error", "-print_format", "json", "-show_streams", "-show_format", path],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe failed on {os.path.basename(path)}: {result.stderr.strip()}")
+    data = json.loads(result.stdout)
+    video = next((s for s in data.get("streams", []) if s.get("codec_type") == "video"), None)
+    audio = next((s for s in data.get("streams", []) if s.get("codec_type") == "audio"), None)
+    if video is None:
+        raise RuntimeError(f"{os.path.basename(path)} has no video stream")
+    numerator, _, denominator = video.get("avg_frame_rate", "0/1").partition("/")
+    return {
+        "video_codec": video.get("codec_name"),
+        "width": video.get("width"),
+        "height": video.get("height"),
+        "fps": float(numerator) / float(denominator or 1) if float(denominator or 1) else 0.0,
+        "pix_fmt": video.get("pix_fmt"),
+        "video_bitrate": int(video.get("bit_rate") or data.get("format", {}).get("bit_rate") or 0),
+        "audio_codec": audio.get("codec_name") if audio else None,
+        "sample_rate": int(audio.get("sample_rate", 0)) if audio else 0,
+        "channels": audio.get("channels", 0) if audio else 0
+    }
+
+def video_matches(info, preset):
+    """Check whether a video stream can be copied as is for a preset"""
+    return (info["video_codec"] == "h264" and info["pix_fmt"] == "yuv420p"
+            and info["width"] == preset["width"] and info["height"] == preset["height"]
+            and abs(info["fps"] - preset["fps"]) < 0.01
+            and 0 < info["video_bitrate"] <= preset["max_bitrate"])
+
+def audio_matches(info, preset, loudness):
+    """Check whether an audio stream can be copied as is for a preset"""
+    return (info["audio_codec"] == "aac" and info["sample_rate"] == preset["sample_rate"] and info["channels"] == 2
+            and loudness is not None and loudness["loudness"] is not None
+            and abs(loudness["loudness"] - preset["loudness"]) <= LOUDNESS_TOLERANCE
+            and loudness["true_peak"] <= preset["true_peak"])
+
+def video_args(preset, threads):
+    """Scale and pad to the preset frame, encode H.264 under the bitrate cap"""
+    width, height = preset["width"], preset["height"]
+    return [
+        "-vf", (f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+                f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,fps={preset['fps']}"),
+        "-c:v", "libx264", "-preset", "medium", "-crf", "20", "-profile:v", "high", "-pix_fmt", "yuv420p",
+        "-maxrate", str(preset["max_bitrate"]), "-bufsize", str(2 * preset["max_bitrate"]),
+        "-threads", str(threads)
+    ]
+
+def audio_args(preset, gain=0.0):
+    """Apply a gain in dB and encode AAC stereo"""
+    args = ["-af", f"volume={gain:.2f}dB"] if gain else []
+    return args + ["-c:a", "aac", "-b:a", preset["audio_bitrate"], "-ar", str(preset["sample_rate"]), "-ac", "2"]
+
+def transcode_command(source, output, preset, info, loudness=None, threads=1):
+    """ffmpeg arguments for one scene export and whether streams are copied ("copy", "video_copy" or "transcode")"""
+    copy_video = video_matches(info, preset)
+    copy_audio = copy_video and audio_matches(info, preset, loudness)
+    command = [FFMPEG, "-y", "-loglevel", "error", "-i", source]
+    if info["audio_codec"] is None:
+        # Every export gets an audio track so the scenes can be joined into the final cut
+        command += ["-f", "lavfi", "-i", f"anullsrc=r={preset['sample_rate']}:cl=stereo", "-shortest"]
+        command += ["-map", "0:v:0", "-map", "1:a:0"]
+    else:
+        command += ["-map", "0:v:0", "-map", "0:a:0"]
+    command += ["-c:v", "copy"] if copy_video else video_args(preset, threads)
+    command += ["-c:a", "copy"] if copy_audio else audio_args(
+        preset, gain_to_target(loudness, preset["loudness"], preset["true_peak"]))
+    command += ["-movflags", "+faststart", output]
+    mode = "copy" if copy_audio else "video_copy" if copy_video else "transcode"
+    return command, mode
+
+def run_ffmpeg(command, output):
+    partial = command[-1]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise RuntimeError(f"ffmpeg failed on {os.path.basename(output)}: {result.stderr.strip()[-500:]}")
+    os.replace(partial, output)
+
+def transcode(source, output, preset, threads=1):
+    """Export one scene for a preset (runs in a pool process)"""
+    started = time.time()
+    info = probe(source)
+    loudness = analyze_file(source) if info["audio_codec"] else None
+    command, mode = transcode_command(source, _partial_path(output), preset, info, loudness, threads)
+    run_ffmpeg(command, output)
+    return {"mode": mode, "latency": round(time.time() - started, 3)}
+
+def concat(sources, output, preset, threads=1):
+    """Join exported scenes into the final cut (runs in a pool process)
+
+    The exports share one preset, so the streams are copied unless their parameters differ."""
+    started = time.time()
+    signatures = {json.dumps({key: value for key, value in probe(source).items() if key != "video_bitrate"})
+                  for source in sources}
+    listing = f"{output}.txt"
+    with open(listing, "w") as f:
+        for source in sources:
+            escaped = os.path.abspath(source).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    command = [FFMPEG, "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", listing]
+    if len(signatures) == 1:
+        command += ["-c", "copy"]
+        mode = "copy"
+    else:
+        command += video_args(preset, threads) + audio_args(preset)
+        mode = "transcode"
+    command += ["-movflags", "+faststart", _partial_path(output)]
+    try:
+        run_ffmpeg(command, output)
+    finally:
+        os.remove(listing)
+    return {"mode": mode, "latency": round(time.time() - started, 3)}
+
+def load_exports(project_dir):
+    path = os.path.join(project_dir, EXPORT_DIR, EXPORTS_FILE)
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {"outputs": {}}
+
+def save_exports(project_dir, exports):
+    exports["updated"] = time.time()
+    write_json_atomic(os.path.join(project_dir, EXPORT_DIR, EXPORTS_FILE), exports)
+
+def export_key(inputs, preset):
+    """Key of an output: changes whenever an input, the preset or the commands change"""
+    data = json.dumps({"inputs": inputs, "preset": preset, "version": EXPORT_VERSION}, sort_keys=True)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+def export_project(project_dir, platforms=None, workers=None, on_progress=None):
+    """Export every scene and the final cut of a project for the given platforms
+
+    Scene exports run in parallel; a platform's final cut starts as soon as its scenes are done.
+    on_progress(done, total) is called after every finished or skipped output.
+    Returns a summary with the counts per mode, skipped outputs and failures."""
+    started = time.time()
+    platforms = [platform for platform in (platforms or PLATFORM_PRESETS) if platform in PLATFORM_PRESETS]
+    sources = scene_sources(project_dir)
+    summary = {"exported": 0, "skipped": 0, "copied": 0, "failed": [], "outputs": []}
+    if not sources or not platforms:
+        return summary
+    manifest = load_manifest(project_dir)
+    hashes = {filename: asset_hash(project_dir, manifest, filename) for _, filename in sources}
+    exports = load_exports(project_dir)
+    workers = workers or os.cpu_count() or 1
+    scene_jobs = len(sources) * len(platforms)
+    # Split the cores between the jobs that can run at once
+    threads = max(1, (os.cpu_count() or 1) // min(workers, scene_jobs))
+    total = scene_jobs + len(platforms)
+    done = 0
+
+    def finish(relative, key, result=None, error=None):
+        nonlocal done
+        done += 1
+        if error is not None:
+            summary["failed"].append((relative, str(error)))
+        elif result is None:
+            summary["skipped"] += 1
+            summary["outputs"].append(relative)
+        else:
+            exports["outputs"][relative] = {"key": key, "mode": result["mode"], "saved": time.time()}
+            summary["exported"] += 1
+            summary["copied"] += result["mode"] != "transcode"
+            summary["outputs"].append(relative)
+        if on_progress:
+            on_progress(done, total)
+
+    def is_current(relative, key):
+        entry = exports["outputs"].get(relative)
+        return entry is not None and entry["key"] == key and os.path.exists(os.path.join(project_dir, EXPORT_DIR, relative))
+
+    remaining = {platform: len(sources) for platform in platforms}
+    failed_platforms = set()
+    pending = {}
+    # Spawned, not forked: the app's server process has threads whose locks a fork could copy mid-use
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        def start_final_cut(platform):
+            relative = f"{platform}/{FINAL_CUT}"
+            scene_keys = [exports["outputs"][f"{platform}/{filename}"]["key"] for _, filename in sources]
+            key = export_key(scene_keys, PLATFORM_PRESETS[platform])
+            if is_current(relative, key):
+                finish(relative, key)
+                return
+            scene_paths = [os.path.join(project_dir, EXPORT_DIR, platform, filename) for _, filename in sources]
+            output = os.path.join(project_dir, EXPORT_DIR, relative)
+            pending[pool.submit(concat, scene_paths, output, PLATFORM_PRESETS[platform], threads)] = (platform, relative, key)
+
+        def scene_done(platform):
+            remaining[platform] -= 1
+            if remaining[platform] == 0:
+                if platform in failed_platforms:
+                    finish(f"{platform}/{FINAL_CUT}", None, error="skipped because a scene export failed")
+                else:
+                    start_final_cut(platform)
+
+        for platform in platforms:
+            preset = PLATFORM_PRESETS[platform]
+            os.makedirs(os.path.join(project_dir, EXPORT_DIR, platform), exist_ok=True)
+            for _, filename in sources:
+                relative = f"{platform}/{filename}"
+                key = export_key([hashes[filename]], preset)
+                if is_current(relative, key):
+                    finish(relative, key)
+                    scene_done(platform)
+                    continue
+                output = os.path.join(project_dir, EXPORT_DIR, relative)
+                pending[pool.submit(transcode, os.path.join(project_dir, filename), output, preset, threads)] = (
+                    platform, relative, key)
+
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                platform, relative, key = pending.pop(future)
+                try:
+                    finish(relative, key, result=future.result())
+                except Exception as e:
+                    finish(relative, key, error=e)
+                    failed_platforms.add(platform)
+                if not relative.endswith(f"/{FINAL_CUT}"):
+                    scene_done(platform)
+    save_exports(project_dir, exports)
+    summary["latency"] = round(time.time() - started, 3)
+    metrics.record("postprocess", platforms=platforms, scenes=len(sources), exported=summary["exported"],
+                   skipped=summary["skipped"], copied=summary["copied"], failed=len(summary["failed"]),
+                   workers=workers, latency=summary["latency"])
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a saved project for TikTok, Reels and Shorts")
+    parser.add_argument("project_dir")
+    parser.add_argument("--platforms", nargs="+", choices=list(PLATFORM_PRESETS), default=list(PLATFORM_PRESETS))
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Parallel ffmpeg jobs")
+    args = parser.parse_args()
+
+    summary = export_project(args.project_dir, args.platforms, args.workers,
+                             on_progress=lambda done, total: print(f"\r{done}/{total} outputs", end="", flush=True))
+    print()
+    print(f"{summary['exported']} exported ({summary['copied']} by stream copy), {summary['skipped']} unchanged, "
+          f"{len(summary['failed'])} failed in {summary.get('latency', 0):.1f}s")
+    for relative, error in summary["failed"]:
+        print(f"  {relative}: {error}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Opt-in wall-clock profiler for Streamlit reruns.
+
+Views decorated with @profiled and blocks wrapped in section() are timed
+while a rerun is being profiled; everything else costs one attribute lookup.
+Each profiled rerun is summarized as a tree of frames (total time and calls
+per call path), a rolling history of those summaries is kept per session,
+and the history can be exported as folded stacks ("a;b;c <microseconds>"),
+the input format of flamegraph.pl, speedscope and similar tools.
+"""
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+# Reruns kept in the rolling history of a session
+HISTORY_SIZE = 50
+
+# Each script run happens on its own thread, so the active profile is per thread
+_active = threading.local()
+
+class RerunProfile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stack = []
+        self.frames = {}
+
+@contextmanager
+def section(name):
+    """Time a block as a frame under whatever is currently being timed"""
+    profile = getattr(_active, "profile", None)
+    if profile is None:
+        yield
+        return
+    profile.stack.append(name)
+    path = tuple(profile.stack)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        frame = profile.frames.setdefault(path, [0.0, 0])
+        frame[0] += time.perf_counter() - started
+        frame[1] += 1
+        profile.stack.pop()
+
+def profiled(func):
+    """Time every call of a view function while profiling"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if getattr(_active, "profile", None) is None:
+            return func(*args, **kwargs)
+        with section(func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+@contextmanager
+def profile_rerun(history, enabled=True, **info):
+    """Profile one rerun and append its summary to history (also when st.rerun() interrupts it)"""
+    if not enabled:
+        yield
+        return
+    profile = RerunProfile()
+    _active.profile = profile
+    completed = False
+    try:
+        with section("rerun"):
+            yield
+        completed = True
+    finally:
+        _active.profile = None
+        history.append({
+            "ts": time.time(),
+            "total": time.perf_counter() - profile.started,
+            "completed": completed,
+            "frames": [{"path": list(path), "total": total, "calls": calls}
+                       for path, (total, calls) in profile.frames.items()],
+            **info
+        })
+        del history[:-HISTORY_SIZE]
+
+def frame_table(summary):
+    """Rows of one rerun summary with self time (total minus the frames directly below)"""
+    child_time = {}
+    for frame in summary["frames"]:
+        parent = tuple(frame["path"][:-1])
+        child_time[parent] = child_time.get(parent, 0.0) + frame["total"]
+    rows = []
+    for frame in summary["frames"]:
+        path = tuple(frame["path"])
+        rows.append({
+            "frame": " › ".join(frame["path"][1:]) or frame["path"][0],
+            "total_ms": round(frame["total"] * 1000, 1),
+            "self_ms": round((frame["total"] - child_time.get(path, 0.0)) * 1000, 1),
+            "calls": frame["calls"]
+        })
+    rows.sort(key=lambda row: row["total_ms"], reverse=True)
+    return rows
+
+def folded_stacks(history):
+    """Self time of every call path over the whole history, one folded stack per line"""
+    totals = {}
+    for summary in history:
+        child_time = {}
+        for frame in summary["frames"]:
+            parent = tuple(frame["path"][:-1])
+            child_time[parent] = child_time.get(parent, 0.0) + frame["total"]
+        for frame in summary["frames"]:
+            path = tuple(frame["path"])
+            totals[path] = totals.get(path, 0.0) + frame["total"] - child_time.get(path, 0.0)
+    lines = []
+    for path, seconds in sorted(totals.items()):
+        microseconds = int(seconds * 1_000_000)
+        if microseconds > 0:
+            lines.append(f"{';'.join(name.replace(';', ',').replace(' ', '_') for name in path)} {microseconds}")
+    return "\n".join(lines) + "\n"
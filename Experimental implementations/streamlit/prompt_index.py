@@ -0,0 +1,175 @@
+"""Near-duplicate prompt cache of generated outputs.
+
+Every finished prediction is stored with its stage, model, quality, input
+asset (the image of a video, the video of a sound) and a text embedding of
+its prompt. The embedding is a hashed bag of words, word pairs and character
+trigrams, so it needs no external service and a prompt that differs in an
+adjective or two stays close to the original. Lookups compare a new prompt
+against all stored prompts of the stage at once with a matrix product; a
+match above the threshold, made by one of the models the prediction could
+run on, is offered as a candidate before a new prediction is paid for.
+
+Replicate output URLs expire after about an hour. A candidate is offered by
+its URL while that is valid, so the next stage can pass it straight to
+Replicate, and by its local copy (once one has been attached) after that.
+"""
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from functools import lru_cache
+
+import numpy as np
+
+DEFAULT_INDEX_PATH = os.getenv("FLOWLY_PROMPT_INDEX", "prompt_index.db")
+DEFAULT_THRESHOLD = float(os.getenv("FLOWLY_PROMPT_CACHE_THRESHOLD", "0.9"))
+
+DIMENSIONS = 1024
+# Seconds a prediction output URL stays downloadable
+URL_TTL = 3600
+
+# Quality levels an output can stand in for
+SERVES_QUALITY = {"draft": ["draft", "final"], "final": ["final"]}
+
+logger = logging.getLogger("flowly.prompt_index")
+
+WORD = re.compile(r"\w+")
+
+def features(text):
+    """Words, word pairs and character trigrams of a prompt"""
+    text = " ".join(WORD.findall(text.lower()))
+    words = text.split()
+    grams = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    grams += [text[i:i + 3] for i in range(len(text) - 2)]
+    return grams
+
+@lru_cache(maxsize=4096)
+def embed(text):
+    """Unit-length hashed embedding of a prompt (signed feature hashing with log term counts)"""
+    vector = np.zeros(DIMENSIONS, dtype=np.float32)
+    grams = features(text)
+    if not grams:
+        return vector
+    hashes = np.array([zlib.crc32(gram.encode()) for gram in grams], dtype=np.uint32)
+    buckets, counts = np.unique(hashes, return_counts=True)
+    signs = np.where(buckets & 0x80000000, -1.0, 1.0).astype(np.float32)
+    np.add.at(vector, buckets % DIMENSIONS, signs * (1 + np.log(counts)).astype(np.float32))
+    norm = np.linalg.norm(vector)
+    if norm:
+        vector /= norm
+    vector.setflags(write=False)
+    return vector
+
+class PromptIndex:
+    """Prompts and outputs of past predictions in SQLite, with the embeddings of each stage kept in memory"""
+
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS prompts (id INTEGER PRIMARY KEY, stage TEXT NOT NULL, model TEXT NOT NULL, "
+            "quality TEXT NOT NULL, condition TEXT NOT NULL, prompt TEXT NOT NULL, url TEXT NOT NULL, "
+            "path TEXT, created REAL NOT NULL, vector BLOB NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS prompts_url ON prompts (url)")
+        # stage -> (rows, matrix); loaded on first use and appended to by add()
+        self.stages = {}
+
+    def _load(self, stage):
+        if stage not in self.stages:
+            rows = self.conn.execute(
+                "SELECT id, model, quality, condition, prompt, url, path, created, vector FROM prompts WHERE stage = ? "
+                "ORDER BY id", (stage,)
+            ).fetchall()
+            entries = [dict(zip(["id", "model", "quality", "condition", "prompt", "url", "path", "created"], row[:8]))
+                       for row in rows]
+            matrix = (np.frombuffer(b"".join(row[8] for row in rows), dtype=np.float32).reshape(-1, DIMENSIONS)
+                      if rows else np.zeros((0, DIMENSIONS), dtype=np.float32))
+            self.stages[stage] = (entries, matrix)
+        return self.stages[stage]
+
+    def add(self, stage, model, quality, prompt, url, condition=""):
+        """Store a finished prediction"""
+        vector = embed(prompt)
+        created = time.time()
+        with self.lock:
+            cursor = self.conn.execute(
+                "INSERT INTO prompts (stage, model, quality, condition, prompt, url, created, vector) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (stage, model, quality, condition or "", prompt, url, created, vector.tobytes())
+            )
+            if stage in self.stages:
+                entries, matrix = self.stages[stage]
+                entries.append({"id": cursor.lastrowid, "model": model, "quality": quality, "condition": condition or "",
+                                "prompt": prompt, "url": url, "path": None, "created": created})
+                self.stages[stage] = (entries, np.vstack([matrix, vector[None, :]]))
+
+    def attach_path(self, url, path):
+        """Record a local copy of an output so it can still be offered after its URL expires"""
+        with self.lock:
+            self.conn.execute("UPDATE prompts SET path = ? WHERE url = ?", (path, url))
+            for entries, _ in self.stages.values():
+                for entry in entries:
+                    if entry["url"] == url:
+                        entry["path"] = path
+
+    def lookup(self, stage, prompt, quality="final", condition="", threshold=DEFAULT_THRESHOLD, exclude=(),
+               models=None):
+        """Most similar earlier output of a stage that can stand in for this prediction, or None
+
+        models limits the candidates to outputs of those models (names without version).
+        Returns the entry with its similarity and the asset to use (URL or local copy)."""
+        with self.lock:
+            entries, matrix = self._load(stage)
+            if not entries:
+                return None
+            similarities = matrix @ embed(prompt)
+        now = time.time()
+        serves = SERVES_QUALITY.get(quality, ["final"])
+        for position in np.argsort(-similarities):
+            similarity = float(similarities[position])
+            if similarity < threshold:
+                break
+            entry = entries[position]
+            if entry["quality"] not in serves or entry["condition"] != (condition or ""):
+                continue
+            if models is not None and entry["model"] not in models:
+                continue
+            if os.path.exists(entry["url"]) or now - entry["created"] < URL_TTL:
+                asset = entry["url"]
+            elif entry["path"] and os.path.exists(entry["path"]):
+                asset = entry["path"]
+            else:
+                continue
+            if asset in exclude or entry["url"] in exclude:
+                continue
+            return {**entry, "similarity": similarity, "asset": asset}
+        return None
+
+    def stats(self):
+        """Stored prompts per stage and model"""
+        with self.lock:
+            rows = self.conn.execute("SELECT stage, model, COUNT(*) FROM prompts GROUP BY stage, model").fetchall()
+        return {(stage, model): count for stage, model, count in rows}
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_index():
+    """Process-wide prompt index"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = PromptIndex()
+        return _index
+
+def remember(stage, model, quality, prompt, url, condition=""):
+    """Add a prediction to the index; a broken index never fails the prediction itself"""
+    try:
+        get_index().add(stage, model, quality, prompt, url, condition)
+    except Exception as e:
+        logger.warning("Could not index %s prompt: %s", stage, e)
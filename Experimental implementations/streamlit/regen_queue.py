@@ -0,0 +1,137 @@
+"""Debounced, coalescing regeneration of single scene stages.
+
+Regenerating a stage (from its button or after editing its prompt) does not
+start a prediction right away: the request waits DEBOUNCE seconds, and a
+newer request for the same scene and stage within that time replaces it, so
+a burst of edits and clicks becomes one prediction. A newer request also
+supersedes one that is already queued or running, which is cancelled in the
+generation service and, through it, on Replicate.
+
+Every request carries a version number per scene and stage. Its future
+resolves to the prediction's result, or to Superseded when a newer version
+replaced it; callers apply a result only while it is the latest version.
+"""
+import os
+import threading
+import time
+from concurrent.futures import CancelledError, Future, InvalidStateError
+
+import metrics
+
+DEBOUNCE = float(os.getenv("FLOWLY_REGEN_DEBOUNCE", "1.0"))
+
+class Superseded(Exception):
+    """A newer request for the same scene and stage replaced this one"""
+
+class Request:
+    """One version of a scene stage's regeneration"""
+
+    def __init__(self, key, version, start, details):
+        self.key = key
+        self.version = version
+        self.start = start
+        self.details = details
+        self.future = Future()
+        # Future of the started prediction, once the debounce delay is over
+        self.started = None
+        self.superseded = False
+        self.created = time.time()
+
+    def resolve(self, result=None, error=None):
+        try:
+            if error is None:
+                self.future.set_result(result)
+            else:
+                self.future.set_exception(error)
+        except InvalidStateError:
+            pass
+
+class RegenerationQueue:
+    """Latest regeneration request of every scene stage, started after a quiet period
+
+    start() of a request returns a concurrent.futures.Future of the
+    prediction; cancel(future) stops a queued or running prediction."""
+
+    def __init__(self, cancel, debounce=DEBOUNCE):
+        self.cancel = cancel
+        self.debounce = debounce
+        self.lock = threading.Lock()
+        self.latest = {}
+        self.timers = {}
+
+    def submit(self, key, start, details=None, debounce=None):
+        """Request a regeneration, superseding the pending or running one of the same key"""
+        with self.lock:
+            previous = self.latest.get(key)
+            request = Request(key, previous.version + 1 if previous else 1, start, details or {})
+            self.latest[key] = request
+            timer = self.timers.pop(key, None)
+        if timer:
+            timer.cancel()
+        if previous:
+            self._supersede(previous)
+        timer = threading.Timer(self.debounce if debounce is None else debounce, self._start, args=(request,))
+        timer.daemon = True
+        with self.lock:
+            if self.latest.get(key) is request:
+                self.timers[key] = timer
+                timer.start()
+        return request
+
+    def is_latest(self, request):
+        with self.lock:
+            return self.latest.get(request.key) is request
+
+    def pending(self, key):
+        """The latest request of a key while it has not finished, or None"""
+        with self.lock:
+            request = self.latest.get(key)
+        return request if request and not request.future.done() else None
+
+    def _supersede(self, request):
+        with self.lock:
+            request.superseded = True
+            started = request.started
+        if request.future.done():
+            return
+        if started is not None:
+            # Already queued or running in the generation service
+            self.cancel(started)
+        metrics.record("regeneration_superseded", key=list(request.key), version=request.version,
+                       started=started is not None)
+        request.resolve(error=Superseded(f"version {request.version} was superseded"))
+
+    def _start(self, request):
+        with self.lock:
+            if self.latest.get(request.key) is not request or request.superseded:
+                return
+            self.timers.pop(request.key, None)
+        try:
+            started = request.start()
+        except Exception as e:
+            request.resolve(error=e)
+            return
+        with self.lock:
+            request.started = started
+            superseded = request.superseded
+        if superseded:
+            # Replaced while it was being submitted
+            self.cancel(started)
+            return
+        started.add_done_callback(lambda future: self._finish(request, future))
+
+    def _finish(self, request, future):
+        if request.superseded or not self.is_latest(request):
+            request.resolve(error=Superseded(f"version {request.version} was superseded"))
+        elif future.cancelled():
+            request.resolve(error=CancelledError())
+        elif future.exception() is not None:
+            request.resolve(error=future.exception())
+        else:
+            request.resolve(future.result())
+
+    def forget(self, key, request):
+        """Drop a finished request once its result was applied (or discarded)"""
+        with self.lock:
+            if self.latest.get(key) is request and request.future.done():
+                del self.latest[key]
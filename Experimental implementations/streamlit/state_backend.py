@@ -0,0 +1,143 @@
+"""Project state stored outside the Streamlit process.
+
+The storyboard and generation state of a project is kept in a key-value
+backend instead of st.session_state alone, so any app replica can serve a
+project (identified by ?project=<id> in the URL) and state survives process
+restarts. SQLite is the default backend; point every replica at the same
+file on shared storage. LocalKVBackend implements the same get/set/delete
+interface in memory, as a stand-in for Redis in tests and single-process
+runs.
+
+Every write bumps a per-project version so replicas can tell when their
+copy is stale. Concurrent writers are last-writer-wins.
+
+Results of background scene renders are stored under their own versioned
+project/scene/stage key as soon as they finish, so whichever replica serves
+the project next applies them, even if the process that rendered them
+never reruns the session.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_STATE_PATH = os.getenv("FLOWLY_STATE_DB", "state.db")
+
+class SQLiteBackend:
+    """Key-value store in a SQLite file"""
+
+    def __init__(self, path=DEFAULT_STATE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, updated REAL NOT NULL)")
+
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value):
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO kv (key, value, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated = excluded.updated",
+                (key, json.dumps(value), time.time())
+            )
+
+    def incr(self, key):
+        """Atomically increment an integer counter and return the new value"""
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+                value = (json.loads(row[0]) if row else 0) + 1
+                self.conn.execute(
+                    "INSERT INTO kv (key, value, updated) VALUES (?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated = excluded.updated",
+                    (key, json.dumps(value), time.time())
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return value
+
+    def delete(self, key):
+        with self.lock:
+            self.conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+
+class LocalKVBackend:
+    """In-memory stand-in for a Redis-style key-value server"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = {}
+
+    def get(self, key):
+        with self.lock:
+            value = self.data.get(key)
+        # Values round-trip through JSON like they would over the network
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = json.dumps(value)
+
+    def incr(self, key):
+        with self.lock:
+            value = json.loads(self.data.get(key, "0")) + 1
+            self.data[key] = json.dumps(value)
+        return value
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+BACKENDS = {"sqlite": SQLiteBackend, "memory": LocalKVBackend}
+
+def open_backend(name=None):
+    """Backend selected by FLOWLY_STATE_BACKEND (sqlite or memory)"""
+    name = name or os.getenv("FLOWLY_STATE_BACKEND", "sqlite")
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown state backend: {name}")
+    return BACKENDS[name]()
+
+def project_version(backend, project_id):
+    return backend.get(f"project:{project_id}:version") or 0
+
+def save_project_state(backend, project_id, state):
+    """Store a project's state and return its new version"""
+    backend.set(f"project:{project_id}:state", state)
+    return backend.incr(f"project:{project_id}:version")
+
+def load_project_state(backend, project_id):
+    """Return (state, version) of a project, or (None, 0) when it is unknown"""
+    version = project_version(backend, project_id)
+    return backend.get(f"project:{project_id}:state"), version
+
+def _result_key(project_id, index, stage):
+    return f"project:{project_id}:scene:{index}:{stage}"
+
+def next_result_version(backend, project_id, index, stage):
+    """Version of a new render request of a scene stage, newer than every earlier one on any replica"""
+    return backend.incr(f"{_result_key(project_id, index, stage)}:version")
+
+def save_stage_result(backend, project_id, index, stage, result):
+    """Store a finished render ({"version": ..., ...}) unless a newer request of the scene stage was made since
+
+    Returns whether it was stored."""
+    key = _result_key(project_id, index, stage)
+    if result["version"] < (backend.get(f"{key}:version") or 0):
+        return False
+    backend.set(f"{key}:result", result)
+    backend.incr(f"project:{project_id}:results")
+    return True
+
+def results_version(backend, project_id):
+    """Counter bumped by every stored render result of a project"""
+    return backend.get(f"project:{project_id}:results") or 0
+
+def load_stage_result(backend, project_id, index, stage):
+    return backend.get(f"{_result_key(project_id, index, stage)}:result")
@@ -0,0 +1,589 @@
+import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+# Topic Prompt Presets
+TOPIC_PROMPTS = {
+    "conspiracy": {
+        "name": "Conspiracy Theory",
+        "prompt": "Create a cinematic, intelligent, and scroll-stopping TikTok script based on this conspiracy theory {input}. Follow this format exactly: Start with a 1-sentence hook (max 2 seconds) using a question or intriguing fact (\"Why did...\", \"What if…\", \"Did you know that…\"). Then build a 7–9 scene script (~20–35 seconds total), written as immersive, voiceover-style narration — not camera directions. Each \"scene\" should be 1–2 sentences max and evoke a visual moment. The tone should feel like a Netflix doc: cinematic, calm, composed, and mysterious — never loud, never clickbait. The final line must leave the viewer wondering or imply the story isn't really over. Use real historical dates, locations, and terminology where possible to enhance realism."
+    },
+    "educational": {
+        "name": "Educational Content",
+        "prompt": "Create an engaging educational TikTok script about {input}. Start with a compelling hook question or surprising fact (1-2 seconds). Build a 6-8 scene script (~25-40 seconds) that teaches the audience something valuable. Use clear, conversational language with smooth transitions between concepts. Each scene should be 1-2 sentences that paint a clear visual picture. Make it informative but entertaining, like a good teacher explaining a fascinating topic."
+    },
+    "motivational": {
+        "name": "Motivational/Inspirational",
+        "prompt": "Create an inspiring and motivational TikTok script based on {input}. Start with a powerful hook that resonates emotionally (1-2 seconds). Build a 5-7 scene script (~20-30 seconds) that tells a compelling story of overcoming challenges or achieving success. Use uplifting language that motivates action. Each scene should be 1-2 sentences that create vivid, inspiring imagery. End with a call to action that empowers the viewer."
+    },
+    "storytelling": {
+        "name": "Storytelling/Narrative",
+        "prompt": "Create a captivating story-based TikTok script about {input}. Start with an intriguing hook that sets up the story (1-2 seconds). Build a 7-10 scene script (~30-45 seconds) that tells a complete narrative with beginning, middle, and end. Use vivid, descriptive language that makes viewers feel like they're experiencing the story. Each scene should be 1-2 sentences that advance the plot. Create emotional connection and satisfying resolution."
+    }
+}
+
+# General Instructions
+GENERAL_PROMPT = """Make sure not to use em dashes (use commas instead) and other punctuation that would confuse the script reader (who is a robot). Next, with the scene informations, generate prompts for the images, the videos (that will be made with the images) and the sound for the scenes. The prompts should be as long and detailed as possible or should be, since it needs to look alluring. Output all scenes (including the hook) with their corresponding prompts in the format and only respond with the finalized format. The format and example prompts are listed below, pay close attention."""
+
+# Model Examples
+MODEL_EXAMPLES = {
+    "image_examples": [
+        "A cinematic, photorealistic medium shot capturing the nostalgic warmth of a mid-2000s indie film. The focus is a young woman with a sleek, straight bob haircut in cool platinum white with freckled skin, looking directly and intently into the camera lens with a knowing smirk, her head is looking up slightly. She wears an oversized band t-shirt that says \"Seedream 3.0 on Replicate\" in huge stylized text over a long-sleeved striped top and simple silver stud earrings. The lighting is soft, golden hour sunlight creating lens flare and illuminating dust motes in the air. The background shows a blurred outdoor urban setting with graffiti-covered walls (the graffiti says \"seedream\" in stylized graffiti lettering), rendered with a shallow depth of field. Natural film grain, a warm, slightly muted color palette, and sharp focus on her expressive eyes enhance the intimate, authentic feel",
+        "A cinematic, photorealistic medium shot capturing the rebellious energy of early 1990s grunge culture. The focus is a young woman with tousled, shoulder-length auburn hair with natural waves and freckled skin, looking directly and intently into the camera lens with a knowing smirk, her head is looking up slightly. She wears an oversized flannel shirt that says \"Seedream 3.0 on Replicate\" in huge stylized text over a band tee and simple hoop earrings. The lighting is moody, overcast daylight filtering through windows creating dramatic shadows. The background shows a blurred indoor coffee shop setting with vintage concert posters covering brick walls (one poster says \"seedream\" in bold concert lettering), rendered with a shallow depth of field. Natural film grain, a desaturated color palette with pops of deep reds and blues, and sharp focus on her expressive eyes enhance the raw, authentic underground feel."
+    ],
+    "video_examples": [
+        "a woman points at the words",
+        "a woman takes her hands out her pockets and gestures to the words with both hands, she is excited, behind her it is raining"
+    ],
+    "sound_examples": [
+        "Generate a continuous printer printing sound with periodic beeps and paper movement, plus a cat pawing at the machine. Add subtle ambient room noise for authenticity, keeping the focus on printing, beeps, and the cat's interaction.",
+        "Begin by creating a soft, steady background of light pacifier suckling. Add subtle, breathy rhythms to mimic a newborn's gentle mouth movements. Keep the sound smooth, natural, and soothing.",
+        "Generate the sound of firecrackers lighting and exploding repeatedly on the ground, followed by fireworks bursting in the sky. Incorporate occasional subtle echoes to mimic an outdoor night ambiance, with no human voices present.",
+        "Begin with the sound of hands scooping up loose plastic debris, followed by the subtle cascading noise as the pieces fall and scatter back down. Include soft crinkling and rustling to emphasize the texture of the plastic. Add ambient factory background noise with distant machinery to create an industrial atmosphere."
+    ]
+}
+
+def _numbered(examples):
+    return chr(10).join([f"{i+1}. {example}" for i, example in enumerate(examples)])
+
+# Static system prompt. It contains no per-request content so that every storyboard
+# call shares the same prefix and the provider's prompt cache can reuse it; the topic
+# prompt and user input are sent afterwards in the user message.
+STORYBOARD_SYSTEM_PROMPT = f"""You are an expert video storyboard creator. Your task is to create detailed storyboards for TikTok-style videos. The topic prompt and the user input are given in the user message.
+
+GENERAL INSTRUCTIONS:
+{GENERAL_PROMPT}
+
+FORMAT:
+{{
+  "scenes": [
+    {{
+      "scene": "Scene script",
+      "scene_image_prompt": "...",
+      "scene_video_prompt": "...",
+      "scene_sound_prompt": "..."
+    }},
+    ...
+  ]
+}}
+
+MODEL EXAMPLES:
+
+Image prompts should be detailed and cinematic like these examples:
+{_numbered(MODEL_EXAMPLES["image_examples"])}
+
+Video prompts should be simple motion descriptions like these examples:
+{_numbered(MODEL_EXAMPLES["video_examples"])}
+
+Sound prompts should be detailed audio descriptions like these examples:
+{_numbered(MODEL_EXAMPLES["sound_examples"])}
+
+IMPORTANT: Your response must be ONLY valid JSON with no additional text, explanations, or markdown formatting."""
+
+# Routes storyboard calls to the same cache shard on the provider side
+PROMPT_CACHE_KEY = "flowly-storyboard-v1"
+
+def build_topic_prompt(user_input, format_type, custom_topic_prompts=None):
+    """Fill the selected format's topic prompt with the user input"""
+    custom_topic_prompts = custom_topic_prompts or {}
+    if format_type in TOPIC_PROMPTS:
+        return TOPIC_PROMPTS[format_type]["prompt"].format(input=user_input)
+    if format_type in custom_topic_prompts:
+        return custom_topic_prompts[format_type].format(input=user_input)
+    return f"Create a video script about: {user_input}"
+
+def build_storyboard_messages(topic_prompt, user_input):
+    """Chat messages with the static prefix first and per-request content last"""
+    return [
+        {"role": "system", "content": STORYBOARD_SYSTEM_PROMPT},
+        {"role": "user", "content": f"TOPIC PROMPT:\n{topic_prompt}\n\nInput: {user_input}"}
+    ]
+
+def log_usage(response, call, started):
+    """Record prompt, cached and completion token counts of a chat completion"""
+    usage = getattr(response, "usage", None)
+    details = getattr(usage, "prompt_tokens_details", None)
+    entry = {
+        "call": call,
+        "model": getattr(response, "model", None),
+        "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+        "cached_tokens": getattr(details, "cached_tokens", 0) or 0,
+        "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+        "latency": round(time.time() - started, 3)
+    }
+    metrics.record("llm_call", **entry)
+    return entry
+
+# Fields every scene needs before it can be generated
+SCENE_FIELDS = ["scene", "scene_image_prompt", "scene_video_prompt", "scene_sound_prompt"]
+
+# Alternative keys the model sometimes uses instead of the expected ones
+FIELD_ALIASES = {
+    "script": "scene",
+    "scene_text": "scene",
+    "image_prompt": "scene_image_prompt",
+    "video_prompt": "scene_video_prompt",
+    "sound_prompt": "scene_sound_prompt",
+    "audio_prompt": "scene_sound_prompt"
+}
+
+def scene_schema(fields=SCENE_FIELDS):
+    """JSON schema of a scene object restricted to the given fields"""
+    return {
+        "type": "object",
+        "properties": {field: {"type": "string"} for field in fields},
+        "required": list(fields),
+        "additionalProperties": False
+    }
+
+STORYBOARD_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "scenes": {"type": "array", "items": scene_schema()}
+    },
+    "required": ["scenes"],
+    "additionalProperties": False
+}
+
+def json_schema_format(name, schema):
+    """Structured output response_format for chat completions"""
+    return {"type": "json_schema", "json_schema": {"name": name, "strict": True, "schema": schema}}
+
+def _strip_fences(text):
+    text = text.strip()
+    text = re.sub(r"^```(?:json)?\s*", "", text)
+    text = re.sub(r"\s*```$", "", text)
+    return text.strip()
+
+def _salvage_scenes(text):
+    """Decode the complete scene objects of a truncated or malformed scenes array"""
+    match = re.search(r'"scenes"\s*:\s*\[', text)
+    position = match.end() if match else text.find("[") + 1
+    if position <= 0:
+        return []
+    decoder = json.JSONDecoder()
+    scenes = []
+    while True:
+        start = text.find("{", position)
+        if start == -1:
+            break
+        try:
+            scene, end = decoder.raw_decode(text, start)
+        except json.JSONDecodeError:
+            break
+        if isinstance(scene, dict):
+            scenes.append(scene)
+        position = end
+    return scenes
+
+def _normalize_scene(scene):
+    normalized = {}
+    for key, value in scene.items():
+        key = FIELD_ALIASES.get(key, key)
+        if key in SCENE_FIELDS and isinstance(value, str) and key not in normalized:
+            normalized[key] = value
+    return normalized
+
+def parse_storyboard_text(text):
+    """Parse a storyboard response, repairing what can be repaired locally
+
+    Returns (storyboard, repaired) where repaired tells whether anything had to be fixed.
+    Raises ValueError when no scene could be recovered."""
+    if not text or not text.strip():
+        raise ValueError("OpenAI returned an empty response")
+    repaired = False
+    cleaned = _strip_fences(text)
+    if cleaned != text.strip():
+        repaired = True
+    try:
+        data = json.loads(cleaned)
+    except json.JSONDecodeError:
+        repaired = True
+        try:
+            # Trailing commas are the most common syntax slip
+            data = json.loads(re.sub(r",\s*([\]}])", r"\1", cleaned))
+        except json.JSONDecodeError:
+            data = {"scenes": _salvage_scenes(cleaned)}
+    if isinstance(data, list):
+        repaired = True
+        data = {"scenes": data}
+    if not isinstance(data, dict) or not isinstance(data.get("scenes"), list):
+        raise ValueError("Invalid storyboard structure: missing 'scenes' list")
+    scenes = []
+    for scene in data["scenes"]:
+        if not isinstance(scene, dict):
+            repaired = True
+            continue
+        normalized = _normalize_scene(scene)
+        if set(normalized) != set(scene):
+            repaired = True
+        scenes.append(normalized)
+    if not scenes:
+        raise ValueError(f"No usable scenes in response: {cleaned[:200]}")
+    return {"scenes": scenes}, repaired
+
+def find_incomplete_scenes(scenes):
+    """Map scene index to the required fields that are missing or empty"""
+    incomplete = {}
+    for i, scene in enumerate(scenes):
+        missing = [field for field in SCENE_FIELDS if not str(scene.get(field, "")).strip()]
+        if missing:
+            incomplete[i] = missing
+    return incomplete
+
+def build_scene_fields_messages(topic_prompt, scenes, index, fields, instructions="", offset=0):
+    """Messages asking for some fields of one scene, with the storyboard (or an excerpt) as context
+
+    offset is the position of scenes[0] in the full storyboard when only an excerpt is sent."""
+    context = [{"scene_number": offset + i + 1, **scene} for i, scene in enumerate(scenes)]
+    storyboard_context = json.dumps({"scenes": context}, indent=2)
+    request = (f"TOPIC PROMPT:\n{topic_prompt}\n\n"
+               f"STORYBOARD SO FAR:\n{storyboard_context}\n\n"
+               f"Write only the following fields for scene {offset + index + 1}: {', '.join(fields)}. "
+               f"Keep them consistent with the neighbouring scenes.")
+    if instructions:
+        request += f"\n\nADDITIONAL INSTRUCTIONS:\n{instructions}"
+    return [
+        {"role": "system", "content": STORYBOARD_SYSTEM_PROMPT},
+        {"role": "user", "content": request}
+    ]
+
+def request_scene_fields(client, topic_prompt, scenes, index, fields, model="gpt-4o", instructions="",
+                         call="scene_fields", offset=0):
+    """Ask the LLM for some fields of a single scene and return them as a dict"""
+    started = time.time()
+    response = client.chat.completions.create(
+        model=model,
+        messages=build_scene_fields_messages(topic_prompt, scenes, index, fields, instructions, offset),
+        temperature=0.7,
+        response_format=json_schema_format("scene_fields", scene_schema(fields)),
+        extra_body={"prompt_cache_key": PROMPT_CACHE_KEY}
+    )
+    log_usage(response, call, started)
+    content = _strip_fences(response.choices[0].message.content or "")
+    try:
+        values = _normalize_scene(json.loads(content))
+    except (json.JSONDecodeError, AttributeError) as e:
+        raise ValueError(f"Invalid JSON for scene {offset + index + 1}: {e}")
+    missing = [field for field in fields if not values.get(field, "").strip()]
+    if missing:
+        raise ValueError(f"Scene {offset + index + 1} still missing required fields: {missing}")
+    return {field: values[field] for field in fields}
+
+def request_storyboard(client, topic_prompt, user_input, model="gpt-4o"):
+    """Generate a schema-constrained storyboard, repairing broken scenes individually
+
+    Returns (storyboard, usage). Raises ValueError when the storyboard cannot be repaired."""
+    started = time.time()
+    response = client.chat.completions.create(
+        model=model,
+        messages=build_storyboard_messages(topic_prompt, user_input),
+        temperature=0.7,
+        response_format=json_schema_format("storyboard", STORYBOARD_SCHEMA),
+        extra_body={"prompt_cache_key": PROMPT_CACHE_KEY}
+    )
+    usage = log_usage(response, "storyboard", started)
+    message = response.choices[0].message
+    if getattr(message, "refusal", None):
+        metrics.record("storyboard_parse", first_try=False, repaired_locally=False, rerequested_scenes=0, ok=False)
+        raise ValueError(f"OpenAI refused the request: {message.refusal}")
+
+    try:
+        storyboard, repaired = parse_storyboard_text(message.content)
+    except ValueError:
+        metrics.record("storyboard_parse", first_try=False, repaired_locally=False, rerequested_scenes=0, ok=False)
+        raise
+    incomplete = find_incomplete_scenes(storyboard["scenes"])
+    first_try = not repaired and not incomplete
+
+    # Re-request only the fields that are still missing, one scene at a time
+    try:
+        for index, fields in incomplete.items():
+            storyboard["scenes"][index].update(
+                request_scene_fields(client, topic_prompt, storyboard["scenes"], index, fields, model, call="scene_repair")
+            )
+    except ValueError:
+        metrics.record("storyboard_parse", first_try=False, repaired_locally=repaired,
+                       rerequested_scenes=len(incomplete), ok=False)
+        raise
+    metrics.record("storyboard_parse", first_try=first_try, repaired_locally=repaired,
+                   rerequested_scenes=len(incomplete), ok=True)
+    return storyboard, usage
+
+# Fields written per scene in the second phase of two-phase generation
+PROMPT_FIELDS = ["scene_image_prompt", "scene_video_prompt", "scene_sound_prompt"]
+
+OUTLINE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "scenes": {"type": "array", "items": scene_schema(["scene"])}
+    },
+    "required": ["scenes"],
+    "additionalProperties": False
+}
+
+# Upper bound on parallel scene expansion calls
+MAX_PARALLEL_EXPANSIONS = 16
+
+def request_outline(client, topic_prompt, user_input, model="gpt-4o"):
+    """First phase: only the scene scripts of the storyboard"""
+    messages = build_storyboard_messages(topic_prompt, user_input)
+    messages[-1]["content"] += ("\n\nFor now write only the outline: the \"scene\" script of every scene, "
+                                "without image, video or sound prompts.")
+    started = time.time()
+    response = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=0.7,
+        response_format=json_schema_format("storyboard_outline", OUTLINE_SCHEMA),
+        extra_body={"prompt_cache_key": PROMPT_CACHE_KEY}
+    )
+    usage = log_usage(response, "outline", started)
+    outline, repaired = parse_storyboard_text(response.choices[0].message.content)
+    scenes = [{"scene": scene["scene"]} for scene in outline["scenes"] if scene.get("scene", "").strip()]
+    if not scenes:
+        raise ValueError("The outline contains no scenes")
+    return scenes, usage, repaired
+
+def expand_scenes(client, topic_prompt, outline, model="gpt-4o", repaired_scenes=None):
+    """Second phase: write the prompts of every scene with parallel calls sharing the outline
+
+    The indices of scenes that needed a second request are appended to repaired_scenes."""
+    repaired_scenes = [] if repaired_scenes is None else repaired_scenes
+
+    def expand(index):
+        try:
+            return request_scene_fields(client, topic_prompt, outline, index, PROMPT_FIELDS, model, call="scene_expand")
+        except ValueError:
+            # Retry just this scene once before giving up on the storyboard
+            repaired_scenes.append(index)
+            return request_scene_fields(client, topic_prompt, outline, index, PROMPT_FIELDS, model, call="scene_repair")
+
+    workers = max(1, min(MAX_PARALLEL_EXPANSIONS, len(outline)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        prompts = list(executor.map(expand, range(len(outline))))
+    return [{"scene": scene["scene"], **scene_prompts} for scene, scene_prompts in zip(outline, prompts)]
+
+def request_storyboard_two_phase(client, topic_prompt, user_input, model="gpt-4o"):
+    """Generate a short outline, then expand all scenes in parallel
+
+    Returns (storyboard, usage) like request_storyboard."""
+    started = time.time()
+    try:
+        outline, usage, repaired = request_outline(client, topic_prompt, user_input, model)
+    except ValueError:
+        metrics.record("storyboard_parse", mode="two_phase", first_try=False, repaired_locally=False,
+                       rerequested_scenes=0, ok=False)
+        raise
+    outline_latency = time.time() - started
+    repaired_scenes = []
+    try:
+        scenes = expand_scenes(client, topic_prompt, outline, model, repaired_scenes)
+    except ValueError:
+        metrics.record("storyboard_parse", mode="two_phase", first_try=False, repaired_locally=repaired,
+                       rerequested_scenes=len(repaired_scenes), ok=False)
+        raise
+    metrics.record("storyboard_parse", mode="two_phase", first_try=not repaired and not repaired_scenes,
+                   repaired_locally=repaired, rerequested_scenes=len(repaired_scenes), ok=True)
+    metrics.record("storyboard_two_phase", scenes=len(scenes), outline_latency=round(outline_latency, 3),
+                   expand_latency=round(time.time() - started - outline_latency, 3),
+                   latency=round(time.time() - started, 3))
+    usage = dict(usage, latency=round(time.time() - started, 3))
+    return {"scenes": scenes}, usage
+
+# Scenes on each side of a rewritten scene that are sent as context
+REWRITE_CONTEXT_SCENES = 2
+
+def rewrite_scene_prompts(client, topic_prompt, scenes, index, instructions="", model="gpt-4o"):
+    """Write new image, video and sound prompts for one scene, using only its neighbours as context"""
+    start = max(0, index - REWRITE_CONTEXT_SCENES)
+    end = min(len(scenes), index + REWRITE_CONTEXT_SCENES + 1)
+    note = f"The current prompts of scene {index + 1} were rejected, write new ones that are clearly different."
+    if instructions.strip():
+        note += f"\n\nRequested changes: {instructions.strip()}"
+    return request_scene_fields(client, topic_prompt, scenes[start:end], index - start, PROMPT_FIELDS, model,
+                                instructions=note, call="scene_rewrite", offset=start)
+
+# Long-form mode: the storyboard is written in chunks of scene scripts, each continuing from a
+# running summary of the story so far, while the prompts of finished scenes are expanded in parallel
+LONG_FORM_CHUNK_SCENES = 10
+LONG_FORM_DEFAULT_SCENES = 60
+
+SUMMARY_FIELDS = ["characters", "setting", "visual_style", "story_so_far"]
+
+# The summary comes after the scenes so that scenes can be used while the chunk is still streaming
+CHUNK_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "scenes": {"type": "array", "items": scene_schema(["scene"])},
+        "summary": {
+            "type": "object",
+            "properties": {field: {"type": "string"} for field in SUMMARY_FIELDS},
+            "required": SUMMARY_FIELDS,
+            "additionalProperties": False
+        }
+    },
+    "required": ["scenes", "summary"],
+    "additionalProperties": False
+}
+
+def format_summary(summary):
+    """Running summary as plain text for the next prompt"""
+    return "\n".join(f"{field.replace('_', ' ').capitalize()}: {summary.get(field, '')}" for field in SUMMARY_FIELDS)
+
+def build_chunk_messages(topic_prompt, user_input, summary, first, count, total):
+    """Messages asking for the scene scripts of one chunk of a long-form storyboard"""
+    messages = build_storyboard_messages(topic_prompt, user_input)
+    request = (f"\n\nLONG-FORM MODE: ignore the scene count and length given in the topic prompt. "
+               f"The full video has {total} scenes and is written in parts. "
+               f"Write only the \"scene\" scripts of scenes {first + 1} to {first + count}, without image, "
+               f"video or sound prompts.")
+    if first == 0:
+        request += " Scene 1 is the hook."
+    if first + count >= total:
+        request += f" Scene {total} is the last scene and must end the story as the topic prompt asks."
+    else:
+        request += " Do not end the story yet."
+    request += (" Then return the updated running summary: the recurring characters (names and looks), "
+                "the setting, the visual style and the story so far.")
+    if summary:
+        request += f"\n\nRUNNING SUMMARY OF SCENES 1 TO {first}:\n{format_summary(summary)}"
+    messages[-1]["content"] += request
+    return messages
+
+def _scan_streamed_scenes(text, position):
+    """Decode the scene objects completed since position in a streamed {"scenes": [...]} document
+
+    Returns (scenes, position); position 0 means the scenes array has not started yet."""
+    if position == 0:
+        match = re.search(r'"scenes"\s*:\s*\[', text)
+        if not match:
+            return [], 0
+        position = match.end()
+    decoder = json.JSONDecoder()
+    scenes = []
+    while True:
+        while position < len(text) and text[position] in " \t\r\n,":
+            position += 1
+        if position >= len(text) or text[position] != "{":
+            break
+        try:
+            scene, end = decoder.raw_decode(text, position)
+        except json.JSONDecodeError:
+            break
+        scenes.append(scene)
+        position = end
+    return scenes, position
+
+def stream_chunk(client, messages, on_scene, model="gpt-4o"):
+    """Stream one chunk, calling on_scene(scene) as soon as each scene object is complete
+
+    Returns (summary, usage)."""
+    started = time.time()
+    stream = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=0.7,
+        response_format=json_schema_format("storyboard_chunk", CHUNK_SCHEMA),
+        extra_body={"prompt_cache_key": PROMPT_CACHE_KEY},
+        stream=True,
+        stream_options={"include_usage": True}
+    )
+    text = ""
+    position = 0
+    last_event = None
+    for event in stream:
+        # The usage arrives in a final event without choices
+        if getattr(event, "usage", None):
+            last_event = event
+        if not event.choices:
+            continue
+        delta = event.choices[0].delta.content
+        if not delta:
+            continue
+        text += delta
+        scenes, position = _scan_streamed_scenes(text, position)
+        for scene in scenes:
+            if isinstance(scene, dict):
+                on_scene(_normalize_scene(scene))
+    usage = log_usage(last_event, "storyboard_chunk", started)
+    try:
+        summary = json.loads(_strip_fences(text)).get("summary")
+    except (json.JSONDecodeError, AttributeError):
+        summary = None
+    if not isinstance(summary, dict):
+        raise ValueError("The storyboard chunk has no running summary")
+    return summary, usage
+
+def request_storyboard_long_form(client, topic_prompt, user_input, total_scenes=LONG_FORM_DEFAULT_SCENES,
+                                 model="gpt-4o", chunk_scenes=LONG_FORM_CHUNK_SCENES):
+    """Generate a long storyboard chunk by chunk, expanding scene prompts while later chunks stream
+
+    Each chunk continues from the running summary of the previous one, so characters, setting
+    and style stay consistent across the whole video. The prompts of a scene are requested the
+    moment its script has streamed in, with its preceding scenes and the summary as context.
+    Returns (storyboard, usage) like request_storyboard."""
+    started = time.time()
+    outline = []
+    futures = []
+    summary = None
+    usage = {"prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+    chunks = 0
+    # Scenes whose prompts needed a second request, and scenes a short chunk left to the next one
+    repaired_scenes = []
+    short_scenes = 0
+
+    def expand(index, excerpt, offset, instructions):
+        try:
+            return request_scene_fields(client, topic_prompt, excerpt, index - offset, PROMPT_FIELDS, model,
+                                        instructions=instructions, call="scene_expand", offset=offset)
+        except ValueError:
+            repaired_scenes.append(index)
+            return request_scene_fields(client, topic_prompt, excerpt, index - offset, PROMPT_FIELDS, model,
+                                        instructions=instructions, call="scene_repair", offset=offset)
+
+    with ThreadPoolExecutor(max_workers=MAX_PARALLEL_EXPANSIONS) as executor:
+        try:
+            while len(outline) < total_scenes:
+                first = len(outline)
+                count = min(chunk_scenes, total_scenes - first)
+                instructions = (f"This is scene {first + 1} of a {total_scenes} scene video. Keep the characters, "
+                                f"setting and visual style consistent with this summary of the earlier scenes:\n"
+                                f"{format_summary(summary)}" if summary else "")
+
+                def on_scene(scene):
+                    if not scene.get("scene", "").strip() or len(outline) >= first + count:
+                        return
+                    index = len(outline)
+                    outline.append({"scene": scene["scene"]})
+                    offset = max(0, index - REWRITE_CONTEXT_SCENES)
+                    futures.append(executor.submit(expand, index, list(outline[offset:]), offset, instructions))
+
+                messages = build_chunk_messages(topic_prompt, user_input, summary, first, count, total_scenes)
+                summary, chunk_usage = stream_chunk(client, messages, on_scene, model)
+                chunks += 1
+                for key in usage:
+                    usage[key] += chunk_usage[key]
+                if len(outline) == first:
+                    raise ValueError(f"The storyboard chunk for scenes {first + 1} to {first + count} is empty")
+                # The missing scenes of a short chunk are requested again with the next chunk
+                short_scenes += first + count - len(outline)
+            narration_latency = time.time() - started
+            prompts = [future.result() for future in futures]
+        except ValueError:
+            for future in futures:
+                future.cancel()
+            metrics.record("storyboard_parse", mode="long_form", first_try=False, repaired_locally=False,
+                           rerequested_scenes=len(repaired_scenes) + short_scenes, ok=False)
+            raise
+    scenes = [{"scene": scene["scene"], **scene_prompts} for scene, scene_prompts in zip(outline, prompts)]
+    latency = round(time.time() - started, 3)
+    metrics.record("storyboard_parse", mode="long_form", first_try=not repaired_scenes and not short_scenes,
+                   repaired_locally=False, rerequested_scenes=len(repaired_scenes) + short_scenes, ok=True)
+    metrics.record("storyboard_long_form", scenes=len(scenes), chunks=chunks,
+                   narration_latency=round(narration_latency, 3), latency=latency)
+    usage.update(call="storyboard_long_form", model=model, latency=latency)
+    return {"scenes": scenes, "summary": summary}, usage
@@ -0,0 +1,120 @@
+"""Deficit round robin scheduling and cancellation in the shared generation service.
+
+    python -m pytest tests
+"""
+import asyncio
+import os
+import sys
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import CancelledError
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+import pytest
+
+from generation_service import GenerationService, Job, next_job
+
+TIMEOUT = 5
+
+def queued(jobs):
+    """Queues of next_job from (session, quality cost) pairs, in submission order"""
+    queues = OrderedDict()
+    for session, cost in jobs:
+        queues.setdefault(session, deque()).append(Job(session, "image", cost, None, ()))
+    return queues
+
+def drain(queues, weights):
+    deficits = {}
+    order = []
+    while (job := next_job(queues, deficits, weights)) is not None:
+        order.append(job.session)
+    return order
+
+def test_weights_set_each_session_share():
+    queues = queued([("a", 1)] * 8 + [("b", 1)] * 8)
+    order = drain(queues, {"a": 2})
+    assert order[:12] == ["a"] * 4 + ["b"] * 2 + ["a"] * 4 + ["b"] * 2
+    assert sorted(order) == ["a"] * 8 + ["b"] * 8
+
+def test_costly_jobs_take_more_credit():
+    # A final render costs twice a draft, so it takes a whole turn
+    queues = queued([("final", 2)] * 3 + [("draft", 1)] * 3)
+    assert drain(queues, {}) == ["final", "draft", "draft", "final", "draft", "final"]
+
+def test_set_weight_rejects_non_positive_weights():
+    service = GenerationService(limits={"image": 1})
+    with pytest.raises(ValueError):
+        service.set_weight("a", 0)
+
+@pytest.fixture
+def service():
+    """Service with one image slot, and a job that holds the slot until released"""
+    service = GenerationService(limits={"image": 1})
+    release = threading.Event()
+
+    async def blocker():
+        while not release.is_set():
+            await asyncio.sleep(0.01)
+
+    service.blocked = service.submit("blocker", "image", "draft", blocker)
+    service.release = release
+    yield service
+    release.set()
+
+def test_dispatch_follows_weights(service):
+    started = []
+
+    async def record(name):
+        started.append(name)
+
+    service.set_weight("a", 2)
+    futures = [service.submit(session, "image", "draft", record, session) for session in ["a", "b"] * 4]
+    service.release.set()
+    for future in futures:
+        future.result(TIMEOUT)
+    assert started == ["a"] * 4 + ["b"] * 4
+
+def test_cancel_queued_job(service):
+    ran = []
+
+    async def record():
+        ran.append(True)
+
+    future = service.submit("a", "image", "draft", record)
+    assert service.cancel(future)
+    assert future.cancelled()
+    assert service.status("a") == {"running": 0, "queued": 0, "ahead": None}
+    service.release.set()
+    service.blocked.result(TIMEOUT)
+    # Another job runs, so the cancelled one would have been dispatched before it
+    service.submit("b", "image", "draft", record).result(TIMEOUT)
+    assert ran == [True]
+
+def test_cancel_running_job(service):
+    started = threading.Event()
+    cancelled = threading.Event()
+
+    async def prediction():
+        started.set()
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    service.release.set()
+    future = service.submit("a", "image", "draft", prediction)
+    assert started.wait(TIMEOUT)
+    assert service.cancel(future)
+    with pytest.raises(CancelledError):
+        future.result(TIMEOUT)
+    # The coroutine itself was cancelled, which is what cancels its prediction on Replicate
+    assert cancelled.is_set()
+    assert service.snapshot()["image"]["running"] == 0
+
+def test_cancel_finished_job(service):
+    service.release.set()
+    service.blocked.result(TIMEOUT)
+    assert not service.cancel(service.blocked)
@@ -0,0 +1,154 @@
+"""Claims, leases, retries, global rate limits and shared model health of the SQLite job store.
+
+Every test opens its own database file and runs on a fake clock.
+
+    python -m pytest tests
+"""
+import os
+import sys
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+import pytest
+
+import job_store
+from job_store import MAX_ATTEMPTS, JobStore
+from models import FAILURE_COOLDOWN, FAILURES_BEFORE_COOLDOWN, get_router
+
+SCENE = {
+    "scene_image_prompt": "A lighthouse at dawn",
+    "scene_video_prompt": "Waves roll in slowly",
+    "scene_sound_prompt": "Gulls and surf"
+}
+
+IMAGE_MODELS = get_router("image").models
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(job_store, "time", clock)
+    return clock
+
+@pytest.fixture
+def open_store(tmp_path, clock):
+    """Opens stores on one database file, like worker processes sharing it"""
+    stores = []
+
+    def open_store(**kwargs):
+        store = JobStore(str(tmp_path / "jobs.db"), rate_limits=kwargs.pop("rate_limits", {}), **kwargs)
+        stores.append(store)
+        return store
+
+    yield open_store
+    for store in stores:
+        store.close()
+
+def test_claim_follows_dependencies(open_store):
+    store = open_store()
+    image_id, video_id, _ = store.enqueue_scene("project", 0, SCENE)
+
+    job = store.claim("worker")
+    assert (job["id"], job["stage"], job["model"], job["attempts"]) == (image_id, "image", IMAGE_MODELS[0], 1)
+    assert job["payload"] == {"prompt": SCENE["scene_image_prompt"]}
+    # The video waits for its image
+    assert store.claim("worker") is None
+
+    assert store.complete(image_id, "worker", {"url": "https://example.com/image.png"})
+    job = store.claim("worker")
+    assert job["id"] == video_id
+    assert job["parent_result"] == {"url": "https://example.com/image.png"}
+
+def test_claim_filters_stages(open_store):
+    store = open_store()
+    store.enqueue_scene("project", 0, SCENE)
+    assert store.claim("worker", stages=["video"]) is None
+    assert store.claim("worker", stages=["image"])["stage"] == "image"
+
+def test_expired_lease_is_reclaimed(open_store, clock):
+    store = open_store(lease_seconds=60)
+    image_id = store.enqueue_scene("project", 0, SCENE)[0]
+    store.claim("dead worker")
+
+    clock.now += 30
+    assert store.heartbeat(image_id, "dead worker")
+    clock.now += 61
+    job = store.claim("worker")
+    assert (job["id"], job["attempts"]) == (image_id, 2)
+    # The first worker lost its lease and cannot finish the job any more
+    assert not store.heartbeat(image_id, "dead worker")
+    assert not store.complete(image_id, "dead worker", {"url": "late"})
+    assert store.complete(image_id, "worker", {"url": "https://example.com/image.png"})
+
+def test_lease_expiring_too_often_fails_the_scene(open_store, clock):
+    store = open_store(lease_seconds=60)
+    store.enqueue_scene("project", 0, SCENE)
+    for _ in range(MAX_ATTEMPTS):
+        assert store.claim("worker")["stage"] == "image"
+        clock.now += 61
+    assert store.claim("worker") is None
+    statuses = [(job["stage"], job["status"]) for job in store.project_status("project")]
+    assert statuses == [("image", "failed"), ("video", "failed"), ("sound", "failed")]
+    assert not store.has_unfinished()
+
+def test_failed_job_is_retried_until_max_attempts(open_store, clock):
+    store = open_store()
+    image_id = store.enqueue_scene("project", 0, SCENE)[0]
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        job = store.claim("worker")
+        assert (job["id"], job["attempts"]) == (image_id, attempt)
+        assert store.fail(image_id, "worker", "prediction failed")
+        # Cooldowns are not what this test is about
+        clock.now += FAILURE_COOLDOWN + 1
+    assert store.claim("worker") is None
+    jobs = store.project_status("project")
+    assert [job["status"] for job in jobs] == ["failed"] * 3
+    assert jobs[0]["error"] == "prediction failed"
+    assert jobs[1]["error"] == f"dependency {image_id} failed"
+
+def test_in_flight_limit_holds_across_stores(open_store):
+    limits = {IMAGE_MODELS[0]: {"max_in_flight": 1}, IMAGE_MODELS[1]: {"max_in_flight": 1}}
+    first, second = open_store(rate_limits=limits), open_store(rate_limits=limits)
+    first.enqueue_storyboard("project", [SCENE] * 3)
+
+    jobs = [first.claim("worker 1"), second.claim("worker 2")]
+    assert [job["model"] for job in jobs] == IMAGE_MODELS[:2]
+    assert second.claim("worker 2") is None
+
+    first.complete(jobs[0]["id"], "worker 1", {"url": "https://example.com/image.png"})
+    assert second.claim("worker 2", stages=["image"])["model"] == IMAGE_MODELS[0]
+
+def test_per_minute_limit(open_store, clock):
+    store = open_store(rate_limits={model: {"per_minute": 1} for model in IMAGE_MODELS})
+    store.enqueue_storyboard("project", [SCENE] * 3)
+    assert [store.claim("worker")["model"] for _ in IMAGE_MODELS] == IMAGE_MODELS
+    assert store.claim("worker") is None
+    clock.now += 61
+    assert store.claim("worker")["model"] == IMAGE_MODELS[0]
+
+def test_failing_model_is_routed_around_by_every_worker(open_store, clock):
+    first, second = open_store(), open_store()
+    first.enqueue_storyboard("project", [SCENE] * 3)
+    for _ in range(FAILURES_BEFORE_COOLDOWN):
+        job = first.claim("worker 1")
+        assert job["model"] == IMAGE_MODELS[0]
+        first.fail(job["id"], "worker 1", "model down")
+
+    assert second.claim("worker 2")["model"] == IMAGE_MODELS[1]
+    clock.now += FAILURE_COOLDOWN + 1
+    assert second.claim("worker 2")["model"] == IMAGE_MODELS[0]
+
+def test_cooling_model_is_used_when_no_other_is_allowed(open_store):
+    store = open_store(rate_limits={IMAGE_MODELS[1]: {"max_in_flight": 0}})
+    store.enqueue_storyboard("project", [SCENE] * 2)
+    for _ in range(FAILURES_BEFORE_COOLDOWN):
+        job = store.claim("worker")
+        store.fail(job["id"], "worker", "model down")
+    assert store.claim("worker")["model"] == IMAGE_MODELS[0]
@@ -0,0 +1,129 @@
+"""Local files in a scene (reopened projects, reused shots) are uploaded to Replicate, not sent as paths.
+
+Runs app.py with Streamlit's AppTest; run_prediction is replaced, so no Replicate calls are made.
+
+    python -m pytest tests
+"""
+import io
+import json
+import os
+import sys
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_FILE = os.path.join(APP_DIR, "app.py")
+
+# Configure the app before it is first imported
+os.environ.pop("FLOWLY_FAKE_GENERATION", None)
+os.environ["FLOWLY_STATE_BACKEND"] = "memory"
+os.environ["FLOWLY_REGEN_DEBOUNCE"] = "0.05"
+os.environ["FLOWLY_EXPORT_PORT"] = "0"
+sys.path.insert(0, APP_DIR)
+
+import numpy as np
+import pytest
+import streamlit as st
+from PIL import Image
+from streamlit.testing.v1 import AppTest
+
+import generation
+from generation import FAKE_PNG
+
+SCENE = {
+    "scene": "Test scene",
+    "scene_image_prompt": "A lighthouse at dawn",
+    "scene_video_prompt": "Waves roll in slowly",
+    "scene_sound_prompt": "Gulls and surf"
+}
+
+@pytest.fixture(scope="module")
+def workdir(tmp_path_factory):
+    """Working directory of the app (final_videos/, catalogs, metrics), shared because the prompt index is opened once per process"""
+    path = tmp_path_factory.mktemp("flowly")
+    previous = os.getcwd()
+    os.environ["FLOWLY_METRICS_FILE"] = str(path / "metrics.jsonl")
+    os.chdir(path)
+    yield path
+    os.chdir(previous)
+
+@pytest.fixture(autouse=True)
+def fresh_resources(workdir):
+    """Catalog, shot index and services are rebuilt, so they pick up the projects a test saved"""
+    st.cache_resource.clear()
+
+@pytest.fixture
+def predictions(monkeypatch, workdir):
+    """Inputs of every prediction, with file inputs read back; each prediction returns a placeholder file"""
+    calls = []
+    output = workdir / "output.mp4"
+    output.write_bytes(b"\0" * 1024)
+
+    async def run_prediction(model, input):
+        calls.append({"model": model, **{key: value.read() if hasattr(value, "read") else value
+                                         for key, value in input.items()}})
+        return str(output)
+
+    monkeypatch.setattr(generation, "run_prediction", run_prediction)
+    return calls
+
+def save_project(workdir, name, files):
+    """A saved project directory with one scene and the given scene_1_* files"""
+    project_dir = workdir / "final_videos" / name
+    project_dir.mkdir(parents=True)
+    (project_dir / "storyboard.json").write_text(json.dumps({"scenes": [SCENE]}))
+    for filename, data in files.items():
+        (project_dir / filename).write_bytes(data)
+    return project_dir
+
+def scene_image():
+    """PNG with enough structure for a perceptual hash"""
+    x, y = np.meshgrid(np.arange(64), np.arange(64))
+    pixels = ((x * 4 + np.where((x // 16 + y // 16) % 2, 96, 0)) % 256).astype(np.uint8)
+    data = io.BytesIO()
+    Image.fromarray(pixels).save(data, format="PNG")
+    return data.getvalue()
+
+def open_project(name):
+    at = AppTest.from_file(APP_FILE, default_timeout=60).run()
+    next(button for button in at.button if button.label == "📂 Saved Projects").click().run()
+    at.button(key=f"open_{name}").click().run()
+    assert not at.exception
+    return at
+
+def wait_for(at, stage, timeout=10):
+    """Rerun until a queued regeneration of the first scene has been applied"""
+    deadline = time.time() + timeout
+    while not at.session_state.scene_states[0][f"{stage}_generated"]:
+        assert time.time() < deadline, f"{stage} was not generated: {[element.value for element in at.error]}"
+        time.sleep(0.1)
+        at.run()
+    assert not at.error
+
+def test_reopened_project_uploads_its_image(workdir, predictions):
+    save_project(workdir, "project_20250101_120000", {"scene_1_Test_scene_image.png": FAKE_PNG})
+    at = open_project("project_20250101_120000")
+    image = at.session_state.scene_data[0]["generated_image"]
+    assert os.path.isfile(image)
+
+    at.button(key="vid_0").click().run()
+    wait_for(at, "video")
+
+    assert len(predictions) == 1
+    assert predictions[0]["start_image"] == FAKE_PNG
+
+def test_reused_shot_uploads_its_video_for_sound(workdir, predictions):
+    image = scene_image()
+    video = b"shot video " * 100
+    save_project(workdir, "project_20250102_120000", {"scene_1_Test_scene_image.png": image,
+                                                      "scene_1_Test_scene_video.mp4": video})
+    save_project(workdir, "project_20250103_120000", {"scene_1_Test_scene_image.png": image})
+    at = open_project("project_20250103_120000")
+
+    at.button(key="shot_0").click().run()
+    assert at.session_state.scene_data[0]["generated_video"].endswith(
+        os.path.join("project_20250102_120000", "scene_1_Test_scene_video.mp4"))
+    at.button(key="sound_0").click().run()
+    wait_for(at, "sound")
+
+    assert len(predictions) == 1
+    assert predictions[0]["video"] == video
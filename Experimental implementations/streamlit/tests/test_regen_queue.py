@@ -0,0 +1,106 @@
+"""Debouncing and superseding of scene stage regenerations.
+
+    python -m pytest tests
+"""
+import os
+import sys
+import threading
+from concurrent.futures import CancelledError, Future
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+import pytest
+
+import metrics
+from regen_queue import RegenerationQueue, Superseded
+
+# Long enough that a burst of submits always lands inside one debounce window
+DEBOUNCE = 0.5
+TIMEOUT = 5
+KEY = ("session", "project", 0, "video")
+
+@pytest.fixture(autouse=True)
+def metrics_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_FILE", str(tmp_path / "metrics.jsonl"))
+
+class Predictions:
+    """start() and cancel() of a RegenerationQueue; started predictions stay pending until finished by the test"""
+
+    def __init__(self):
+        self.started = []
+        self.cancelled = []
+        self.condition = threading.Condition()
+
+    def start(self, name):
+        def start():
+            future = Future()
+            future.set_running_or_notify_cancel()
+            with self.condition:
+                self.started.append((name, future))
+                self.condition.notify_all()
+            return future
+        return start
+
+    def wait_started(self, count):
+        with self.condition:
+            return self.condition.wait_for(lambda: len(self.started) >= count, TIMEOUT)
+
+    def cancel(self, future):
+        self.cancelled.append(future)
+        future.set_exception(CancelledError())
+        return True
+
+@pytest.fixture
+def predictions():
+    return Predictions()
+
+def test_burst_starts_only_the_latest_request(predictions):
+    queue = RegenerationQueue(predictions.cancel, debounce=DEBOUNCE)
+    requests = [queue.submit(KEY, predictions.start(name)) for name in ["first", "second", "third"]]
+    assert [request.version for request in requests] == [1, 2, 3]
+
+    for request in requests[:2]:
+        with pytest.raises(Superseded):
+            request.future.result(TIMEOUT)
+    assert predictions.wait_started(1)
+    assert [name for name, _ in predictions.started] == ["third"]
+    # Nothing had started yet, so there was nothing to cancel
+    assert predictions.cancelled == []
+
+    predictions.started[0][1].set_result("https://example.com/video.mp4")
+    assert requests[2].future.result(TIMEOUT) == "https://example.com/video.mp4"
+    assert queue.is_latest(requests[2])
+
+def test_newer_request_cancels_a_started_one(predictions):
+    queue = RegenerationQueue(predictions.cancel, debounce=0)
+    first = queue.submit(KEY, predictions.start("first"))
+    assert predictions.wait_started(1)
+    started = predictions.started[0][1]
+
+    second = queue.submit(KEY, predictions.start("second"), debounce=DEBOUNCE)
+    with pytest.raises(Superseded):
+        first.future.result(TIMEOUT)
+    assert predictions.cancelled == [started]
+    assert queue.pending(KEY) is second
+
+def test_other_keys_are_independent(predictions):
+    queue = RegenerationQueue(predictions.cancel, debounce=0)
+    video = queue.submit(KEY, predictions.start("video"))
+    sound = queue.submit(KEY[:3] + ("sound",), predictions.start("sound"))
+    assert predictions.wait_started(2)
+    assert sorted(name for name, _ in predictions.started) == ["sound", "video"]
+    assert not video.superseded and not sound.superseded
+    assert predictions.cancelled == []
+
+def test_failed_start_resolves_the_request(predictions):
+    queue = RegenerationQueue(predictions.cancel, debounce=0)
+
+    def start():
+        raise RuntimeError("queue full")
+
+    request = queue.submit(KEY, start)
+    with pytest.raises(RuntimeError):
+        request.future.result(TIMEOUT)
+    queue.forget(KEY, request)
+    assert queue.pending(KEY) is None
@@ -0,0 +1,170 @@
+"""Generation worker pool backed by the shared job store.
+
+    python worker.py submit storyboard.json --project my_video
+    python worker.py work --processes 4 --concurrency 8
+    python worker.py status my_video
+
+Workers can run on several machines as long as they open the same
+database file (FLOWLY_JOB_STORE or --store) on a shared filesystem.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import time
+
+from dotenv import load_dotenv
+
+from generation import _generate_image, _generate_video, _generate_sound
+from job_store import DEFAULT_STORE_PATH, DEFAULT_LEASE_SECONDS, JobStore
+
+POLL_INTERVAL = 2.0
+
+async def run_stage(job):
+    """Run the prediction for one claimed job on the model the claim picked and return its result"""
+    prompt = job["payload"]["prompt"]
+    # No failover within the job: the store rate-limited this model, so a retry picks the next one
+    routing = {"models": [job["model"]]}
+    if job["stage"] == "image":
+        url = await _generate_image(prompt, routing=routing)
+    elif job["stage"] == "video":
+        url = await _generate_video(prompt, job["parent_result"]["url"], routing=routing)
+    elif job["stage"] == "sound":
+        url = await _generate_sound(job["parent_result"]["url"], prompt, routing=routing)
+    else:
+        raise ValueError(f"Unknown stage: {job['stage']}")
+    return {"url": url}
+
+async def process_job(store, job, worker_id):
+    """Run a job while heartbeating its lease; abandon it if the lease is lost"""
+    stage_task = asyncio.create_task(run_stage(job))
+    interval = max(store.lease_seconds / 3, 1)
+    while True:
+        done, _ = await asyncio.wait({stage_task}, timeout=interval)
+        if done:
+            break
+        if not await asyncio.to_thread(store.heartbeat, job["id"], worker_id):
+            print(f"[{worker_id}] lost lease on {job['stage']} for scene {job['scene_index'] + 1}, abandoning")
+            stage_task.cancel()
+            return
+    try:
+        result = stage_task.result()
+    except Exception as e:
+        print(f"[{worker_id}] {job['stage']} for scene {job['scene_index'] + 1} failed: {e}")
+        await asyncio.to_thread(store.fail, job["id"], worker_id, str(e))
+        return
+    await asyncio.to_thread(store.complete, job["id"], worker_id, result)
+    print(f"[{worker_id}] {job['stage']} for scene {job['scene_index'] + 1} done: {result['url']}")
+
+async def worker_slot(store, worker_id, stop_when_idle):
+    """Claim and process jobs one at a time until the queue drains (or forever)"""
+    while True:
+        job = await asyncio.to_thread(store.claim, worker_id)
+        if job is None:
+            if stop_when_idle and not await asyncio.to_thread(store.has_unfinished):
+                return
+            await asyncio.sleep(POLL_INTERVAL)
+            continue
+        await process_job(store, job, worker_id)
+
+async def run_worker(store_path, lease_seconds, concurrency, stop_when_idle):
+    """Run several job slots on one event loop, each with its own store connection"""
+    process_id = f"{socket.gethostname()}-{os.getpid()}"
+    stores = [JobStore(store_path, lease_seconds=lease_seconds) for _ in range(concurrency)]
+    try:
+        async with asyncio.TaskGroup() as tg:
+            for slot, store in enumerate(stores):
+                tg.create_task(worker_slot(store, f"{process_id}-{slot}", stop_when_idle))
+    finally:
+        for store in stores:
+            store.close()
+
+def worker_process(store_path, lease_seconds, concurrency, stop_when_idle):
+    """Entry point of each worker process"""
+    load_dotenv()
+    try:
+        asyncio.run(run_worker(store_path, lease_seconds, concurrency, stop_when_idle))
+    except KeyboardInterrupt:
+        pass
+
+def start_pool(store_path, processes, concurrency, lease_seconds=DEFAULT_LEASE_SECONDS, stop_when_idle=False):
+    """Start worker processes and wait for them to exit"""
+    workers = [
+        multiprocessing.Process(
+            target=worker_process,
+            args=(store_path, lease_seconds, concurrency, stop_when_idle),
+            daemon=True
+        )
+        for _ in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        print("Stopping workers...")
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.join()
+
+def submit(store_path, storyboard_file, project):
+    """Queue all scenes of a storyboard.json file"""
+    with open(storyboard_file) as f:
+        storyboard = json.load(f)
+    project = project or time.strftime("project_%Y%m%d_%H%M%S")
+    store = JobStore(store_path)
+    try:
+        store.enqueue_storyboard(project, storyboard["scenes"])
+    finally:
+        store.close()
+    print(f"Queued {len(storyboard['scenes'])} scenes as project '{project}'")
+    return project
+
+def print_status(store_path, project):
+    """Print the state of every stage of a project"""
+    store = JobStore(store_path)
+    try:
+        for job in store.project_status(project):
+            line = f"Scene {job['scene_index'] + 1} {job['stage']:<5} {job['status']:<7} attempts={job['attempts']}"
+            if job["result"]:
+                line += f" {job['result']['url']}"
+            if job["error"] and job["status"] != "done":
+                line += f" ({job['error']})"
+            print(line)
+    finally:
+        store.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared generation worker pool")
+    parser.add_argument("--store", default=DEFAULT_STORE_PATH, help="Path of the shared job database")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    submit_parser = subparsers.add_parser("submit", help="Queue a storyboard.json for generation")
+    submit_parser.add_argument("storyboard")
+    submit_parser.add_argument("--project", help="Project name (defaults to a timestamp)")
+
+    work_parser = subparsers.add_parser("work", help="Run worker processes")
+    work_parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    work_parser.add_argument("--concurrency", type=int, default=4, help="Jobs in flight per process")
+    work_parser.add_argument("--lease", type=int, default=DEFAULT_LEASE_SECONDS, help="Lease length in seconds")
+    work_parser.add_argument("--exit-when-idle", action="store_true", help="Stop once no jobs are left")
+
+    status_parser = subparsers.add_parser("status", help="Show the jobs of a project")
+    status_parser.add_argument("project")
+
+    args = parser.parse_args()
+    load_dotenv()
+
+    if args.command == "submit":
+        submit(args.store, args.storyboard, args.project)
+    elif args.command == "work":
+        start_pool(args.store, args.processes, args.concurrency, args.lease, args.exit_when_idle)
+    elif args.command == "status":
+        print_status(args.store, args.project)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""Streaming zip download of a saved project.
+
+The archive (storyboard.json, prompts, manifest and every image, video and
+sound, exports included) is written entry by entry straight into the HTTP
+response with chunked transfer encoding. Media that is already compressed is
+stored as is, text is deflated, and files are read 1 MB at a time, so the
+server holds one chunk of a multi-GB project in memory, never the archive.
+
+Streamlit's download button keeps its whole payload in memory, so the app
+serves downloads from a small threaded HTTP server next to it (port 8502 by
+default, FLOWLY_EXPORT_PORT). Each project gets an unguessable download link
+that stays valid for a day; set FLOWLY_EXPORT_URL to the public address of
+that server when it sits behind a proxy.
+
+    python zip_export.py final_videos/project_YYYYMMDD_HHMMSS -o project.zip
+"""
+import argparse
+import logging
+import os
+import secrets
+import sys
+import threading
+import time
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote
+
+import metrics
+
+EXPORT_HOST = os.getenv("FLOWLY_EXPORT_HOST", "0.0.0.0")
+EXPORT_PORT = int(os.getenv("FLOWLY_EXPORT_PORT", "8502"))
+EXPORT_URL = os.getenv("FLOWLY_EXPORT_URL", "")
+
+CHUNK_SIZE = 1 << 20
+# Seconds a download link stays valid after it was last handed out
+LINK_TTL = 24 * 3600
+# Deflating these gains nothing and costs CPU on every download
+STORED_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp", ".gif", ".mp4", ".mov", ".webm", ".mp3", ".m4a", ".aac", ".zip"}
+
+logger = logging.getLogger("flowly.zip_export")
+
+def archive_entries(project_dir):
+    """(path, name in the archive) of every file of a project, metadata first"""
+    name = os.path.basename(os.path.normpath(project_dir))
+    entries = []
+    for directory, dirnames, filenames in os.walk(project_dir):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            # Downloads and relinks still in progress
+            if ".partial" in filename or filename.endswith(".link"):
+                continue
+            path = os.path.join(directory, filename)
+            entries.append((path, f"{name}/{os.path.relpath(path, project_dir).replace(os.sep, '/')}"))
+    # storyboard.json and the prompts come before the media, so a cut-off download still has them
+    entries.sort(key=lambda entry: os.path.splitext(entry[0])[1].lower() in STORED_EXTENSIONS)
+    return entries
+
+def write_zip(project_dir, out):
+    """Write a project as a zip to a file object, which need not be seekable; returns the number of files"""
+    entries = archive_entries(project_dir)
+    with zipfile.ZipFile(out, "w", allowZip64=True, strict_timestamps=False) as archive:
+        for path, arcname in entries:
+            info = zipfile.ZipInfo.from_file(path, arcname, strict_timestamps=False)
+            stored = os.path.splitext(path)[1].lower() in STORED_EXTENSIONS
+            info.compress_type = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+            with open(path, "rb") as src, archive.open(info, "w") as dst:
+                for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+                    dst.write(chunk)
+    return len(entries)
+
+class ChunkedWriter:
+    """Write-only file object that sends HTTP/1.1 chunks of about CHUNK_SIZE bytes"""
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self.buffer = bytearray()
+        self.sent = 0
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= CHUNK_SIZE:
+            self._send()
+        return len(data)
+
+    def _send(self):
+        if self.buffer:
+            self.wfile.write(b"%x\r\n" % len(self.buffer) + self.buffer + b"\r\n")
+            self.sent += len(self.buffer)
+            self.buffer = bytearray()
+
+    def flush(self):
+        self._send()
+        self.wfile.flush()
+
+    def close(self):
+        self.flush()
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+_links = {}
+_links_lock = threading.Lock()
+
+def register(project_dir):
+    """Download token of a project directory, reused while it is valid"""
+    project_dir = os.path.abspath(project_dir)
+    now = time.time()
+    with _links_lock:
+        for token, (directory, expires) in list(_links.items()):
+            if expires < now:
+                del _links[token]
+            elif directory == project_dir:
+                _links[token] = (directory, now + LINK_TTL)
+                return token
+        token = secrets.token_urlsafe(16)
+        _links[token] = (project_dir, now + LINK_TTL)
+        return token
+
+def resolve(token):
+    """Project directory of a valid token, or None"""
+    with _links_lock:
+        entry = _links.get(token)
+    if entry is None or entry[1] < time.time() or not os.path.isdir(entry[0]):
+        return None
+    return entry[0]
+
+class ExportHandler(BaseHTTPRequestHandler):
+    """GET /export/<token>/<name>.zip"""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        parts = self.path.split("?")[0].strip("/").split("/")
+        project_dir = resolve(parts[1]) if len(parts) == 3 and parts[0] == "export" else None
+        if project_dir is None:
+            self.send_error(404, "Unknown or expired download link")
+            return
+        name = os.path.basename(project_dir)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/zip")
+        self.send_header("Content-Disposition", f"attachment; filename=\"{name}.zip\"")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        started = time.time()
+        out = ChunkedWriter(self.wfile)
+        try:
+            files = write_zip(project_dir, out)
+            out.close()
+        except (BrokenPipeError, ConnectionResetError):
+            # The user cancelled the download
+            metrics.record("zip_export", project=name, ok=False, bytes=out.sent, latency=round(time.time() - started, 3))
+            return
+        metrics.record("zip_export", project=name, ok=True, files=files, bytes=out.sent,
+                       latency=round(time.time() - started, 3))
+
+    def log_message(self, format, *args):
+        logger.info("%s %s", self.address_string(), format % args)
+
+_server = None
+_server_lock = threading.Lock()
+
+def start_server(host=EXPORT_HOST, port=EXPORT_PORT):
+    """Serve downloads from a background thread; one server per process"""
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), ExportHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="flowly-zip-export", daemon=True).start()
+        return _server
+
+def download_url(project_dir, host="localhost"):
+    """Link that streams a project as a zip; host is the address the user reached the app on"""
+    server = start_server()
+    token = register(project_dir)
+    name = quote(os.path.basename(os.path.abspath(project_dir)))
+    base = EXPORT_URL.rstrip("/") if EXPORT_URL else f"http://{host}:{server.server_address[1]}"
+    return f"{base}/export/{token}/{name}.zip"
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a saved project as a zip")
+    parser.add_argument("project_dir")
+    parser.add_argument("-o", "--output", help="Zip file to write (default: standard output)")
+    args = parser.parse_args()
+    if args.output:
+        with open(args.output, "wb") as out:
+            files = write_zip(args.project_dir, out)
+    else:
+        files = write_zip(args.project_dir, sys.stdout.buffer)
+    print(f"{files} files", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()